@@ -1,10 +1,15 @@
 import os
-import json
+import time
+import inspect
 import logging
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, g, request
 from flask_restx import Api, Resource, fields
+from werkzeug.wsgi import ClosingIterator
 from functools import wraps
 from cloud_operations import CloudOperations
+from utils.metrics import REQUEST_SECONDS
+from utils.config import load_config, config_flag
+from utils import timing
 
 app = Flask(__name__)
 api = Api(app, version='1.0', title='Cloud Operations API',
@@ -15,31 +20,133 @@ api = Api(app, version='1.0', title='Cloud Operations API',
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Load configuration
-with open('.env.json') as config_file:
-    config = json.load(config_file)
+# Load configuration, shared with CloudOperations
+config = load_config()
 
 API_KEY = config.get('API_KEY')
 
+# Authenticated requests carrying PROFILE_HEADER are sampled by a profiler
+# when PROFILING_ENABLED is set; the hottest stacks go to the timing log
+PROFILE_HEADER = 'X-Devi-Profile'
+PROFILING_ENABLED = config_flag(config, 'PROFILING_ENABLED')
+PROFILING_INTERVAL = float(config.get('PROFILING_INTERVAL_SECONDS', 0.005))
+PROFILING_TOP_STACKS = int(config.get('PROFILING_TOP_STACKS', 20))
+
+def wants_profile(headers):
+    return PROFILING_ENABLED and bool(headers.get(PROFILE_HEADER)) and headers.get('Authorization') == API_KEY
+
 def require_api_key(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
         if 'Authorization' not in request.headers:
-            return jsonify({'status': 'fail', 'message': 'API key is missing'}), 401
+            return {'status': 'fail', 'message': 'API key is missing'}, 401
         api_key = request.headers['Authorization']
         if api_key != API_KEY:
-            return jsonify({'status': 'fail', 'message': 'Invalid API key'}), 403
+            return {'status': 'fail', 'message': 'Invalid API key'}, 403
         return f(*args, **kwargs)
     return decorated_function
 
+def api_response(response, status):
+    # File responses built by CloudOperations are returned as they are,
+    # dicts are serialized by flask-restx
+    if isinstance(response, Response):
+        return response
+    return response, status
+
 cloud_ops = CloudOperations()
 
+@app.before_request
+def start_timer():
+    g.request_started = time.perf_counter()
+    endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    g.timeline = timing.start(endpoint, method=request.method)
+    if wants_profile(request.headers):
+        g.profiler = timing.SamplingProfiler(interval=PROFILING_INTERVAL).start()
+
+@app.after_request
+def record_request(response):
+    # Streamed bodies are timed until the response starts, not until the
+    # last byte is sent
+    started = g.pop('request_started', None)
+    if started is not None:
+        endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint,
+                                method=request.method, status=response.status_code)
+
+    timeline = g.pop('timeline', None)
+    if timeline is not None:
+        response.headers['Server-Timing'] = timeline.server_timing()
+        profiler = g.pop('profiler', None)
+        status = response.status_code
+
+        def log_timeline():
+            extra = {'status': status}
+            if profiler is not None:
+                extra['profile'] = profiler.stop().top(PROFILING_TOP_STACKS)
+            timing.log(timeline, **extra)
+            timing.stop()
+
+        if inspect.isgenerator(response.response):
+            # Streamed bodies are logged once the server closes them, so the
+            # log line has the spans the header was sent without
+            response.response = ClosingIterator(response.response, log_timeline)
+        else:
+            log_timeline()
+    return response
+
 upload_model = api.model('UploadModel', {
     'files': fields.List(fields.Raw, required=True, description='List of files to be uploaded')
 })
 
 delete_files_model = api.model('DeleteFilesModel', {
-    'file_names': fields.List(fields.String, required=True, description='List of file names to be deleted')
+    'file_names': fields.List(fields.String, description='List of file names to be deleted'),
+    'prefix': fields.String(description='Delete every file under this prefix instead')
+})
+
+download_zip_model = api.model('DownloadZipModel', {
+    'file_names': fields.List(fields.String, description='List of file names to put in the archive'),
+    'prefix': fields.String(description='Archive every file under this prefix instead'),
+    'archive_name': fields.String(description='File name of the archive')
+})
+
+copy_file_model = api.model('CopyFileModel', {
+    'source': fields.String(required=True, description='File to copy'),
+    'destination': fields.String(required=True, description='Name of the copy')
+})
+
+rename_file_model = api.model('RenameFileModel', {
+    'file_name': fields.String(required=True, description='File to rename'),
+    'new_name': fields.String(required=True, description='New name in the same folder')
+})
+
+copy_files_model = api.model('CopyFilesModel', {
+    'items': fields.List(fields.Nested(copy_file_model), description='Source and destination pairs'),
+    'prefix': fields.String(description='Copy every file under this prefix instead'),
+    'destination_prefix': fields.String(description='Prefix that replaces prefix in the copies')
+})
+
+transcribe_batch_model = api.model('TranscribeBatchModel', {
+    'urls': fields.List(fields.String, description='YouTube URLs to transcribe'),
+    'playlist_url': fields.String(description='Transcribe every video of this playlist instead'),
+    'language': fields.String(description='Language of the audio')
+})
+
+multipart_upload_model = api.model('MultipartUploadModel', {
+    'file_name': fields.String(required=True, description='Name of the file to upload'),
+    'size': fields.Integer(description='File size in bytes, presigns every part when given'),
+    'content_type': fields.String(description='Content type of the file'),
+    'expires_in': fields.Integer(description='Lifetime of the part URLs in seconds')
+})
+
+upload_part_model = api.model('UploadPartModel', {
+    'part_number': fields.Integer(required=True),
+    'etag': fields.String(required=True, description='ETag returned by S3 for the part')
+})
+
+complete_multipart_upload_model = api.model('CompleteMultipartUploadModel', {
+    'file_name': fields.String(required=True),
+    'upload_id': fields.String(required=True),
+    'parts': fields.List(fields.Nested(upload_part_model), required=True)
 })
 
 @api.route('/uploadToCloud')
@@ -48,35 +155,78 @@ class UploadToCloud(Resource):
     @require_api_key
     def post(self):
         response, status = cloud_ops.upload_to_cloud(request)
-        return jsonify(response), status
+        return api_response(response, status)
 
 @api.route('/downloadFromCloud')
 class DownloadFromCloud(Resource):
     @require_api_key
     def get(self):
         response, status = cloud_ops.download_from_cloud(request)
-        return jsonify(response), status
+        return api_response(response, status)
+
+@api.route('/downloadZip')
+class DownloadZip(Resource):
+    @api.expect(download_zip_model)
+    @require_api_key
+    def post(self):
+        response, status = cloud_ops.download_zip(request)
+        return api_response(response, status)
 
 @api.route('/listFiles')
 class ListFiles(Resource):
     @require_api_key
     def get(self):
-        response, status = cloud_ops.list_files()
-        return jsonify(response), status
+        response, status = cloud_ops.list_files(request)
+        return api_response(response, status)
+
+@api.route('/cacheStats')
+class CacheStats(Resource):
+    @require_api_key
+    def get(self):
+        response, status = cloud_ops.cache_stats()
+        return api_response(response, status)
+
+@api.route('/dedupStats')
+class DedupStats(Resource):
+    @require_api_key
+    def get(self):
+        response, status = cloud_ops.dedup_stats()
+        return api_response(response, status)
+
+@api.route('/fileInfo')
+class FileInfo(Resource):
+    @require_api_key
+    def get(self):
+        response, status = cloud_ops.file_info(request)
+        return api_response(response, status)
+
+@api.route('/clientStats')
+class ClientStats(Resource):
+    @require_api_key
+    def get(self):
+        response, status = cloud_ops.client_stats()
+        return api_response(response, status)
+
+@api.route('/metrics')
+class Metrics(Resource):
+    @require_api_key
+    def get(self):
+        response, status = cloud_ops.metrics()
+        return api_response(response, status)
 
 @api.route('/viewFile')
 class ViewFile(Resource):
     @require_api_key
     def get(self):
         response, status = cloud_ops.view_file(request)
-        return send_file(response), status
+        return api_response(response, status)
 
 @api.route('/deleteFile')
 class DeleteFile(Resource):
     @require_api_key
     def delete(self):
         response, status = cloud_ops.delete_file(request)
-        return jsonify(response), status
+        return api_response(response, status)
 
 @api.route('/deleteFiles')
 class DeleteFiles(Resource):
@@ -84,14 +234,151 @@ class DeleteFiles(Resource):
     @require_api_key
     def delete(self):
         response, status = cloud_ops.delete_files(request)
-        return jsonify(response), status
+        return api_response(response, status)
+
+@api.route('/copyFile')
+class CopyFile(Resource):
+    @api.expect(copy_file_model)
+    @require_api_key
+    def post(self):
+        response, status = cloud_ops.copy_file(request)
+        return api_response(response, status)
+
+@api.route('/moveFile')
+class MoveFile(Resource):
+    @api.expect(copy_file_model)
+    @require_api_key
+    def post(self):
+        response, status = cloud_ops.move_file(request)
+        return api_response(response, status)
+
+@api.route('/renameFile')
+class RenameFile(Resource):
+    @api.expect(rename_file_model)
+    @require_api_key
+    def post(self):
+        response, status = cloud_ops.rename_file(request)
+        return api_response(response, status)
+
+@api.route('/copyFiles')
+class CopyFiles(Resource):
+    @api.expect(copy_files_model)
+    @require_api_key
+    def post(self):
+        response, status = cloud_ops.copy_files(request)
+        return api_response(response, status)
+
+@api.route('/moveFiles')
+class MoveFiles(Resource):
+    @api.expect(copy_files_model)
+    @require_api_key
+    def post(self):
+        response, status = cloud_ops.copy_files(request, move=True)
+        return api_response(response, status)
+
+@api.route('/presignedUrl')
+class PresignedUrl(Resource):
+    @require_api_key
+    def get(self):
+        response, status = cloud_ops.presigned_url(request)
+        return api_response(response, status)
+
+@api.route('/multipartUploads')
+class MultipartUploads(Resource):
+    @api.expect(multipart_upload_model)
+    @require_api_key
+    def post(self):
+        response, status = cloud_ops.create_multipart_upload(request)
+        return api_response(response, status)
+
+    @require_api_key
+    def delete(self):
+        response, status = cloud_ops.abort_multipart_upload(request)
+        return api_response(response, status)
+
+@api.route('/multipartUploads/parts')
+class MultipartUploadParts(Resource):
+    @require_api_key
+    def post(self):
+        response, status = cloud_ops.presign_upload_parts(request)
+        return api_response(response, status)
+
+@api.route('/multipartUploads/complete')
+class CompleteMultipartUpload(Resource):
+    @api.expect(complete_multipart_upload_model)
+    @require_api_key
+    def post(self):
+        response, status = cloud_ops.complete_multipart_upload(request)
+        return api_response(response, status)
+
+upload_session_model = api.model('UploadSessionModel', {
+    'file_name': fields.String(required=True, description='Name of the file to upload'),
+    'size': fields.Integer(description='File size in bytes, fixes the number and size of the chunks. Without it, the last chunk is sent with final=true'),
+    'content_type': fields.String(description='Content type of the file')
+})
+
+@api.route('/uploadSessions')
+class UploadSessions(Resource):
+    @api.expect(upload_session_model)
+    @require_api_key
+    def post(self):
+        response, status = cloud_ops.create_upload_session(request)
+        return api_response(response, status)
+
+@api.route('/uploadSessions/<string:session_id>')
+class UploadSession(Resource):
+    @require_api_key
+    def get(self, session_id):
+        response, status = cloud_ops.upload_session_status(session_id)
+        return api_response(response, status)
+
+    @require_api_key
+    def delete(self, session_id):
+        response, status = cloud_ops.abort_upload_session(session_id)
+        return api_response(response, status)
+
+@api.route('/uploadSessions/<string:session_id>/chunks/<int:part_number>')
+class UploadSessionChunk(Resource):
+    @require_api_key
+    def put(self, session_id, part_number):
+        response, status = cloud_ops.upload_session_chunk(request, session_id, part_number)
+        return api_response(response, status)
+
+@api.route('/uploadSessions/<string:session_id>/complete')
+class CompleteUploadSession(Resource):
+    @require_api_key
+    def post(self, session_id):
+        response, status = cloud_ops.complete_upload_session(session_id)
+        return api_response(response, status)
 
 @api.route('/transcribeYTUrl')
 class TranscribeYTUrl(Resource):
     @require_api_key
     def post(self):
         response, status = cloud_ops.transcribe_yt_url(request)
-        return jsonify(response), status
+        return api_response(response, status)
+
+@api.route('/transcribeBatch')
+class TranscribeBatch(Resource):
+    @api.expect(transcribe_batch_model)
+    @require_api_key
+    def post(self):
+        response, status = cloud_ops.transcribe_batch(request)
+        return api_response(response, status)
+
+@api.route('/jobs/stats')
+class JobStats(Resource):
+    @require_api_key
+    def get(self):
+        response, status = cloud_ops.job_stats()
+        return api_response(response, status)
+
+@api.route('/jobs/<string:job_id>')
+class JobStatus(Resource):
+    @require_api_key
+    def get(self, job_id):
+        response, status = cloud_ops.job_status(job_id)
+        return api_response(response, status)
     
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1,117 @@
+"""ASGI entry point, for example: hypercorn asgi:application
+
+Uploads, downloads, views, listings and deletes are served by Quart on
+AsyncCloudOperations, so slow clients hold a coroutine instead of a
+thread. Every other route is passed to the Flask app in app.py.
+"""
+import time
+import logging
+from functools import wraps
+from quart import Quart, g, request
+from asgiref.wsgi import WsgiToAsgi
+
+from app import app as wsgi_app, cloud_ops, config, API_KEY, PROFILING_INTERVAL, PROFILING_TOP_STACKS, wants_profile
+from async_cloud_operations import AsyncCloudOperations
+from utils.metrics import REQUEST_SECONDS
+from utils import timing
+
+logger = logging.getLogger(__name__)
+
+async_app = Quart(__name__)
+# Transfers may take as long as the client needs
+async_app.config.update(MAX_CONTENT_LENGTH=None, BODY_TIMEOUT=None, RESPONSE_TIMEOUT=None)
+
+async_cloud_ops = AsyncCloudOperations(cloud_ops, config)
+
+
+def require_api_key(f):
+    @wraps(f)
+    async def decorated_function(*args, **kwargs):
+        if 'Authorization' not in request.headers:
+            return {'status': 'fail', 'message': 'API key is missing'}, 401
+        api_key = request.headers['Authorization']
+        if api_key != API_KEY:
+            return {'status': 'fail', 'message': 'Invalid API key'}, 403
+        return await f(*args, **kwargs)
+    return decorated_function
+
+
+@async_app.before_serving
+async def start_client():
+    await async_cloud_ops.start()
+
+@async_app.after_serving
+async def close_client():
+    await async_cloud_ops.close()
+
+@async_app.before_request
+async def start_timer():
+    g.request_started = time.perf_counter()
+    endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    g.timeline = timing.start(endpoint, method=request.method)
+    if wants_profile(request.headers):
+        # Samples the event loop thread, so concurrent requests show up too
+        g.profiler = timing.SamplingProfiler(interval=PROFILING_INTERVAL).start()
+
+@async_app.after_request
+async def record_request(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint,
+                                method=request.method, status=response.status_code)
+
+    timeline = g.pop('timeline', None)
+    if timeline is not None:
+        # Logged when the response starts; streamed bodies are not included
+        response.headers['Server-Timing'] = timeline.server_timing()
+        extra = {'status': response.status_code}
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            extra['profile'] = profiler.stop().top(PROFILING_TOP_STACKS)
+        timing.log(timeline, **extra)
+        timing.stop()
+    return response
+
+
+@async_app.route('/uploadToCloud', methods=['POST'])
+@require_api_key
+async def upload_to_cloud():
+    return await async_cloud_ops.upload_to_cloud(request)
+
+@async_app.route('/downloadFromCloud', methods=['GET'])
+@require_api_key
+async def download_from_cloud():
+    return await async_cloud_ops.download_from_cloud(request)
+
+@async_app.route('/viewFile', methods=['GET'])
+@require_api_key
+async def view_file():
+    return await async_cloud_ops.view_file(request)
+
+@async_app.route('/listFiles', methods=['GET'])
+@require_api_key
+async def list_files():
+    return await async_cloud_ops.list_files(request)
+
+@async_app.route('/deleteFile', methods=['DELETE'])
+@require_api_key
+async def delete_file():
+    return await async_cloud_ops.delete_file(request)
+
+@async_app.route('/deleteFiles', methods=['DELETE'])
+@require_api_key
+async def delete_files():
+    return await async_cloud_ops.delete_files(request)
+
+
+ASYNC_PATHS = {str(rule) for rule in async_app.url_map.iter_rules() if rule.endpoint != 'static'}
+
+flask_app = WsgiToAsgi(wsgi_app)
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan' or scope.get('path') in ASYNC_PATHS:
+        await async_app(scope, receive, send)
+    else:
+        await flask_app(scope, receive, send)
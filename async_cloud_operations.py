@@ -0,0 +1,561 @@
+import json
+import time
+import asyncio
+import logging
+import mimetypes
+from contextlib import AsyncExitStack
+from quart import Response, send_file
+from aiobotocore.session import get_session
+from aiobotocore.config import AioConfig
+from botocore.exceptions import NoCredentialsError, ClientError, BotoCoreError
+
+from cloud_operations import MAX_LIST_KEYS, MAX_DELETE_KEYS, MAX_PENDING_DELETE_BATCHES, is_not_found, stream_size
+from utils.compression import decompressobj
+from utils.config import config_flag
+from utils.dedup import DIGEST_METADATA, hash_stream
+from utils.metrics import TRANSFER_BYTES, TRANSFERS_IN_FLIGHT, S3_OPERATION_SECONDS, S3_ERRORS
+
+logger = logging.getLogger(__name__)
+
+
+class ObjectStream(object):
+    """Async iterator over the chunks of an S3 body that always releases it.
+
+    Quart closes the iterator of a response, but an async generator closed
+    before its first chunk never runs its finally block. The body and the
+    cache writer are released here instead, however far the stream got,
+    and also when the stream is dropped without being closed.
+    """
+
+    def __init__(self, chunks, body, cache_writer=None):
+        self._chunks = chunks
+        self._body = body
+        self._cache_writer = cache_writer
+        self._closed = False
+        self.completed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self._chunks.__anext__()
+        except StopAsyncIteration:
+            self.completed = True
+            await self.aclose()
+            raise
+
+    async def aclose(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            await self._chunks.aclose()
+        finally:
+            self._body.close()
+            if self._cache_writer is not None:
+                if self.completed:
+                    await asyncio.to_thread(self._cache_writer.commit)
+                else:
+                    self._cache_writer.discard()
+
+    def __del__(self):
+        if not self._closed:
+            self._closed = True
+            self._body.close()
+            if self._cache_writer is not None:
+                self._cache_writer.discard()
+
+
+class BodyReader(object):
+    """read(size) over an async iterable of byte chunks, like a request body."""
+
+    def __init__(self, chunks):
+        self._chunks = chunks.__aiter__()
+        self._buffer = bytearray()
+        self._done = False
+
+    async def read(self, size):
+        while len(self._buffer) < size and not self._done:
+            try:
+                self._buffer.extend(await self._chunks.__anext__())
+            except StopAsyncIteration:
+                self._done = True
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+
+class AsyncCloudOperations(object):
+    """Non-blocking upload, download, listing and delete endpoints.
+
+    Shares its bucket, transfer planner, object cache and metadata index
+    with the synchronous CloudOperations it wraps. S3 is called through
+    aiobotocore and file I/O is handed to threads, so a slow client holds a
+    coroutine instead of a thread. start() must be awaited before serving.
+    """
+
+    def __init__(self, cloud_ops, config):
+        self.cloud_ops = cloud_ops
+        self.space_name = cloud_ops.space_name
+        self.config = config
+        self.client = None
+        self._exit_stack = None
+
+    async def start(self):
+        session = get_session()
+        self._exit_stack = AsyncExitStack()
+        self.client = await self._exit_stack.enter_async_context(session.create_client(
+            's3',
+            region_name=self.config.get('AWS_DEFAULT_REGION'),
+            aws_access_key_id=self.config.get('AWS_ACCESS_KEY_ID'),
+            aws_secret_access_key=self.config.get('AWS_SECRET_ACCESS_KEY'),
+            endpoint_url=self.config.get('S3_ENDPOINT_URL'),
+            config=AioConfig(
+                max_pool_connections=int(self.config.get('S3_MAX_POOL_CONNECTIONS', 50)),
+                tcp_keepalive=config_flag(self.config, 'S3_TCP_KEEPALIVE', True),
+                retries={'mode': self.config.get('S3_RETRY_MODE', 'standard'),
+                         'max_attempts': int(self.config.get('S3_MAX_ATTEMPTS', 5))}
+            )
+        ))
+        self.client.meta.events.register('before-call.s3', self._before_call)
+        self.client.meta.events.register('after-call.s3', self._after_call)
+        self.client.meta.events.register('after-call-error.s3', self._after_call)
+
+    async def close(self):
+        if self._exit_stack is not None:
+            await self._exit_stack.aclose()
+            self._exit_stack = None
+            self.client = None
+
+    def _before_call(self, context, **kwargs):
+        # Calls interleave on one thread, so the start time is kept in the
+        # per-call context instead of a thread-local
+        context['devi_started'] = time.monotonic()
+
+    def _after_call(self, context, model=None, http_response=None, parsed=None, exception=None, **kwargs):
+        started = context.pop('devi_started', None)
+        if started is None:
+            return
+        operation = model.name if model is not None else 'unknown'
+        S3_OPERATION_SECONDS.observe(time.monotonic() - started, operation=operation)
+        if exception is not None:
+            S3_ERRORS.inc(operation=operation, code=type(exception).__name__)
+        elif http_response is not None and http_response.status_code >= 300:
+            code = (parsed or {}).get('Error', {}).get('Code') or str(http_response.status_code)
+            S3_ERRORS.inc(operation=operation, code=code)
+
+    async def _upload_stream(self, read, file_name, size=None, hashed=None):
+        # read(n) returns up to n bytes and b'' at the end. Objects above
+        # the multipart threshold are sent in parts, at most max_concurrency
+        # of them in flight, so memory stays bounded by the part size.
+        # hashed is the (digest, size) of the content when deduplicating.
+        planner = self.cloud_ops.transfer_planner
+        mime_type, _ = mimetypes.guess_type(file_name)
+        extra_args = {'ContentType': mime_type} if mime_type else {}
+        if hashed is not None:
+            extra_args['Metadata'] = {DIGEST_METADATA: hashed[0]}
+        if self.cloud_ops._upload_encoding(mime_type, size, extra_args) is not None:
+            read = self.cloud_ops.compression.async_reader(read).read
+            # The compressed size is only known at the end
+            size = None
+        TRANSFERS_IN_FLIGHT.inc(direction='upload')
+        try:
+            if hashed is not None and await asyncio.to_thread(
+                    self.cloud_ops._copy_duplicate, file_name, *hashed, mime_type):
+                return None
+            with planner.transfer(size):
+                part_size = planner.part_size(size)
+                single = size is not None and size <= planner.multipart_threshold
+                first = await read(size if single else part_size)
+                if single or len(first) < part_size:
+                    await self.client.put_object(Bucket=self.space_name, Key=file_name, Body=first, **extra_args)
+                    TRANSFER_BYTES.inc(len(first), direction='upload')
+                else:
+                    await self._upload_parts(read, file_name, first, part_size, planner.max_concurrency, extra_args)
+            await asyncio.to_thread(self.cloud_ops._record_upload, file_name)
+            if hashed is not None:
+                await asyncio.to_thread(self.cloud_ops._record_digest, file_name, hashed, None)
+            logger.info(f'Uploaded file {file_name} to cloud')
+            return None
+        except NoCredentialsError:
+            logger.error('Credentials not available')
+            return {'status': 'fail', 'message': 'Credentials not available'}, 403
+        except ClientError as e:
+            logger.error(f'Client error: {str(e)}')
+            return {'status': 'fail', 'message': str(e)}, 500
+        except BotoCoreError as e:
+            # The upload never got an answer from S3
+            logger.error(f'Could not upload {file_name}: {str(e)}')
+            return {'status': 'fail', 'message': str(e)}, 500
+        finally:
+            TRANSFERS_IN_FLIGHT.dec(direction='upload')
+
+    async def _upload_parts(self, read, file_name, first, part_size, max_concurrency, extra_args):
+        upload_id = (await self.client.create_multipart_upload(
+            Bucket=self.space_name, Key=file_name, **extra_args))['UploadId']
+        slots = asyncio.Semaphore(max_concurrency)
+
+        async def upload_part(part_number, chunk):
+            try:
+                response = await self.client.upload_part(
+                    Bucket=self.space_name, Key=file_name, UploadId=upload_id,
+                    PartNumber=part_number, Body=chunk)
+                TRANSFER_BYTES.inc(len(chunk), direction='upload')
+                return {'PartNumber': part_number, 'ETag': response['ETag']}
+            finally:
+                slots.release()
+
+        tasks = []
+        try:
+            chunk = first
+            while chunk:
+                await slots.acquire()
+                tasks.append(asyncio.ensure_future(upload_part(len(tasks) + 1, chunk)))
+                chunk = await read(part_size)
+            parts = await asyncio.gather(*tasks)
+            await self.client.complete_multipart_upload(
+                Bucket=self.space_name, Key=file_name, UploadId=upload_id,
+                MultipartUpload={'Parts': list(parts)})
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            try:
+                await self.client.abort_multipart_upload(
+                    Bucket=self.space_name, Key=file_name, UploadId=upload_id)
+            except ClientError as e:
+                logger.error(f'Could not abort the upload of {file_name}: {str(e)}')
+            raise
+
+    async def upload_to_cloud(self, request):
+        try:
+            file_name = request.args.get('file_name')
+            if file_name and request.mimetype != 'multipart/form-data':
+                # Raw upload mode: the request body itself is the file content
+                error = await self._upload_stream(
+                    BodyReader(request.body).read, file_name, request.content_length)
+                if error is not None:
+                    return error
+                return {'status': 'success', 'uploaded_files': [file_name]}, 200
+
+            files = (await request.files).getlist('files')
+            if not files:
+                logger.error('No files part in the request')
+                return {'status': 'fail', 'message': 'No files part in the request'}, 400
+
+            errors = await asyncio.gather(*(self._upload_file(file) for file in files))
+            return self.cloud_ops._upload_response([file.filename for file in files], errors)
+
+        except Exception as e:
+            logger.error(f'Exception: {str(e)}')
+            return {'status': 'fail', 'message': str(e)}, 500
+
+    async def _upload_file(self, file):
+        # Form files are spooled, so with deduplication on they are hashed
+        # before anything is sent. Raw bodies are uploaded without a check.
+        size = stream_size(file.stream)
+        hashed = None
+        if self.cloud_ops.dedup is not None:
+            hashed = await asyncio.to_thread(hash_stream, file.stream)
+            if hashed is not None:
+                size = hashed[1]
+        return await self._upload_stream(self._file_reader(file.stream), file.filename, size, hashed)
+
+    def _file_reader(self, stream):
+        async def read(size):
+            return await asyncio.to_thread(stream.read, size)
+        return read
+
+    async def _stream_object(self, request, file_name, as_attachment):
+        # Same protocol as CloudOperations._stream_object: Range passthrough,
+        # cached copies revalidated with If-None-Match, misses tee'd into
+        # the cache
+        object_cache = self.cloud_ops.object_cache
+        get_args = {}
+        if request.headers.get('Range'):
+            get_args['Range'] = request.headers['Range']
+
+        entry = None
+        if object_cache is not None:
+            entry = object_cache.get(self.space_name, file_name)
+            if entry is not None and object_cache.is_fresh(entry):
+                cached = await self._send_cached(request, entry, file_name, as_attachment)
+                if cached is not None:
+                    return cached
+            if entry is not None:
+                get_args['IfNoneMatch'] = entry.etag
+
+        try:
+            s3_response = await self.client.get_object(Bucket=self.space_name, Key=file_name, **get_args)
+        except ClientError as e:
+            if entry is None or e.response.get('Error', {}).get('Code') != '304':
+                raise
+            cached = await self._send_cached(request, entry, file_name, as_attachment)
+            if cached is not None:
+                return cached
+            get_args.pop('IfNoneMatch')
+            s3_response = await self.client.get_object(Bucket=self.space_name, Key=file_name, **get_args)
+
+        encoding, decode = self.cloud_ops._decoding(request, s3_response)
+        if decode and 'Range' in get_args:
+            s3_response['Body'].close()
+            get_args.pop('Range')
+            s3_response = await self.client.get_object(Bucket=self.space_name, Key=file_name, **get_args)
+
+        mime_type = s3_response.get('ContentType') or mimetypes.guess_type(file_name)[0]
+        cache_writer = None
+        if object_cache is not None:
+            if entry is not None:
+                object_cache.invalidate(self.space_name, file_name)
+            object_cache.record_miss()
+            if 'Range' not in get_args and encoding is None:
+                cache_writer = object_cache.writer(
+                    self.space_name, file_name, s3_response.get('ETag'),
+                    s3_response['ContentLength'], mime_type)
+
+        body = s3_response['Body']
+        chunk_size = self.cloud_ops.transfer_planner.stream_chunk_size
+
+        async def generate():
+            TRANSFERS_IN_FLIGHT.inc(direction='download')
+            decompressor = decompressobj(encoding) if decode else None
+            try:
+                async for chunk in body.iter_chunks(chunk_size):
+                    TRANSFER_BYTES.inc(len(chunk), direction='download')
+                    if cache_writer is not None:
+                        await asyncio.to_thread(cache_writer.write, chunk)
+                    if decompressor is not None:
+                        chunk = decompressor.decompress(chunk)
+                    if chunk:
+                        yield chunk
+                if decompressor is not None and hasattr(decompressor, 'flush'):
+                    tail = decompressor.flush()
+                    if tail:
+                        yield tail
+            finally:
+                TRANSFERS_IN_FLIGHT.dec(direction='download')
+
+        stream = ObjectStream(generate(), body, cache_writer)
+        headers, status = self.cloud_ops._object_headers(s3_response, file_name, as_attachment, encoding, decode)
+        response = Response(stream, status=status, headers=headers,
+                            mimetype=mime_type or 'application/octet-stream')
+        return response, status
+
+    async def _send_cached(self, request, entry, file_name, as_attachment):
+        try:
+            response = await send_file(
+                entry.path,
+                mimetype=entry.content_type or 'application/octet-stream',
+                as_attachment=as_attachment,
+                attachment_filename=file_name.rsplit('/', 1)[-1],
+                add_etags=False
+            )
+        except FileNotFoundError:
+            # Evicted between the lookup and the read
+            return None
+        response.set_etag(entry.etag.strip('"'))
+        await response.make_conditional(request)
+        self.cloud_ops.object_cache.record_hit(self.space_name, file_name)
+        logger.info(f'Serving file {file_name} from cache')
+        return response, response.status_code
+
+    async def _send_object(self, request, as_attachment):
+        try:
+            file_name = request.args.get('file_name')
+            if not file_name:
+                logger.error('No file_name provided')
+                return {'status': 'fail', 'message': 'No file_name provided'}, 400
+
+            try:
+                response, status = await self._stream_object(request, file_name, as_attachment)
+                logger.info(f'Streaming file {file_name} from cloud')
+                return response, status
+            except NoCredentialsError:
+                logger.error('Credentials not available')
+                return {'status': 'fail', 'message': 'Credentials not available'}, 403
+            except ClientError as e:
+                if is_not_found(e):
+                    logger.error(f'File {file_name} not found in cloud')
+                    return {'status': 'fail', 'message': f'File {file_name} not found in cloud'}, 404
+                if e.response.get('Error', {}).get('Code') == 'InvalidRange':
+                    logger.error(f'Invalid range for file {file_name}')
+                    return {'status': 'fail', 'message': 'Requested range not satisfiable'}, 416
+                logger.error(f'Client error: {str(e)}')
+                return {'status': 'fail', 'message': str(e)}, 500
+
+        except Exception as e:
+            logger.error(f'Exception: {str(e)}')
+            return {'status': 'fail', 'message': str(e)}, 500
+
+    async def download_from_cloud(self, request):
+        return await self._send_object(request, as_attachment=True)
+
+    async def view_file(self, request):
+        return await self._send_object(request, as_attachment=False)
+
+    async def list_files(self, request):
+        try:
+            try:
+                list_args = self.cloud_ops._listing_args(request)
+                use_index = self.cloud_ops._use_index(request)
+            except ValueError as e:
+                logger.error(f'Invalid listing parameters: {str(e)}')
+                return {'status': 'fail', 'message': str(e)}, 400
+
+            stream = request.args.get('stream', '').lower() in ('1', 'true')
+            if use_index:
+                if stream:
+                    return self._stream_index_listing(list_args), 200
+                return await asyncio.to_thread(self.cloud_ops._index_listing, list_args), 200
+
+            if stream:
+                return self._stream_listing(list_args), 200
+
+            page = await self.client.list_objects_v2(**list_args)
+            response = {
+                'status': 'success',
+                'consistency': 'live',
+                'files': [self.cloud_ops._listing_entry(obj) for obj in page.get('Contents', [])],
+                'prefixes': [prefix['Prefix'] for prefix in page.get('CommonPrefixes', [])],
+                'is_truncated': page.get('IsTruncated', False)
+            }
+            if page.get('NextContinuationToken'):
+                response['next_continuation_token'] = page['NextContinuationToken']
+            return response, 200
+        except ClientError as e:
+            logger.error(f'Client error: {str(e)}')
+            return {'status': 'fail', 'message': str(e)}, 500
+        except Exception as e:
+            logger.error(f'Exception: {str(e)}')
+            return {'status': 'fail', 'message': str(e)}, 500
+
+    def _stream_listing(self, list_args):
+        paginator = self.client.get_paginator('list_objects_v2')
+
+        async def generate():
+            try:
+                async for page in paginator.paginate(**list_args):
+                    for obj in page.get('Contents', []):
+                        yield json.dumps(self.cloud_ops._listing_entry(obj)) + '\n'
+                    for prefix in page.get('CommonPrefixes', []):
+                        yield json.dumps({'prefix': prefix['Prefix']}) + '\n'
+            except ClientError as e:
+                logger.error(f'Client error: {str(e)}')
+                yield json.dumps({'status': 'fail', 'message': str(e)}) + '\n'
+
+        return Response(generate(), mimetype='application/x-ndjson')
+
+    def _stream_index_listing(self, list_args):
+        index = self.cloud_ops.metadata_index
+        prefix = list_args.get('Prefix', '')
+
+        async def generate():
+            after = None
+            while True:
+                files, _, after = await asyncio.to_thread(
+                    index.list, self.space_name, prefix, max_keys=MAX_LIST_KEYS, continuation_token=after)
+                for entry in files:
+                    yield json.dumps(entry) + '\n'
+                if after is None:
+                    return
+
+        return Response(generate(), mimetype='application/x-ndjson')
+
+    async def delete_file(self, request):
+        try:
+            file_name = request.args.get('file_name')
+            if not file_name:
+                logger.error('No file_name provided')
+                return {'status': 'fail', 'message': 'No file_name provided'}, 400
+
+            try:
+                await self.client.delete_object(Bucket=self.space_name, Key=file_name)
+                await asyncio.to_thread(self.cloud_ops._record_delete, [file_name])
+                logger.info(f'Deleted file {file_name} from cloud')
+                return {'status': 'success', 'message': f'File {file_name} deleted successfully'}, 200
+            except ClientError as e:
+                logger.error(f'Client error: {str(e)}')
+                return {'status': 'fail', 'message': str(e)}, 500
+
+        except Exception as e:
+            logger.error(f'Exception: {str(e)}')
+            return {'status': 'fail', 'message': str(e)}, 500
+
+    async def _delete_batch(self, keys):
+        try:
+            response = await self.client.delete_objects(
+                Bucket=self.space_name,
+                Delete={'Objects': [{'Key': key} for key in keys], 'Quiet': True}
+            )
+        except (ClientError, BotoCoreError) as e:
+            logger.error(f'Could not delete a batch of {len(keys)} files: {str(e)}')
+            return [], self.cloud_ops._batch_errors(keys, e)
+
+        deleted, errors = self.cloud_ops._batch_result(keys, response)
+        await asyncio.to_thread(self.cloud_ops._record_delete, deleted)
+        return deleted, errors
+
+    async def _delete_batches(self, batches):
+        # batches is an async iterable. At most MAX_PENDING_DELETE_BATCHES
+        # requests are pending and finished ones are dropped as they are
+        # counted, so prefix deletes run in constant memory apart from the
+        # errors.
+        deleted_count = 0
+        errors = []
+        pending = set()
+
+        def collect(done):
+            nonlocal deleted_count
+            for task in done:
+                batch_deleted, batch_errors = task.result()
+                deleted_count += len(batch_deleted)
+                errors.extend(batch_errors)
+
+        try:
+            async for batch in batches:
+                if len(pending) >= MAX_PENDING_DELETE_BATCHES:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    collect(done)
+                pending.add(asyncio.ensure_future(self._delete_batch(batch)))
+            if pending:
+                done, pending = await asyncio.wait(pending)
+                collect(done)
+        finally:
+            for task in pending:
+                task.cancel()
+        return deleted_count, errors
+
+    async def _prefix_batches(self, prefix):
+        paginator = self.client.get_paginator('list_objects_v2')
+        async for page in paginator.paginate(Bucket=self.space_name, Prefix=prefix,
+                                             PaginationConfig={'PageSize': MAX_DELETE_KEYS}):
+            keys = [obj['Key'] for obj in page.get('Contents', [])]
+            if keys:
+                yield keys
+
+    async def _key_batches(self, file_names):
+        for batch in self.cloud_ops._key_batches(file_names):
+            yield batch
+
+    async def delete_files(self, request):
+        try:
+            body = await request.get_json(silent=True) or {}
+            file_names = body.get('file_names')
+            prefix = body.get('prefix')
+            if not file_names and not prefix:
+                logger.error('No file_names provided')
+                return {'status': 'fail', 'message': 'No file_names provided'}, 400
+
+            try:
+                if prefix:
+                    deleted_count, errors = await self._delete_batches(self._prefix_batches(prefix))
+                else:
+                    deleted_count, errors = await self._delete_batches(self._key_batches(file_names))
+            except ClientError as e:
+                logger.error(f'Client error: {str(e)}')
+                return {'status': 'fail', 'message': str(e)}, 500
+            return self.cloud_ops._delete_response(file_names, prefix, deleted_count, errors)
+
+        except Exception as e:
+            logger.error(f'Exception: {str(e)}')
+            return {'status': 'fail', 'message': str(e)}, 500
@@ -0,0 +1,100 @@
+"""Compares the YouTube audio preparation paths before transcription.
+
+legacy:    decode the downloaded audio and re-encode it to MP3 with moviepy
+fast:      send the downloaded m4a/webm container as it is
+transcode: ffmpeg streaming transcode to MP3, used for other containers
+
+Without --input a sample m4a file of --seconds length is generated with
+ffmpeg. Prints one JSON object per path with wall time, CPU time (this
+process and its children) and output size.
+
+    python benchmarks/bench_audio_pipeline.py --seconds 600
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import resource
+import tempfile
+import subprocess
+
+import imageio_ffmpeg
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from utils.utils import convert_to_mp3, needs_conversion
+
+
+def cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime + children.ru_utime + children.ru_stime
+
+
+def make_sample(path, seconds):
+    subprocess.run(
+        [imageio_ffmpeg.get_ffmpeg_exe(), '-y', '-loglevel', 'error', '-f', 'lavfi',
+         '-i', f'sine=frequency=440:duration={seconds}', '-c:a', 'aac', '-b:a', '128k', path],
+        check=True)
+
+
+def legacy(path):
+    import moviepy.editor as mp
+    clip = mp.AudioFileClip(path)
+    mp3_file = os.path.splitext(path)[0] + '.mp3'
+    clip.write_audiofile(mp3_file, logger=None)
+    clip.close()
+    return mp3_file
+
+
+def fast(path):
+    if needs_conversion(path):
+        return convert_to_mp3(path)
+    return path
+
+
+def transcode(path):
+    return convert_to_mp3(path)
+
+
+def measure(name, prepare, source, workdir):
+    # Each path gets its own copy since conversion removes the source
+    path = os.path.join(workdir, f'{name}{os.path.splitext(source)[1]}')
+    shutil.copy(source, path)
+    started_cpu = cpu_seconds()
+    started = time.perf_counter()
+    output = prepare(path)
+    return {
+        'path': name,
+        'wall_seconds': round(time.perf_counter() - started, 3),
+        'cpu_seconds': round(cpu_seconds() - started_cpu, 3),
+        'output_bytes': os.path.getsize(output)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--input', help='audio file to prepare (default: generated m4a)')
+    parser.add_argument('--seconds', type=int, default=300, help='length of the generated sample')
+    parser.add_argument('--paths', default='legacy,fast,transcode')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench-audio-')
+    try:
+        source = args.input
+        if source is None:
+            source = os.path.join(workdir, 'sample.m4a')
+            make_sample(source, args.seconds)
+
+        paths = {'legacy': legacy, 'fast': fast, 'transcode': transcode}
+        for name in args.paths.split(','):
+            print(json.dumps(dict(measure(name, paths[name], source, workdir),
+                                  input_bytes=os.path.getsize(source))))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""Measures the cold start of the app: importing app.py in a fresh interpreter.
+
+Each run imports app in a new process with a generated configuration and
+reports the import time, peak RSS, number of loaded modules and whether
+the transcription stack (pytube, openai) was loaded. Runs once with lazy
+loading and once with PRELOAD_TRANSCRIPTION set, and breaks the import
+time down by top-level package using python -X importtime.
+
+    python benchmarks/bench_startup.py --runs 5
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+import tempfile
+import shutil
+from collections import Counter
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+PROBE = '''
+import os, sys, json, time, resource
+started = time.perf_counter()
+import app
+elapsed = time.perf_counter() - started
+peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({
+    'import_seconds': elapsed,
+    'peak_rss_bytes': peak if sys.platform == 'darwin' else peak * 1024,
+    'modules': len(sys.modules),
+    'transcription_loaded': sorted(name for name in ('pytube', 'openai') if name in sys.modules)
+}))
+sys.stdout.flush()
+# Skip waiting for the app's background threads
+os._exit(0)
+'''
+
+
+def write_config(workdir, preload):
+    path = os.path.join(workdir, f'config-{int(preload)}.json')
+    with open(path, 'w') as config_file:
+        json.dump({
+            'API_KEY': 'bench',
+            'AWS_BUCKET_NAME': 'bench',
+            'AWS_DEFAULT_REGION': 'us-east-1',
+            'AWS_ACCESS_KEY_ID': 'bench',
+            'AWS_SECRET_ACCESS_KEY': 'bench',
+            'OPENAI_API_KEY': 'bench',
+            'JOB_STORE_PATH': os.path.join(workdir, 'jobs.sqlite3'),
+            'UPLOAD_SESSION_STORE_PATH': os.path.join(workdir, 'upload_sessions.sqlite3'),
+            'SCRATCH_DIR': os.path.join(workdir, 'scratch'),
+            'OBJECT_CACHE_DIR': os.path.join(workdir, 'object-cache'),
+            'PRELOAD_TRANSCRIPTION': preload
+        }, config_file)
+    return path
+
+
+def probe(config_path, importtime=False):
+    env = dict(os.environ, DEVI_CONFIG=config_path)
+    args = [sys.executable] + (['-X', 'importtime'] if importtime else []) + ['-c', PROBE]
+    process = subprocess.run(args, cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    return json.loads(process.stdout.strip().splitlines()[-1]), process.stderr
+
+
+def packages(importtime_output, top):
+    # Self import time in milliseconds summed per top-level package
+    totals = Counter()
+    for line in importtime_output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, _, name = line[len('import time:'):].split('|')
+        totals[name.strip().split('.')[0]] += int(self_us)
+    return {name: round(us / 1000, 1) for name, us in totals.most_common(top)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5, help='imports per mode')
+    parser.add_argument('--top', type=int, default=10, help='packages in the import time breakdown')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench-startup-')
+    try:
+        for mode, preload in (('lazy', False), ('preload', True)):
+            config_path = write_config(workdir, preload)
+            runs = [probe(config_path)[0] for _ in range(args.runs)]
+            _, importtime_output = probe(config_path, importtime=True)
+            seconds = [run['import_seconds'] for run in runs]
+            print(json.dumps({
+                'mode': mode,
+                'runs': args.runs,
+                'import_seconds_median': round(statistics.median(seconds), 3),
+                'import_seconds_max': round(max(seconds), 3),
+                'peak_rss_bytes': max(run['peak_rss_bytes'] for run in runs),
+                'modules': runs[-1]['modules'],
+                'transcription_loaded': runs[-1]['transcription_loaded'],
+                'import_ms_by_package': packages(importtime_output, args.top)
+            }))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,352 @@
+"""Throughput benchmark for the API against a local S3 stand-in.
+
+Starts a moto S3 server in a subprocess (or uses --endpoint-url), serves
+the real app on a local threaded WSGI server and drives it over HTTP:
+
+upload:   POST /uploadToCloud with --files files of each --sizes size
+download: GET /downloadFromCloud of an object of each size
+view:     GET /viewFile of an object of each size
+list:     GET /listFiles?stream=true over prefixes of --bucket-objects keys
+delete:   DELETE /deleteFiles with --files keys per request
+
+Every scenario runs --requests requests at each --concurrency level. The
+report is JSON with one row per scenario: throughput, p50/p99 latency and
+the peak RSS of this process while the scenario ran. That is the app and
+the load generator, the S3 stand-in runs in its own process. Reports of two versions can be compared with --compare.
+
+    pip install -r benchmarks/requirements.txt
+    python benchmarks/bench_throughput.py --output before.json
+    python benchmarks/bench_throughput.py --compare before.json after.json
+
+Extra app configuration is passed with --set, for example
+--set OBJECT_CACHE_MAX_BYTES=1073741824.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import logging
+import platform
+import argparse
+import resource
+import tempfile
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+import requests
+from botocore.config import Config
+from werkzeug.serving import make_server
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(ROOT)
+
+API_KEY = 'bench-key'
+BUCKET = 'bench'
+UNITS = {'KB': 1024, 'MB': 1024 ** 2, 'GB': 1024 ** 3, 'B': 1}
+ROW_KEY = ('operation', 'object_bytes', 'files', 'bucket_objects', 'concurrency')
+
+
+def parse_size(value):
+    value = value.strip().upper()
+    for unit, factor in UNITS.items():
+        if value.endswith(unit):
+            return int(float(value[:-len(unit)]) * factor)
+    return int(value)
+
+
+def parse_list(value, parse=int):
+    return [parse(item) for item in value.split(',') if item]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_moto():
+    port = free_port()
+    process = subprocess.Popen([sys.executable, '-m', 'moto.server', '-H', '127.0.0.1', '-p', str(port)],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return process, f'http://127.0.0.1:{port}'
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError('moto server did not start')
+
+
+def load_app(workdir, endpoint_url, overrides):
+    # The app reads .env.json from the working directory at import
+    config = {
+        'API_KEY': API_KEY,
+        'AWS_BUCKET_NAME': BUCKET,
+        'AWS_DEFAULT_REGION': 'us-east-1',
+        'AWS_ACCESS_KEY_ID': 'bench',
+        'AWS_SECRET_ACCESS_KEY': 'bench',
+        'OPENAI_API_KEY': 'bench',
+        'S3_ENDPOINT_URL': endpoint_url,
+        'JOB_STORE_PATH': os.path.join(workdir, 'jobs.sqlite3')
+    }
+    config.update(overrides)
+    with open(os.path.join(workdir, '.env.json'), 'w') as config_file:
+        json.dump(config, config_file)
+    os.chdir(workdir)
+    from app import app
+    return app
+
+
+def serve(app):
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_port}'
+
+
+def current_rss():
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        # Lifetime peak, in KB on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class RssSampler(object):
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.peak = current_rss()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, current_rss())
+
+
+def percentile(values, fraction):
+    # Nearest-rank percentile
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(fraction * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def run(calls, concurrency):
+    # Runs call(session) for each call, concurrency at a time. Returns the
+    # latencies, the failed call count and the elapsed seconds.
+    local = threading.local()
+
+    def timed(call):
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+            session.headers['Authorization'] = API_KEY
+        started = time.perf_counter()
+        response = call(session)
+        elapsed = time.perf_counter() - started
+        return elapsed, response.status_code >= 300
+
+    with RssSampler() as sampler:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(timed, calls))
+        seconds = time.perf_counter() - started
+    return [latency for latency, _ in results], sum(failed for _, failed in results), seconds, sampler.peak
+
+
+def row(operation, calls, concurrency, payload_bytes, object_bytes=None, files=None, bucket_objects=None):
+    latencies, errors, seconds, peak_rss = run(calls, concurrency)
+    result = {
+        'operation': operation,
+        'object_bytes': object_bytes,
+        'files': files,
+        'bucket_objects': bucket_objects,
+        'concurrency': concurrency,
+        'requests': len(calls),
+        'errors': errors,
+        'seconds': round(seconds, 3),
+        'requests_per_second': round(len(calls) / seconds, 2),
+        'bytes_per_second': round(payload_bytes / seconds),
+        'p50_ms': round(percentile(latencies, 0.5) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'peak_rss_bytes': peak_rss
+    }
+    print(json.dumps(result), file=sys.stderr)
+    return result
+
+
+def put_objects(s3, keys, body):
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        list(executor.map(lambda key: s3.put_object(Bucket=BUCKET, Key=key, Body=body), keys))
+
+
+def delete_prefix(s3, prefix):
+    for page in s3.get_paginator('list_objects_v2').paginate(Bucket=BUCKET, Prefix=prefix):
+        keys = [{'Key': obj['Key']} for obj in page.get('Contents', [])]
+        if keys:
+            s3.delete_objects(Bucket=BUCKET, Delete={'Objects': keys, 'Quiet': True})
+
+
+def benchmark(base_url, s3, args):
+    results = []
+    count = args.requests
+
+    for size in args.sizes:
+        payload = os.urandom(size)
+        for files in args.files:
+            for concurrency in args.concurrency:
+                prefix = f'upload-{size}-{files}-{concurrency}/'
+
+                def upload(i):
+                    form = [('files', (f'{prefix}{i}-{j}.bin', payload)) for j in range(files)]
+                    return lambda session: session.post(f'{base_url}/uploadToCloud', files=form)
+
+                results.append(row('upload', [upload(i) for i in range(count)], concurrency,
+                                   size * files * count, object_bytes=size, files=files))
+                delete_prefix(s3, prefix)
+
+        key = f'objects/{size}.bin'
+        s3.put_object(Bucket=BUCKET, Key=key, Body=payload)
+        for operation, path in (('download', 'downloadFromCloud'), ('view', 'viewFile')):
+            for concurrency in args.concurrency:
+                call = lambda session: session.get(f'{base_url}/{path}', params={'file_name': key})
+                results.append(row(operation, [call] * count, concurrency, size * count, object_bytes=size))
+
+    for bucket_objects in args.bucket_objects:
+        prefix = f'list-{bucket_objects}/'
+        put_objects(s3, [f'{prefix}{i:08d}' for i in range(bucket_objects)], b'x')
+        for concurrency in args.concurrency:
+            call = lambda session: session.get(f'{base_url}/listFiles',
+                                               params={'prefix': prefix, 'stream': 'true', 'consistency': 'live'})
+            results.append(row('list', [call] * count, concurrency, 0, bucket_objects=bucket_objects))
+        delete_prefix(s3, prefix)
+
+    for files in args.files:
+        for concurrency in args.concurrency:
+            prefix = f'delete-{files}-{concurrency}/'
+            batches = [[f'{prefix}{i}-{j}' for j in range(files)] for i in range(count)]
+            put_objects(s3, [key for batch in batches for key in batch], b'x')
+            calls = [lambda session, batch=batch: session.delete(f'{base_url}/deleteFiles',
+                                                                 json={'file_names': batch})
+                     for batch in batches]
+            results.append(row('delete', calls, concurrency, 0, files=files))
+
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(base_path, current_path):
+    # One JSON line per scenario present in both reports
+    with open(base_path) as base_file, open(current_path) as current_file:
+        base, current = json.load(base_file), json.load(current_file)
+    base_rows = {tuple(r[field] for field in ROW_KEY): r for r in base['results']}
+    for r in current['results']:
+        before = base_rows.get(tuple(r[field] for field in ROW_KEY))
+        if before is None:
+            continue
+        print(json.dumps(dict(
+            {field: r[field] for field in ROW_KEY},
+            requests_per_second_ratio=round(r['requests_per_second'] / before['requests_per_second'], 3),
+            p99_ratio=round(r['p99_ms'] / before['p99_ms'], 3) if before['p99_ms'] else None,
+            peak_rss_ratio=round(r['peak_rss_bytes'] / before['peak_rss_bytes'], 3)
+        )))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='4KB,1MB,8MB', help='object sizes')
+    parser.add_argument('--files', default='1,4', help='files per upload and delete request')
+    parser.add_argument('--bucket-objects', default='100,1000', help='keys under each listed prefix')
+    parser.add_argument('--concurrency', default='1,8', help='concurrent clients')
+    parser.add_argument('--requests', type=int, default=16, help='requests per scenario')
+    parser.add_argument('--endpoint-url', help='S3-compatible endpoint to use instead of a moto server')
+    parser.add_argument('--set', action='append', default=[], metavar='KEY=VALUE',
+                        help='extra app configuration')
+    parser.add_argument('--output', help='report path (default: stdout)')
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'CURRENT'), help='compare two reports')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    args.sizes = parse_list(args.sizes, parse_size)
+    args.files = parse_list(args.files)
+    args.bucket_objects = parse_list(args.bucket_objects)
+    args.concurrency = parse_list(args.concurrency)
+    overrides = dict(item.split('=', 1) for item in args.set)
+
+    moto = None
+    endpoint_url = args.endpoint_url
+    if endpoint_url is None:
+        moto, endpoint_url = start_moto()
+    workdir = tempfile.mkdtemp(prefix='bench-throughput-')
+    cwd = os.getcwd()
+    try:
+        s3 = boto3.client('s3', endpoint_url=endpoint_url, region_name='us-east-1',
+                          aws_access_key_id='bench', aws_secret_access_key='bench',
+                          config=Config(max_pool_connections=16))
+        s3.create_bucket(Bucket=BUCKET)
+
+        app = load_app(workdir, endpoint_url, overrides)
+        # Request logging would dominate small requests
+        logging.getLogger().setLevel(logging.WARNING)
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+        server, base_url = serve(app)
+        try:
+            results = benchmark(base_url, s3, args)
+        finally:
+            server.shutdown()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+        if moto is not None:
+            moto.terminate()
+            moto.wait()
+
+    report = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'matrix': {
+            'sizes': args.sizes,
+            'files': args.files,
+            'bucket_objects': args.bucket_objects,
+            'concurrency': args.concurrency,
+            'requests': args.requests,
+            'config': overrides
+        },
+        'results': results
+    }
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,130 +1,600 @@
 import os
 import json
+import math
+import time
 import logging
-import threading
 import mimetypes
-import sys
-from flask import jsonify, send_file
+import threading
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from flask import Response, send_file
+from werkzeug.datastructures import Headers
+from werkzeug.http import http_date
 import boto3
-from boto3.s3.transfer import TransferConfig
-from botocore.exceptions import NoCredentialsError, ClientError
+from botocore.exceptions import NoCredentialsError, ClientError, BotoCoreError
 
 
-from utils.utils import get_youtube_id, transcript_yt, download_yt
+from utils.utils import get_youtube_id, transcript_yt, download_yt_audio, playlist_video_urls, convert_to_mp3, needs_conversion, openai_client_stats, preload_transcription, TRANSCRIPTION_PARAMS
+from utils.config import load_config, config_flag
+from utils.compression import CompressionPolicy, ENCODING_METADATA, stored_encoding, decompress_chunks
+from utils.transfer import TransferPlanner, MAX_PARTS
+from utils.clients import S3Clients
+from utils.cache import ObjectCache
+from utils.metadata_index import MetadataIndex
+from utils.zipstream import ZipEntry, zip_chunks
+from utils.dedup import DigestIndex, HashingReader, DIGEST_METADATA, DEDUP_CHECKS, DEDUP_BYTES_SAVED, hash_stream
+from utils.jobs import JobQueue
+from utils.upload_sessions import UploadSessionStore
+from utils.scratch import ScratchSpace, ScratchSpaceFull
+from utils.transcripts import TranscriptCache
+from utils.transcription import segment_options_from_config
+from utils.metrics import REGISTRY, TRANSFER_BYTES, TRANSFERS_IN_FLIGHT, TransferCallback
+from utils.timing import span, timed, propagate, timeline
 
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-class ProgressPercentage(object):
-    def __init__(self, filename):
-        self._filename = filename
-        self._size = float(os.path.getsize(filename))
-        self._seen_so_far = 0
-        self._lock = threading.Lock()
-
-    def __call__(self, bytes_amount):
-        with self._lock:
-            self._seen_so_far += bytes_amount
-            percentage = (self._seen_so_far / self._size) * 100
-            sys.stdout.write(
-                "\r%s  %s / %s  (%.2f%%)" % (
-                    self._filename, self._seen_so_far, self._size,
-                    percentage))
-            sys.stdout.flush()
+def stream_size(stream):
+    # Size of a seekable stream without consuming it, None if unknown
+    try:
+        position = stream.tell()
+        stream.seek(0, os.SEEK_END)
+        size = stream.tell()
+        stream.seek(position)
+        return size - position
+    except (AttributeError, OSError, ValueError):
+        return None
+
+# ListObjectsV2 returns at most this many keys per page
+MAX_LIST_KEYS = 1000
+
+# DeleteObjects accepts at most this many keys per request
+MAX_DELETE_KEYS = 1000
+MAX_PENDING_DELETE_BATCHES = 16
+
+# Presigned URLs signed with SigV4 are valid for at most 7 days
+MAX_PRESIGNED_EXPIRY = 7 * 24 * 3600
+
+# Status of a batch item while it is in a stage
+BATCH_STAGE_STATUS = {'download': 'downloading', 'convert': 'converting', 'transcribe': 'transcribing'}
+
+# CopyObject copies objects up to 5 GB, larger ones are copied in parts
+# of at least COPY_PART_SIZE with UploadPartCopy
+MAX_COPY_OBJECT_SIZE = 5 * 1024 ** 3
+COPY_PART_SIZE = 512 * 1024 ** 2
+MAX_PENDING_COPIES = 64
+
+# Object attributes a multipart copy carries over from the source
+COPIED_ATTRIBUTES = ('ContentType', 'ContentEncoding', 'ContentDisposition', 'ContentLanguage',
+                     'CacheControl', 'Metadata')
+
+# Archive member listing the objects a ZIP download could not include
+ZIP_ERRORS_NAME = 'download-errors.json'
+
+
+def is_not_found(error):
+    return error.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound')
 
 class CloudOperations:
     def __init__(self):
-        # Read configuration from .env.json
-        with open('.env.json') as config_file:
-            config = json.load(config_file)
-
-        logger.info('Loaded configuration from .env.json')
+        config = load_config()
 
         self.space_name = config.get('AWS_BUCKET_NAME')
         self.region = config.get('AWS_DEFAULT_REGION')
 
         os.environ["OPENAI_API_KEY"] = config.get('OPENAI_API_KEY')
         
-        self.s3_resource = boto3.resource(
-            's3',
+        # Thread-local resources and a shared, pooled low-level client
+        self.clients = S3Clients.from_config(boto3.session.Session(
             region_name=self.region,
             aws_access_key_id=config.get('AWS_ACCESS_KEY_ID'),
             aws_secret_access_key=config.get('AWS_SECRET_ACCESS_KEY')
+        ), config)
+
+        # Part size and concurrency are planned per object from its size
+        self.transfer_planner = TransferPlanner.from_config(config)
+
+        # Lifetime of presigned URLs handed to clients, in seconds
+        self.presigned_url_expiry = int(config.get('PRESIGNED_URL_EXPIRY', 3600))
+
+        # Compression of text-like uploads, None unless COMPRESSION_ENCODING is set
+        self.compression = CompressionPolicy.from_config(config)
+
+        # Read-through cache for hot objects, None unless OBJECT_CACHE_MAX_BYTES is set
+        self.object_cache = ObjectCache.from_config(config)
+
+        # Local listing index, None unless METADATA_INDEX_PATH is set
+        self.metadata_index = MetadataIndex.from_config(config)
+        if self.metadata_index is not None:
+            self.metadata_index.start_reconciler(
+                self.space_name, self.s3_client,
+                float(config.get('METADATA_RECONCILE_SECONDS', 3600)))
+
+        # Content digests of uploads, None unless DEDUP_INDEX_PATH is set.
+        # Uploads of content already in the bucket become server-side copies.
+        self.dedup = DigestIndex.from_config(config)
+
+        # Files of one request are streamed to S3 in parallel; the pool is
+        # shared so the number of concurrent uploads stays bounded
+        self.upload_executor = ThreadPoolExecutor(
+            max_workers=int(config.get('UPLOAD_MAX_WORKERS', 4)),
+            thread_name_prefix='upload'
+        )
+
+        # DeleteObjects batches are sent concurrently on their own pool
+        self.delete_executor = ThreadPoolExecutor(
+            max_workers=int(config.get('DELETE_MAX_WORKERS', 8)),
+            thread_name_prefix='delete'
         )
 
-        self.config = TransferConfig(
-            multipart_threshold=1024 * 25,
-            max_concurrency=10,
-            multipart_chunksize=1024 * 25,
-            use_threads=True
+        # ZIP downloads open the next objects on their own pool while the
+        # current one streams, reading a bounded head of each ahead. Each
+        # download keeps at most `prefetch` of them pending, so the pool
+        # serves several downloads at once without one starving the others.
+        self.zip_options = {
+            'prefetch': int(config.get('ZIP_PREFETCH_OBJECTS', 4)),
+            'prefetch_bytes': int(config.get('ZIP_PREFETCH_BYTES', 1024 * 1024))
+        }
+        self.download_executor = ThreadPoolExecutor(
+            max_workers=int(config.get('ZIP_MAX_WORKERS', 8 * self.zip_options['prefetch'])),
+            thread_name_prefix='download'
         )
 
+        # Resumable uploads; sessions without a chunk for
+        # UPLOAD_SESSION_TTL_SECONDS are aborted in the background
+        self.upload_sessions = UploadSessionStore.from_config(config)
+        self.upload_sessions.start_collector(
+            self._abort_session,
+            float(config.get('UPLOAD_SESSION_TTL_SECONDS', 24 * 3600)),
+            float(config.get('UPLOAD_SESSION_SWEEP_SECONDS', 600)))
+
+        # Items of bulk copies and moves run concurrently on their own pool
+        self.copy_executor = ThreadPoolExecutor(
+            max_workers=int(config.get('COPY_MAX_WORKERS', 8)),
+            thread_name_prefix='copy'
+        )
+
+        # Temporary files of transcriptions, under a byte quota and removed
+        # as soon as their job is done
+        self.scratch = ScratchSpace.from_config(config)
+
+        # Transcripts are cached per video in the bucket and in memory, and
+        # recorded like any other upload when they are stored
+        self.transcript_cache = TranscriptCache.from_config(
+            config, self.s3_client, self.space_name, on_store=self._record_upload)
+
+        # Long audio is transcribed in parallel segments
+        self.segment_options = segment_options_from_config(config)
+
+        # Transcriptions run on a persistent background job queue
+        self.job_queue = JobQueue.from_config(config)
+        self.job_queue.register('transcribe_yt', self._run_transcription)
+        self.job_queue.register('transcribe_batch', self._run_transcription_batch)
+        self.job_queue.start()
+
+        # Videos of a batch are worked on by a bounded pool. An item downloads
+        # its audio and then waits for a transcription slot, so later videos
+        # are fetched while earlier ones are transcribed.
+        self.batch_options = {
+            'workers': int(config.get('TRANSCRIBE_BATCH_WORKERS', 4)),
+            'max_items': int(config.get('TRANSCRIBE_BATCH_MAX_ITEMS', 500))
+        }
+        self.transcription_slots = threading.BoundedSemaphore(
+            int(config.get('TRANSCRIBE_BATCH_CONCURRENCY', 2)))
+
+        # The YouTube and OpenAI clients are imported on the first
+        # transcription unless they are wanted at boot
+        if config_flag(config, 'PRELOAD_TRANSCRIPTION'):
+            preload_transcription()
+
+    @property
+    def s3_resource(self):
+        return self.clients.resource
+
+    @property
+    def s3_client(self):
+        return self.clients.client
+
+    def client_stats(self):
+        return {'status': 'success', 's3': self.clients.snapshot(), 'openai': openai_client_stats()}, 200
+
+    def metrics(self):
+        # Prometheus text format: the shared metrics plus the counters the
+        # clients, caches and job queue keep themselves
+        samples = []
+
+        def add(name, kind, documentation, value):
+            samples.append((f'devi_{name}', kind, documentation, value))
+
+        s3 = self.clients.snapshot()
+        add('s3_requests_total', 'counter', 'S3 API calls made', s3['requests'])
+        add('s3_requests_in_flight', 'gauge', 'S3 API calls in progress', s3['in_flight'])
+        add('s3_pool_saturated_total', 'counter', 'S3 calls that waited for a free connection',
+            s3['pool_saturated'])
+        openai_stats = openai_client_stats()
+        add('openai_requests_total', 'counter', 'OpenAI API calls made', openai_stats['requests'])
+
+        if self.object_cache is not None:
+            cache = self.object_cache.stats()
+            add('object_cache_hits_total', 'counter', 'Object cache hits', cache['hits'])
+            add('object_cache_misses_total', 'counter', 'Object cache misses', cache['misses'])
+            add('object_cache_evictions_total', 'counter', 'Object cache evictions', cache['evictions'])
+            add('object_cache_bytes', 'gauge', 'Bytes held in the object cache', cache['bytes'])
+
+        if self.dedup is not None:
+            add('dedup_index_entries', 'gauge', 'Objects in the digest index', self.dedup.snapshot()['entries'])
+
+        jobs = self.job_queue.stats()
+        add('job_queue_depth', 'gauge', 'Jobs waiting for a worker', jobs['queue_depth'])
+        add('jobs_running', 'gauge', 'Jobs being processed', jobs['running'])
+
+        scratch = self.scratch.snapshot()
+        add('scratch_reserved_bytes', 'gauge', 'Scratch space bytes reserved', scratch['reserved_bytes'])
+        add('scratch_quota_bytes', 'gauge', 'Scratch space quota', scratch['quota_bytes'])
+        add('scratch_waits_total', 'counter', 'Scratch reservations that waited for room', scratch['waits'])
+        add('scratch_rejected_total', 'counter', 'Scratch reservations that found no room', scratch['rejected'])
+
+        transcripts = self.transcript_cache.stats
+        add('transcript_cache_hits_total', 'counter', 'Transcripts served without transcribing',
+            transcripts['memory_hits'] + transcripts['bucket_hits'] + transcripts['shared'])
+        add('transcript_cache_misses_total', 'counter', 'Transcripts computed', transcripts['misses'])
+
+        body = REGISTRY.render(samples)
+        return Response(body, mimetype='text/plain; version=0.0.4; charset=utf-8'), 200
+
+    def _upload_stream(self, stream, file_name, size=None):
+        # Pipes a file-like object into S3 without staging it on disk.
+        # upload_fileobj reads it part by part, so memory per upload stays
+        # bounded by the transfer chunk size and concurrency.
+        try:
+            mime_type, _ = mimetypes.guess_type(file_name)
+            extra_args = {'ContentType': mime_type} if mime_type else {}
+            hashed = hashing = None
+            if self.dedup is not None:
+                with span('hash'):
+                    hashed = hash_stream(stream)
+                if hashed is None:
+                    # Hashed on the way up, so later uploads can match it
+                    stream = hashing = HashingReader(stream)
+                else:
+                    size = hashed[1]
+                    with span('dedup'):
+                        copied = self._copy_duplicate(file_name, *hashed, mime_type)
+                    if copied:
+                        return None
+                    extra_args['Metadata'] = {DIGEST_METADATA: hashed[0]}
+            encoding = self._upload_encoding(mime_type, size, extra_args)
+            if encoding is not None:
+                # Compressed while upload_fileobj reads it
+                stream = self.compression.reader(stream)
+            TRANSFERS_IN_FLIGHT.inc(direction='upload')
+            try:
+                with span('upload'), self.transfer_planner.transfer(size) as transfer_config:
+                    self.s3_resource.Object(self.space_name, file_name).upload_fileobj(
+                        stream,
+                        ExtraArgs=extra_args,
+                        Config=transfer_config,
+                        Callback=TransferCallback('upload')
+                    )
+            finally:
+                TRANSFERS_IN_FLIGHT.dec(direction='upload')
+            self._record_upload(file_name)
+            self._record_digest(file_name, hashed, hashing)
+            logger.info(f'Uploaded file {file_name} to cloud')
+            return None
+        except NoCredentialsError:
+            logger.error('Credentials not available')
+            return {'status': 'fail', 'message': 'Credentials not available'}, 403
+        except ClientError as e:
+            logger.error(f'Client error: {str(e)}')
+            return {'status': 'fail', 'message': str(e)}, 500
+        except BotoCoreError as e:
+            # The upload never got an answer from S3
+            logger.error(f'Could not upload {file_name}: {str(e)}')
+            return {'status': 'fail', 'message': str(e)}, 500
+
+    def _upload_encoding(self, mime_type, size, extra_args):
+        # Picks the compression of an upload and records it on the object
+        if self.compression is None:
+            return None
+        encoding = self.compression.encoding_for(mime_type, size)
+        if encoding is not None:
+            extra_args['ContentEncoding'] = encoding
+            extra_args.setdefault('Metadata', {})[ENCODING_METADATA] = encoding
+        return encoding
+
+    def _find_duplicate(self, file_name, digest, size):
+        # An existing object with this content, checked against S3: the
+        # target key itself first, then the keys the digest index knows.
+        # Returns (key, HeadObject response) or None.
+        candidates = {file_name: self.dedup.get(self.space_name, file_name)}
+        for row in self.dedup.candidates(self.space_name, digest, size):
+            candidates.setdefault(row['key'], row)
+        for key, row in candidates.items():
+            try:
+                head = self.s3_client.head_object(Bucket=self.space_name, Key=key)
+            except ClientError as e:
+                if not is_not_found(e):
+                    raise
+                if row is not None:
+                    self.dedup.remove(self.space_name, [key])
+                continue
+            stored = (head.get('Metadata') or {}).get(DIGEST_METADATA)
+            if stored == digest or (row is not None and row['digest'] == digest
+                                    and row['etag'] is not None and row['etag'] == head.get('ETag')):
+                return key, head
+            if row is not None and key != file_name:
+                # Overwritten outside the service since it was indexed
+                self.dedup.remove(self.space_name, [key])
+        return None
+
+    def _copy_duplicate(self, file_name, digest, size, mime_type):
+        # Stores file_name without transferring its content when an
+        # identical object exists: nothing to do for the same key, a
+        # server-side copy for another. Returns whether the upload is done.
+        duplicate = self._find_duplicate(file_name, digest, size)
+        self.dedup.record_check(size, duplicate is not None)
+        DEDUP_CHECKS.inc(result='hit' if duplicate is not None else 'miss')
+        if duplicate is None:
+            return False
+        source, head = duplicate
+        DEDUP_BYTES_SAVED.inc(size)
+        if source == file_name:
+            logger.info(f'File {file_name} is unchanged, skipped upload')
+            return True
+        attributes = {'Metadata': dict(head.get('Metadata') or {}, **{DIGEST_METADATA: digest})}
+        content_type = mime_type or head.get('ContentType')
+        if content_type:
+            attributes['ContentType'] = content_type
+        if head.get('ContentEncoding'):
+            attributes['ContentEncoding'] = head['ContentEncoding']
+        self._copy_object(source, file_name, head, attributes)
+        logger.info(f'File {file_name} has the content of {source}, copied in the bucket')
+        return True
+
+    def _record_digest(self, file_name, hashed, hashing):
+        # Indexes the digest of a finished upload. Content hashed while it
+        # streamed has no checksum metadata, so its ETag is kept to verify it.
+        if hashed is not None:
+            self.dedup.put(self.space_name, file_name, hashed[0], hashed[1])
+        elif hashing is not None:
+            try:
+                etag = self.s3_client.head_object(Bucket=self.space_name, Key=file_name)['ETag']
+            except (ClientError, BotoCoreError) as e:
+                logger.error(f'Could not index the digest of {file_name}: {str(e)}')
+                return
+            self.dedup.put(self.space_name, file_name, hashing.hexdigest(), hashing.size, etag)
+
     def upload_to_cloud(self, request):
         try:
             if 'files' not in request.files:
+                file_name = request.args.get('file_name')
+                if file_name and request.mimetype != 'multipart/form-data':
+                    return self._upload_request_body(request, file_name)
                 logger.error('No files part in the request')
                 return {'status': 'fail', 'message': 'No files part in the request'}, 400
 
             files = request.files.getlist('files')
-            uploaded_files = []
-
-            for file in files:
-                file_name = file.filename
-                file.save(file_name)
+            futures = [
+                self.upload_executor.submit(
+                    propagate(self._upload_stream), file.stream, file.filename, stream_size(file.stream))
+                for file in files
+            ]
 
-                try:
-                    mime_type, _ = mimetypes.guess_type(file_name)
-                    self.s3_resource.Object(self.space_name, file_name).upload_file(
-                        file_name,
-                        ExtraArgs={'ContentType': mime_type},
-                        Config=self.config,
-                        Callback=ProgressPercentage(file_name)
-                    )
-                    uploaded_files.append(file_name)
-                    os.remove(file_name)
-                    logger.info(f'Uploaded file {file_name} to cloud')
-                except FileNotFoundError:
-                    logger.error(f'File {file_name} not found')
-                    return {'status': 'fail', 'message': f'File {file_name} not found'}, 404
-                except NoCredentialsError:
-                    logger.error('Credentials not available')
-                    return {'status': 'fail', 'message': 'Credentials not available'}, 403
-                except ClientError as e:
-                    logger.error(f'Client error: {str(e)}')
-                    return {'status': 'fail', 'message': str(e)}, 500
-
-            return {'status': 'success', 'uploaded_files': uploaded_files}, 200
+            return self._upload_response([file.filename for file in files],
+                                         [future.result() for future in futures])
 
         except Exception as e:
             logger.error(f'Exception: {str(e)}')
             return {'status': 'fail', 'message': str(e)}, 500
 
-    def download_from_cloud(self, request):
+    def _upload_response(self, file_names, errors):
+        # errors holds None or the (response, status) failure of each file
+        uploaded_files = [file_name for file_name, error in zip(file_names, errors) if error is None]
+        failure = next((error for error in errors if error is not None), None)
+        if failure is not None:
+            response, status = failure
+            response['uploaded_files'] = uploaded_files
+            return response, status
+        return {'status': 'success', 'uploaded_files': uploaded_files}, 200
+
+    def _upload_request_body(self, request, file_name):
+        # Raw upload mode: the request body itself is the file content
+        error = self._upload_stream(request.stream, file_name, request.content_length)
+        if error is not None:
+            return error
+        return {'status': 'success', 'uploaded_files': [file_name]}, 200
+
+    def _stream_object(self, request, file_name, as_attachment):
+        # Streams the GetObject body to the client as it arrives. A Range
+        # header is forwarded to S3 and answered with 206 Partial Content.
+        # Cached copies are revalidated with If-None-Match and served from
+        # disk while S3 answers 304 Not Modified.
+        get_args = {}
+        if request.headers.get('Range'):
+            get_args['Range'] = request.headers['Range']
+
+        entry = None
+        if self.object_cache is not None:
+            with span('cache-lookup'):
+                entry = self.object_cache.get(self.space_name, file_name)
+            if entry is not None and self.object_cache.is_fresh(entry):
+                cached = self._send_cached(entry, file_name, as_attachment)
+                if cached is not None:
+                    return cached
+            if entry is not None:
+                get_args['IfNoneMatch'] = entry.etag
+
+        try:
+            s3_response = self.s3_resource.Object(self.space_name, file_name).get(**get_args)
+        except ClientError as e:
+            if entry is None or e.response.get('Error', {}).get('Code') != '304':
+                raise
+            cached = self._send_cached(entry, file_name, as_attachment)
+            if cached is not None:
+                return cached
+            get_args.pop('IfNoneMatch')
+            s3_response = self.s3_resource.Object(self.space_name, file_name).get(**get_args)
+
+        encoding, decode = self._decoding(request, s3_response)
+        if decode and 'Range' in get_args:
+            # A range of the compressed bytes means nothing to a client
+            # that cannot decode them, the whole object is sent instead
+            s3_response['Body'].close()
+            get_args.pop('Range')
+            s3_response = self.s3_resource.Object(self.space_name, file_name).get(**get_args)
+
+        mime_type = s3_response.get('ContentType') or mimetypes.guess_type(file_name)[0]
+        cache_writer = None
+        if self.object_cache is not None:
+            if entry is not None:
+                # The object changed since it was cached
+                self.object_cache.invalidate(self.space_name, file_name)
+            self.object_cache.record_miss()
+            # Cached copies are served as they are, so only objects stored
+            # without encoding are cached
+            if 'Range' not in get_args and encoding is None:
+                cache_writer = self.object_cache.writer(
+                    self.space_name, file_name, s3_response.get('ETag'),
+                    s3_response['ContentLength'], mime_type)
+
+        body = s3_response['Body']
+        chunk_size = self.transfer_planner.stream_chunk_size
+
+        def download():
+            for chunk in body.iter_chunks(chunk_size):
+                TRANSFER_BYTES.inc(len(chunk), direction='download')
+                if cache_writer is not None:
+                    cache_writer.write(chunk)
+                yield chunk
+
+        def generate():
+            completed = False
+            TRANSFERS_IN_FLIGHT.inc(direction='download')
+            try:
+                # Ends after the headers were sent, so it is only in the log
+                with span('stream'):
+                    yield from decompress_chunks(download(), encoding) if decode else download()
+                completed = True
+            finally:
+                TRANSFERS_IN_FLIGHT.dec(direction='download')
+                body.close()
+                if cache_writer is not None:
+                    if completed:
+                        cache_writer.commit()
+                    else:
+                        cache_writer.discard()
+
+        headers, status = self._object_headers(s3_response, file_name, as_attachment, encoding, decode)
+        response = Response(generate(), status=status, headers=headers,
+                            mimetype=mime_type or 'application/octet-stream',
+                            direct_passthrough=True)
+        response.call_on_close(body.close)
+        if cache_writer is not None:
+            # Drops the partial file if the body was never iterated
+            response.call_on_close(cache_writer.discard)
+        return response, status
+
+    def _decoding(self, request, s3_response):
+        # The stored encoding, and whether it has to be decoded because the
+        # client does not accept it
+        encoding = stored_encoding(s3_response)
+        return encoding, encoding is not None and not request.accept_encodings[encoding]
+
+    def _object_headers(self, s3_response, file_name, as_attachment, encoding=None, decode=False):
+        headers = Headers()
+        if encoding is not None:
+            headers['Vary'] = 'Accept-Encoding'
+        if decode:
+            # The decoded length is only known once it has been sent
+            headers['Accept-Ranges'] = 'none'
+            if s3_response.get('ETag'):
+                headers['ETag'] = 'W/' + s3_response['ETag']
+        else:
+            headers['Accept-Ranges'] = 'bytes'
+            headers['Content-Length'] = str(s3_response['ContentLength'])
+            if encoding is not None:
+                headers['Content-Encoding'] = encoding
+            if s3_response.get('ETag'):
+                headers['ETag'] = s3_response['ETag']
+        if s3_response.get('LastModified'):
+            headers['Last-Modified'] = http_date(s3_response['LastModified'])
+        headers.set('Content-Disposition', 'attachment' if as_attachment else 'inline',
+                    filename=os.path.basename(file_name))
+
+        status = 200
+        if s3_response.get('ContentRange'):
+            headers['Content-Range'] = s3_response['ContentRange']
+            status = 206
+        return headers, status
+
+    @timed('send-cached')
+    def _send_cached(self, entry, file_name, as_attachment):
+        try:
+            response = send_file(
+                entry.path,
+                mimetype=entry.content_type or 'application/octet-stream',
+                as_attachment=as_attachment,
+                download_name=os.path.basename(file_name),
+                conditional=True,
+                etag=entry.etag.strip('"')
+            )
+        except FileNotFoundError:
+            # Evicted between the lookup and the read
+            return None
+        self.object_cache.record_hit(self.space_name, file_name)
+        logger.info(f'Serving file {file_name} from cache')
+        return response, response.status_code
+
+    def _invalidate_cached(self, file_name):
+        if self.object_cache is not None:
+            self.object_cache.invalidate(self.space_name, file_name)
+
+    def _record_upload(self, file_name):
+        # Keeps the local cache and metadata index in step with our own writes
+        self._invalidate_cached(file_name)
+        if self.metadata_index is not None:
+            try:
+                s3_object = self.s3_resource.Object(self.space_name, file_name)
+                s3_object.load()
+                self.metadata_index.put(self.space_name, file_name, s3_object.content_length,
+                                        s3_object.e_tag, s3_object.last_modified)
+            except ClientError as e:
+                # Reconciliation picks the object up later
+                logger.error(f'Could not index {file_name}: {str(e)}')
+
+    def _record_delete(self, file_names):
+        for file_name in file_names:
+            self._invalidate_cached(file_name)
+        if self.metadata_index is not None:
+            self.metadata_index.remove(self.space_name, file_names)
+        if self.dedup is not None:
+            self.dedup.remove(self.space_name, file_names)
+
+    def _send_object(self, request, as_attachment):
         try:
             file_name = request.args.get('file_name')
             if not file_name:
                 logger.error('No file_name provided')
                 return {'status': 'fail', 'message': 'No file_name provided'}, 400
 
-            local_file_path = os.path.join('/tmp', file_name)
-
             try:
-                self.s3_resource.Object(self.space_name, file_name).download_file(
-                    local_file_path,
-                    Config=self.config,
-                    Callback=ProgressPercentage(local_file_path)
-                )
-                logger.info(f'Downloaded file {file_name} from cloud')
-                return send_file(local_file_path), 200
-            except FileNotFoundError:
-                logger.error(f'File {file_name} not found in cloud')
-                return {'status': 'fail', 'message': f'File {file_name} not found in cloud'}, 404
+                response, status = self._stream_object(request, file_name, as_attachment)
+                logger.info(f'Streaming file {file_name} from cloud')
+                return response, status
             except NoCredentialsError:
                 logger.error('Credentials not available')
                 return {'status': 'fail', 'message': 'Credentials not available'}, 403
             except ClientError as e:
+                if is_not_found(e):
+                    logger.error(f'File {file_name} not found in cloud')
+                    return {'status': 'fail', 'message': f'File {file_name} not found in cloud'}, 404
+                if e.response.get('Error', {}).get('Code') == 'InvalidRange':
+                    logger.error(f'Invalid range for file {file_name}')
+                    return {'status': 'fail', 'message': 'Requested range not satisfiable'}, 416
                 logger.error(f'Client error: {str(e)}')
                 return {'status': 'fail', 'message': str(e)}, 500
 
@@ -132,50 +602,629 @@ class CloudOperations:
             logger.error(f'Exception: {str(e)}')
             return {'status': 'fail', 'message': str(e)}, 500
 
-    def list_files(self):
+    def download_from_cloud(self, request):
+        return self._send_object(request, as_attachment=True)
+
+    def _prefix_keys(self, prefix):
+        paginator = self.s3_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.space_name, Prefix=prefix):
+            for obj in page.get('Contents', []):
+                yield obj['Key']
+
+    def _fetch_head(self, file_name):
+        s3_response = self.s3_client.get_object(Bucket=self.space_name, Key=file_name)
+        head = s3_response['Body'].read(self.zip_options['prefetch_bytes'])
+        return s3_response, head
+
+    def _zip_entry(self, file_name, s3_response, head):
+        body = s3_response['Body']
+        encoding = stored_encoding(s3_response)
+        chunk_size = self.transfer_planner.stream_chunk_size
+
+        def download():
+            try:
+                if head:
+                    TRANSFER_BYTES.inc(len(head), direction='download')
+                    yield head
+                for chunk in body.iter_chunks(chunk_size):
+                    TRANSFER_BYTES.inc(len(chunk), direction='download')
+                    yield chunk
+            finally:
+                body.close()
+
+        # Archive members hold the original content of encoded objects
+        chunks = decompress_chunks(download(), encoding) if encoding else download()
+        mime_type = s3_response.get('ContentType') or mimetypes.guess_type(file_name)[0]
+        return ZipEntry(file_name, chunks, None if encoding else s3_response['ContentLength'],
+                        s3_response.get('LastModified'), mime_type)
+
+    def _zip_entries(self, file_names, errors):
+        # Keeps up to `prefetch` GetObject calls ahead of the entry being
+        # written, so S3 latency overlaps with streaming. Objects that cannot
+        # be fetched are left out and reported in errors.
+        file_names = iter(file_names)
+        pending = deque()
+
+        def refill():
+            while len(pending) < self.zip_options['prefetch']:
+                file_name = next(file_names, None)
+                if file_name is None:
+                    return
+                pending.append((file_name, self.download_executor.submit(self._fetch_head, file_name)))
+
+        def discard(future):
+            if not future.cancelled() and future.exception() is None:
+                future.result()[0]['Body'].close()
+
+        try:
+            refill()
+            while pending:
+                file_name, future = pending.popleft()
+                refill()
+                try:
+                    s3_response, head = future.result()
+                except (ClientError, BotoCoreError) as e:
+                    logger.error(f'Could not add {file_name} to the archive: {str(e)}')
+                    errors.append({'file_name': file_name, 'message': str(e)})
+                    continue
+                yield self._zip_entry(file_name, s3_response, head)
+        finally:
+            # The client went away: drop the prefetched objects
+            for _, future in pending:
+                if not future.cancel():
+                    future.add_done_callback(discard)
+
+    def download_zip(self, request):
+        # Streams the objects as one ZIP archive, without staging them. The
+        # archive is sent as it is built, so objects that fail after the
+        # response has started are listed in ZIP_ERRORS_NAME at its end.
+        try:
+            body = request.get_json(silent=True) or {}
+            file_names = body.get('file_names')
+            prefix = body.get('prefix')
+            if not file_names and not prefix:
+                logger.error('No file_names provided')
+                return {'status': 'fail', 'message': 'No file_names provided'}, 400
+            archive_name = body.get('archive_name') or f"{(prefix or 'download').strip('/') or 'download'}.zip"
+
+            errors = []
+            keys = self._prefix_keys(prefix) if prefix else file_names
+
+            def entries():
+                yield from self._zip_entries(keys, errors)
+                if errors:
+                    yield ZipEntry(ZIP_ERRORS_NAME, [json.dumps(errors, indent=2).encode()],
+                                   mime_type='application/json')
+
+            def generate():
+                TRANSFERS_IN_FLIGHT.inc(direction='download')
+                try:
+                    yield from zip_chunks(entries())
+                finally:
+                    TRANSFERS_IN_FLIGHT.dec(direction='download')
+
+            headers = Headers()
+            headers.set('Content-Disposition', 'attachment', filename=os.path.basename(archive_name))
+            logger.info(f'Streaming a ZIP archive of {prefix or len(file_names)} to the client')
+            return Response(generate(), headers=headers, mimetype='application/zip',
+                            direct_passthrough=True), 200
+
+        except Exception as e:
+            logger.error(f'Exception: {str(e)}')
+            return {'status': 'fail', 'message': str(e)}, 500
+
+    def cache_stats(self):
+        if self.object_cache is None:
+            return {'status': 'success', 'enabled': False}, 200
+        return {'status': 'success', 'enabled': True, 'cache': self.object_cache.stats()}, 200
+
+    def dedup_stats(self):
+        if self.dedup is None:
+            return {'status': 'success', 'enabled': False}, 200
+        return {'status': 'success', 'enabled': True, 'dedup': self.dedup.snapshot()}, 200
+
+    def _listing_args(self, request):
+        # Maps query parameters onto a ListObjectsV2 request
+        list_args = {'Bucket': self.space_name}
+        for arg, param in (('Prefix', 'prefix'), ('Delimiter', 'delimiter'),
+                           ('ContinuationToken', 'continuation_token')):
+            if request.args.get(param):
+                list_args[arg] = request.args[param]
+        if request.args.get('max_keys'):
+            max_keys = int(request.args['max_keys'])
+            if not 1 <= max_keys <= MAX_LIST_KEYS:
+                raise ValueError(f'max_keys must be between 1 and {MAX_LIST_KEYS}')
+            list_args['MaxKeys'] = max_keys
+        return list_args
+
+    def _use_index(self, request):
+        # consistency=index (the default) answers from the metadata index
+        # once it has been synced, consistency=live always asks S3
+        consistency = request.args.get('consistency', 'index')
+        if consistency not in ('index', 'live'):
+            raise ValueError('consistency must be index or live')
+        return (consistency == 'index' and self.metadata_index is not None
+                and self.metadata_index.is_ready(self.space_name))
+
+    def _index_listing(self, list_args):
+        files, prefixes, next_token = self.metadata_index.list(
+            self.space_name,
+            prefix=list_args.get('Prefix', ''),
+            delimiter=list_args.get('Delimiter'),
+            max_keys=list_args.get('MaxKeys', MAX_LIST_KEYS),
+            continuation_token=list_args.get('ContinuationToken')
+        )
+        response = {
+            'status': 'success',
+            'consistency': 'index',
+            'files': files,
+            'prefixes': prefixes,
+            'is_truncated': next_token is not None
+        }
+        if next_token is not None:
+            response['next_continuation_token'] = next_token
+        return response
+
+    def _stream_index_listing(self, list_args):
+        entries = self.metadata_index.iter_objects(self.space_name, prefix=list_args.get('Prefix', ''))
+        return Response((json.dumps(entry) + '\n' for entry in entries), mimetype='application/x-ndjson')
+
+    def _listing_entry(self, obj):
+        mime_type, _ = mimetypes.guess_type(obj['Key'])
+        return {
+            'file_name': obj['Key'],
+            'mime_type': mime_type,
+            'size': obj.get('Size'),
+            'last_modified': obj['LastModified'].isoformat() if obj.get('LastModified') else None,
+            'etag': obj.get('ETag')
+        }
+
+    def list_files(self, request):
         try:
-            bucket = self.s3_resource.Bucket(self.space_name)
-            files = []
-            for obj in bucket.objects.all():
-                mime_type, _ = mimetypes.guess_type(obj.key)
-                files.append({'file_name': obj.key, 'mime_type': mime_type})
-            return {'status': 'success', 'files': files}, 200
+            try:
+                list_args = self._listing_args(request)
+                use_index = self._use_index(request)
+            except ValueError as e:
+                logger.error(f'Invalid listing parameters: {str(e)}')
+                return {'status': 'fail', 'message': str(e)}, 400
+
+            stream = request.args.get('stream', '').lower() in ('1', 'true')
+            if use_index:
+                if stream:
+                    return self._stream_index_listing(list_args), 200
+                return self._index_listing(list_args), 200
+
+            if stream:
+                return self._stream_listing(list_args), 200
+
+            page = self.s3_client.list_objects_v2(**list_args)
+            response = {
+                'status': 'success',
+                'consistency': 'live',
+                'files': [self._listing_entry(obj) for obj in page.get('Contents', [])],
+                'prefixes': [prefix['Prefix'] for prefix in page.get('CommonPrefixes', [])],
+                'is_truncated': page.get('IsTruncated', False)
+            }
+            if page.get('NextContinuationToken'):
+                response['next_continuation_token'] = page['NextContinuationToken']
+            return response, 200
         except ClientError as e:
             logger.error(f'Client error: {str(e)}')
             return {'status': 'fail', 'message': str(e)}, 500
 
-    def view_file(self, request):
+    def _stream_listing(self, list_args):
+        # Full scan as NDJSON, one line per key or common prefix. Only one
+        # ListObjectsV2 page is held in memory at a time.
+        paginator = self.s3_client.get_paginator('list_objects_v2')
+
+        def generate():
+            try:
+                for page in paginator.paginate(**list_args):
+                    for obj in page.get('Contents', []):
+                        yield json.dumps(self._listing_entry(obj)) + '\n'
+                    for prefix in page.get('CommonPrefixes', []):
+                        yield json.dumps({'prefix': prefix['Prefix']}) + '\n'
+            except ClientError as e:
+                logger.error(f'Client error: {str(e)}')
+                yield json.dumps({'status': 'fail', 'message': str(e)}) + '\n'
+
+        return Response(generate(), mimetype='application/x-ndjson')
+
+    def _expires_in(self, value):
+        if value is None:
+            return self.presigned_url_expiry
+        expires_in = int(value)
+        if not 1 <= expires_in <= MAX_PRESIGNED_EXPIRY:
+            raise ValueError(f'expires_in must be between 1 and {MAX_PRESIGNED_EXPIRY}')
+        return expires_in
+
+    def _presign(self, client_method, params, expires_in):
+        return self.s3_client.generate_presigned_url(
+            ClientMethod=client_method,
+            Params=dict(params, Bucket=self.space_name),
+            ExpiresIn=expires_in
+        )
+
+    def _presign_parts(self, file_name, upload_id, part_numbers, expires_in):
+        parts = []
+        for part_number in part_numbers:
+            part_number = int(part_number)
+            if not 1 <= part_number <= MAX_PARTS:
+                raise ValueError(f'part numbers must be between 1 and {MAX_PARTS}')
+            parts.append({
+                'part_number': part_number,
+                'url': self._presign('upload_part', {
+                    'Key': file_name, 'UploadId': upload_id, 'PartNumber': part_number}, expires_in)
+            })
+        return parts
+
+    def presigned_url(self, request):
+        # Clients transfer the object directly with S3 using the returned URL
         try:
             file_name = request.args.get('file_name')
             if not file_name:
                 logger.error('No file_name provided')
                 return {'status': 'fail', 'message': 'No file_name provided'}, 400
 
-            local_file_path = os.path.join('/tmp', file_name)
+            method = request.args.get('method', 'get').lower()
+            try:
+                expires_in = self._expires_in(request.args.get('expires_in'))
+                if method not in ('get', 'put'):
+                    raise ValueError('method must be get or put')
+            except ValueError as e:
+                return {'status': 'fail', 'message': str(e)}, 400
+
+            response = {'status': 'success', 'file_name': file_name, 'method': method.upper(),
+                        'expires_in': expires_in}
+            if method == 'get':
+                response['url'] = self._presign('get_object', {'Key': file_name}, expires_in)
+            else:
+                # The Content-Type is signed, clients must send the same header
+                mime_type = request.args.get('content_type') or mimetypes.guess_type(file_name)[0]
+                params = {'Key': file_name}
+                if mime_type:
+                    params['ContentType'] = mime_type
+                    response['headers'] = {'Content-Type': mime_type}
+                response['url'] = self._presign('put_object', params, expires_in)
+            return response, 200
+        except ClientError as e:
+            logger.error(f'Client error: {str(e)}')
+            return {'status': 'fail', 'message': str(e)}, 500
+
+    def create_multipart_upload(self, request):
+        # Starts a multipart upload whose parts clients PUT straight to S3.
+        # With a size, the part size is planned and every part is presigned.
+        try:
+            body = request.get_json(silent=True) or {}
+            file_name = body.get('file_name')
+            if not file_name:
+                logger.error('No file_name provided')
+                return {'status': 'fail', 'message': 'No file_name provided'}, 400
+
+            try:
+                expires_in = self._expires_in(body.get('expires_in'))
+                size = int(body['size']) if body.get('size') is not None else None
+            except ValueError as e:
+                return {'status': 'fail', 'message': str(e)}, 400
+
+            mime_type = body.get('content_type') or mimetypes.guess_type(file_name)[0]
+            create_args = {'Bucket': self.space_name, 'Key': file_name}
+            if mime_type:
+                create_args['ContentType'] = mime_type
+            upload = self.s3_client.create_multipart_upload(**create_args)
+
+            part_size = self.transfer_planner.part_size(size)
+            response = {'status': 'success', 'file_name': file_name, 'upload_id': upload['UploadId'],
+                        'part_size': part_size, 'expires_in': expires_in}
+            if size is not None:
+                part_count = max(1, math.ceil(size / part_size))
+                response['parts'] = self._presign_parts(
+                    file_name, upload['UploadId'], range(1, part_count + 1), expires_in)
+            logger.info(f'Started multipart upload of {file_name}')
+            return response, 200
+        except ClientError as e:
+            logger.error(f'Client error: {str(e)}')
+            return {'status': 'fail', 'message': str(e)}, 500
+
+    def presign_upload_parts(self, request):
+        try:
+            body = request.get_json(silent=True) or {}
+            file_name = body.get('file_name')
+            upload_id = body.get('upload_id')
+            part_numbers = body.get('part_numbers')
+            if not file_name or not upload_id or not part_numbers:
+                logger.error('No file_name, upload_id or part_numbers provided')
+                return {'status': 'fail', 'message': 'file_name, upload_id and part_numbers are required'}, 400
 
             try:
-                self.s3_resource.Object(self.space_name, file_name).download_file(
-                    local_file_path,
-                    Config=self.config,
-                    Callback=ProgressPercentage(local_file_path)
-                )
-                mime_type, _ = mimetypes.guess_type(local_file_path)
-                logger.info(f'Viewing file {file_name} from cloud')
-                return send_file(local_file_path, mimetype=mime_type), 200
-            except FileNotFoundError:
-                logger.error(f'File {file_name} not found in cloud')
-                return {'status': 'fail', 'message': f'File {file_name} not found in cloud'}, 404
-            except NoCredentialsError:
-                logger.error('Credentials not available')
-                return {'status': 'fail', 'message': 'Credentials not available'}, 403
+                expires_in = self._expires_in(body.get('expires_in'))
+                parts = self._presign_parts(file_name, upload_id, part_numbers, expires_in)
+            except ValueError as e:
+                return {'status': 'fail', 'message': str(e)}, 400
+            return {'status': 'success', 'upload_id': upload_id, 'parts': parts, 'expires_in': expires_in}, 200
+        except ClientError as e:
+            logger.error(f'Client error: {str(e)}')
+            return {'status': 'fail', 'message': str(e)}, 500
+
+    def complete_multipart_upload(self, request):
+        try:
+            body = request.get_json(silent=True) or {}
+            file_name = body.get('file_name')
+            upload_id = body.get('upload_id')
+            parts = body.get('parts')
+            if not file_name or not upload_id or not parts:
+                logger.error('No file_name, upload_id or parts provided')
+                return {'status': 'fail', 'message': 'file_name, upload_id and parts are required'}, 400
+
+            try:
+                completed = sorted(({'PartNumber': int(part['part_number']), 'ETag': part['etag']} for part in parts),
+                                   key=lambda part: part['PartNumber'])
+            except (KeyError, TypeError, ValueError):
+                return {'status': 'fail', 'message': 'parts need a part_number and an etag'}, 400
+
+            self.s3_client.complete_multipart_upload(
+                Bucket=self.space_name, Key=file_name, UploadId=upload_id,
+                MultipartUpload={'Parts': completed})
+            self._record_upload(file_name)
+            logger.info(f'Completed multipart upload of {file_name}')
+            return {'status': 'success', 'uploaded_files': [file_name]}, 200
+        except ClientError as e:
+            logger.error(f'Client error: {str(e)}')
+            return {'status': 'fail', 'message': str(e)}, 500
+
+    def abort_multipart_upload(self, request):
+        try:
+            body = request.get_json(silent=True) or {}
+            file_name = body.get('file_name')
+            upload_id = body.get('upload_id')
+            if not file_name or not upload_id:
+                logger.error('No file_name or upload_id provided')
+                return {'status': 'fail', 'message': 'file_name and upload_id are required'}, 400
+
+            self.s3_client.abort_multipart_upload(
+                Bucket=self.space_name, Key=file_name, UploadId=upload_id)
+            logger.info(f'Aborted multipart upload of {file_name}')
+            return {'status': 'success', 'message': f'Upload {upload_id} aborted'}, 200
+        except ClientError as e:
+            logger.error(f'Client error: {str(e)}')
+            return {'status': 'fail', 'message': str(e)}, 500
+
+    def _session_response(self, session):
+        parts = self.upload_sessions.parts(session['id'])
+        response = {'status': 'success', 'session_id': session['id'], 'file_name': session['key'],
+                    'part_size': session['part_size'], 'size': session['size'],
+                    'received_parts': [part['part_number'] for part in parts],
+                    'received_bytes': sum(part['size'] for part in parts)}
+        if session['size'] is not None:
+            received = set(response['received_parts'])
+            response['part_count'] = self._session_part_count(session)
+            response['missing_parts'] = [number for number in range(1, response['part_count'] + 1)
+                                         if number not in received]
+        return response
+
+    def _session_part_count(self, session):
+        return max(1, math.ceil(session['size'] / session['part_size']))
+
+    def _session_chunk_size(self, session, part_number):
+        # Length a chunk must have, or None when the total size was not
+        # given. Every chunk of such a session is a full part except the one
+        # sent with final=true, which fixes the size.
+        if session['size'] is None:
+            return None
+        if part_number > self._session_part_count(session):
+            raise ValueError(f'part_number must be at most {self._session_part_count(session)}')
+        return min(session['part_size'], session['size'] - (part_number - 1) * session['part_size'])
+
+    def _abort_session(self, session):
+        try:
+            self.s3_client.abort_multipart_upload(
+                Bucket=session['bucket'], Key=session['key'], UploadId=session['upload_id'])
+        except ClientError as e:
+            # Already completed or aborted
+            if e.response.get('Error', {}).get('Code') != 'NoSuchUpload':
+                raise
+
+    def _find_session(self, session_id):
+        session = self.upload_sessions.get(session_id)
+        if session is None:
+            logger.error(f'Upload session {session_id} not found')
+        return session
+
+    def create_upload_session(self, request):
+        # Starts a resumable upload. Chunks are PUT one per part, in any
+        # order and in parallel, and each becomes an S3 part as it arrives.
+        try:
+            body = request.get_json(silent=True) or {}
+            file_name = body.get('file_name')
+            if not file_name:
+                logger.error('No file_name provided')
+                return {'status': 'fail', 'message': 'No file_name provided'}, 400
+            try:
+                size = int(body['size']) if body.get('size') is not None else None
+                if size is not None and size < 0:
+                    raise ValueError('size must not be negative')
+            except ValueError as e:
+                return {'status': 'fail', 'message': str(e)}, 400
+
+            mime_type = body.get('content_type') or mimetypes.guess_type(file_name)[0]
+            create_args = {'Bucket': self.space_name, 'Key': file_name}
+            if mime_type:
+                create_args['ContentType'] = mime_type
+            upload = self.s3_client.create_multipart_upload(**create_args)
+
+            part_size = self.transfer_planner.part_size(size)
+            session_id = self.upload_sessions.create(
+                self.space_name, file_name, upload['UploadId'], part_size, size)
+            logger.info(f'Started upload session {session_id} for {file_name}')
+            return self._session_response(self.upload_sessions.get(session_id)), 200
+        except ClientError as e:
+            logger.error(f'Client error: {str(e)}')
+            return {'status': 'fail', 'message': str(e)}, 500
+
+    def upload_session_chunk(self, request, session_id, part_number):
+        # The chunk is spooled to scratch space, never held in memory, and
+        # only for as long as its UploadPart call runs
+        try:
+            session = self._find_session(session_id)
+            if session is None:
+                return {'status': 'fail', 'message': f'Upload session {session_id} not found'}, 404
+            try:
+                if not 1 <= part_number <= MAX_PARTS:
+                    raise ValueError(f'part_number must be between 1 and {MAX_PARTS}')
+                expected = self._session_chunk_size(session, part_number)
+            except ValueError as e:
+                return {'status': 'fail', 'message': str(e)}, 400
+
+            final = request.args.get('final', '').lower() in ('1', 'true')
+            with self.scratch.area(f'chunk-{session_id}-{part_number}', reserve=session['part_size']) as area:
+                path = area.file('chunk')
+                size = self._spool_chunk(request.stream, path, session['part_size'] + 1)
+                if size > session['part_size']:
+                    return {'status': 'fail', 'message': f"Chunks must be at most {session['part_size']} bytes"}, 413
+                if expected is not None and size != expected:
+                    return {'status': 'fail', 'message': f'Chunk {part_number} must be {expected} bytes'}, 400
+                if expected is None:
+                    # S3 rejects parts below the minimum size when the upload
+                    # is completed, so short chunks are only taken as the
+                    # last one
+                    if not final and size < session['part_size']:
+                        return {'status': 'fail',
+                                'message': f"Chunk {part_number} must be {session['part_size']} bytes "
+                                           f"unless it is sent with final=true"}, 400
+                    if final and not size and part_number > 1:
+                        return {'status': 'fail', 'message': 'The final chunk must not be empty'}, 400
+                    later = [part['part_number'] for part in self.upload_sessions.parts(session_id)
+                             if part['part_number'] > part_number]
+                    if final and later:
+                        return {'status': 'fail', 'message': f'Chunk {part_number} cannot be final, '
+                                                             f'chunks {later} were received'}, 409
+
+                TRANSFERS_IN_FLIGHT.inc(direction='upload')
+                try:
+                    with open(path, 'rb') as body:
+                        response = self.s3_client.upload_part(
+                            Bucket=session['bucket'], Key=session['key'], UploadId=session['upload_id'],
+                            PartNumber=part_number, Body=body, ContentLength=size)
+                finally:
+                    TRANSFERS_IN_FLIGHT.dec(direction='upload')
+            TRANSFER_BYTES.inc(size, direction='upload')
+            self.upload_sessions.add_part(session_id, part_number, response['ETag'], size)
+            if expected is None and final:
+                self.upload_sessions.set_size(session_id, (part_number - 1) * session['part_size'] + size)
+            return {'status': 'success', 'session_id': session_id, 'part_number': part_number,
+                    'etag': response['ETag'], 'size': size}, 200
+        except ScratchSpaceFull as e:
+            logger.error(f'Scratch space full: {str(e)}')
+            return {'status': 'fail', 'message': str(e)}, 503
+        except ClientError as e:
+            logger.error(f'Client error: {str(e)}')
+            return {'status': 'fail', 'message': str(e)}, 500
+
+    def _spool_chunk(self, stream, path, limit):
+        # Reads up to limit bytes into path, however short the stream's
+        # reads are, and returns how many there were
+        size = 0
+        with open(path, 'wb') as spooled:
+            while size < limit:
+                data = stream.read(min(self.transfer_planner.stream_chunk_size, limit - size))
+                if not data:
+                    break
+                spooled.write(data)
+                size += len(data)
+        return size
+
+    def upload_session_status(self, session_id):
+        session = self._find_session(session_id)
+        if session is None:
+            return {'status': 'fail', 'message': f'Upload session {session_id} not found'}, 404
+        return self._session_response(session), 200
+
+    def complete_upload_session(self, session_id):
+        try:
+            session = self._find_session(session_id)
+            if session is None:
+                return {'status': 'fail', 'message': f'Upload session {session_id} not found'}, 404
+            parts = self.upload_sessions.parts(session_id)
+            numbers = [part['part_number'] for part in parts]
+            # Without a size the parts received so far must be 1..n
+            part_count = self._session_part_count(session) if session['size'] is not None else len(parts)
+            missing = [number for number in range(1, part_count + 1) if number not in set(numbers)]
+            if missing or not parts:
+                response = self._session_response(session)
+                response.update(status='fail', message='Upload session has missing parts',
+                                missing_parts=missing or [1])
+                return response, 409
+            # Only sessions stored before chunk sizes were checked can have
+            # short parts before the last one
+            undersized = [part['part_number'] for part in parts[:-1] if part['size'] < session['part_size']]
+            if undersized:
+                response = self._session_response(session)
+                response.update(status='fail', message=f"Parts other than the last must be {session['part_size']} bytes",
+                                undersized_parts=undersized)
+                return response, 409
+
+            self.s3_client.complete_multipart_upload(
+                Bucket=session['bucket'], Key=session['key'], UploadId=session['upload_id'],
+                MultipartUpload={'Parts': [{'PartNumber': part['part_number'], 'ETag': part['etag']}
+                                           for part in parts]})
+            self.upload_sessions.delete(session_id)
+            self._record_upload(session['key'])
+            logger.info(f"Completed upload session {session_id} for {session['key']}")
+            return {'status': 'success', 'uploaded_files': [session['key']],
+                    'size': sum(part['size'] for part in parts)}, 200
+        except ClientError as e:
+            logger.error(f'Client error: {str(e)}')
+            return {'status': 'fail', 'message': str(e)}, 500
+
+    def abort_upload_session(self, session_id):
+        try:
+            session = self._find_session(session_id)
+            if session is None:
+                return {'status': 'fail', 'message': f'Upload session {session_id} not found'}, 404
+            self._abort_session(session)
+            self.upload_sessions.delete(session_id)
+            logger.info(f'Aborted upload session {session_id}')
+            return {'status': 'success', 'message': f'Upload session {session_id} aborted'}, 200
+        except ClientError as e:
+            logger.error(f'Client error: {str(e)}')
+            return {'status': 'fail', 'message': str(e)}, 500
+
+    def file_info(self, request):
+        try:
+            file_name = request.args.get('file_name')
+            if not file_name:
+                logger.error('No file_name provided')
+                return {'status': 'fail', 'message': 'No file_name provided'}, 400
+
+            try:
+                if self._use_index(request):
+                    entry = self.metadata_index.get(self.space_name, file_name)
+                else:
+                    s3_object = self.s3_resource.Object(self.space_name, file_name)
+                    s3_object.load()
+                    entry = self._listing_entry({
+                        'Key': file_name,
+                        'Size': s3_object.content_length,
+                        'ETag': s3_object.e_tag,
+                        'LastModified': s3_object.last_modified
+                    })
             except ClientError as e:
-                logger.error(f'Client error: {str(e)}')
-                return {'status': 'fail', 'message': str(e)}, 500
+                if not is_not_found(e):
+                    raise
+                entry = None
 
-        except Exception as e:
-            logger.error(f'Exception: {str(e)}')
+            if entry is None:
+                return {'status': 'fail', 'message': f'File {file_name} not found in cloud'}, 404
+            return {'status': 'success', 'file': entry}, 200
+        except ValueError as e:
+            return {'status': 'fail', 'message': str(e)}, 400
+        except ClientError as e:
+            logger.error(f'Client error: {str(e)}')
             return {'status': 'fail', 'message': str(e)}, 500
 
+    def view_file(self, request):
+        return self._send_object(request, as_attachment=False)
+
     def delete_file(self, request):
         try:
             file_name = request.args.get('file_name')
@@ -185,6 +1234,7 @@ class CloudOperations:
 
             try:
                 self.s3_resource.Object(self.space_name, file_name).delete()
+                self._record_delete([file_name])
                 logger.info(f'Deleted file {file_name} from cloud')
                 return {'status': 'success', 'message': f'File {file_name} deleted successfully'}, 200
             except ClientError as e:
@@ -195,40 +1245,488 @@ class CloudOperations:
             logger.error(f'Exception: {str(e)}')
             return {'status': 'fail', 'message': str(e)}, 500
 
+    def _delete_batch(self, keys):
+        # One DeleteObjects request for up to 1000 keys. Quiet mode only
+        # reports the keys that failed.
+        try:
+            response = self.s3_client.delete_objects(
+                Bucket=self.space_name,
+                Delete={'Objects': [{'Key': key} for key in keys], 'Quiet': True}
+            )
+        except (ClientError, BotoCoreError) as e:
+            logger.error(f'Could not delete a batch of {len(keys)} files: {str(e)}')
+            return [], self._batch_errors(keys, e)
+
+        deleted, errors = self._batch_result(keys, response)
+        self._record_delete(deleted)
+        return deleted, errors
+
+    def _batch_errors(self, keys, error):
+        # The whole DeleteObjects request failed, or never got an answer
+        code, message = self._copy_error(error)
+        return [{'file_name': key, 'code': code, 'message': message} for key in keys]
+
+    def _batch_result(self, keys, response):
+        errors = [{'file_name': error['Key'], 'code': error.get('Code'), 'message': error.get('Message')}
+                  for error in response.get('Errors', [])]
+        failed = {error['file_name'] for error in errors}
+        return [key for key in keys if key not in failed], errors
+
+    def _delete_batches(self, batches):
+        # Sends the batches concurrently while keeping only a few of them
+        # pending. Only the number of deleted keys is kept, so prefix
+        # deletes of any size run in constant memory apart from the errors.
+        deleted_count = 0
+        errors = []
+        pending = set()
+
+        def collect(done):
+            nonlocal deleted_count
+            for future in done:
+                batch_deleted, batch_errors = future.result()
+                deleted_count += len(batch_deleted)
+                errors.extend(batch_errors)
+
+        for batch in batches:
+            if len(pending) >= MAX_PENDING_DELETE_BATCHES:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+            pending.add(self.delete_executor.submit(self._delete_batch, batch))
+        collect(pending)
+        return deleted_count, errors
+
+    def _prefix_batches(self, prefix):
+        paginator = self.s3_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.space_name, Prefix=prefix,
+                                       PaginationConfig={'PageSize': MAX_DELETE_KEYS}):
+            keys = [obj['Key'] for obj in page.get('Contents', [])]
+            if keys:
+                yield keys
+
+    def _key_batches(self, file_names):
+        return [file_names[i:i + MAX_DELETE_KEYS] for i in range(0, len(file_names), MAX_DELETE_KEYS)]
+
+    def _delete_response(self, file_names, prefix, deleted_count, errors):
+        if prefix:
+            logger.info(f'Deleted {deleted_count} files under {prefix} from cloud')
+            response = {'deleted_count': deleted_count, 'errors': errors}
+            target = f'Files under {prefix}'
+        else:
+            logger.info(f'Deleted {deleted_count} of {len(file_names)} files from cloud')
+            failed = {error['file_name']: error for error in errors}
+            response = {'results': [
+                dict(failed[file_name], status='error') if file_name in failed
+                else {'file_name': file_name, 'status': 'deleted'}
+                for file_name in file_names
+            ]}
+            target = f'Files {file_names}'
+
+        if not errors:
+            response.update(status='success', message=f'{target} deleted successfully')
+            return response, 200
+        if not deleted_count:
+            response.update(status='fail', message=f'{target} could not be deleted')
+            return response, 500
+        response.update(status='partial', message=f'{len(errors)} of {deleted_count + len(errors)} files could not be deleted')
+        return response, 207
+
     def delete_files(self, request):
         try:
-            file_names = request.json.get('file_names')
-            if not file_names:
+            body = request.get_json(silent=True) or {}
+            file_names = body.get('file_names')
+            prefix = body.get('prefix')
+            if not file_names and not prefix:
                 logger.error('No file_names provided')
                 return {'status': 'fail', 'message': 'No file_names provided'}, 400
 
             try:
-                for file_name in file_names:
-                    self.s3_resource.Object(self.space_name, file_name).delete()
-                logger.info(f'Deleted files {file_names} from cloud')
-                return {'status': 'success', 'message': f'Files {file_names} deleted successfully'}, 200
+                if prefix:
+                    # Streams the listing straight into batched deletes
+                    deleted_count, errors = self._delete_batches(self._prefix_batches(prefix))
+                else:
+                    deleted_count, errors = self._delete_batches(self._key_batches(file_names))
             except ClientError as e:
                 logger.error(f'Client error: {str(e)}')
                 return {'status': 'fail', 'message': str(e)}, 500
+            return self._delete_response(file_names, prefix, deleted_count, errors)
 
         except Exception as e:
             logger.error(f'Exception: {str(e)}')
             return {'status': 'fail', 'message': str(e)}, 500
-        
+
+    def _copy_object(self, source, destination, head=None, attributes=None):
+        # Server-side copy, no bytes pass through the service. attributes
+        # (ContentType, Metadata, ...) replace the source's when given. The
+        # copy fails if the source changes while it runs.
+        if head is None:
+            head = self.s3_client.head_object(Bucket=self.space_name, Key=source)
+        copy_source = {'Bucket': self.space_name, 'Key': source}
+        if head['ContentLength'] <= MAX_COPY_OBJECT_SIZE:
+            copy_args = dict(attributes, MetadataDirective='REPLACE') if attributes else {}
+            self.s3_client.copy_object(Bucket=self.space_name, Key=destination, CopySource=copy_source,
+                                       CopySourceIfMatch=head['ETag'], **copy_args)
+        else:
+            create_args = {name: head[name] for name in COPIED_ATTRIBUTES if head.get(name)}
+            create_args.update(attributes or {})
+            self._multipart_copy(copy_source, destination, head, create_args)
+
+        self._record_upload(destination)
+        digest = ((attributes or head).get('Metadata') or {}).get(DIGEST_METADATA)
+        if self.dedup is not None and digest:
+            self.dedup.put(self.space_name, destination, digest, head['ContentLength'])
+
+    def _multipart_copy(self, copy_source, destination, head, create_args):
+        # UploadPartCopy of byte ranges of the source, max_concurrency at a time
+        size = head['ContentLength']
+        part_size = max(COPY_PART_SIZE, math.ceil(size / MAX_PARTS))
+        upload_id = self.s3_client.create_multipart_upload(
+            Bucket=self.space_name, Key=destination, **create_args)['UploadId']
+
+        def copy_part(part_number):
+            start = (part_number - 1) * part_size
+            end = min(start + part_size, size) - 1
+            response = self.s3_client.upload_part_copy(
+                Bucket=self.space_name, Key=destination, UploadId=upload_id, PartNumber=part_number,
+                CopySource=copy_source, CopySourceRange=f'bytes={start}-{end}',
+                CopySourceIfMatch=head['ETag'])
+            return {'PartNumber': part_number, 'ETag': response['CopyPartResult']['ETag']}
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.transfer_planner.max_concurrency,
+                                    thread_name_prefix='copy-part') as pool:
+                parts = list(pool.map(copy_part, range(1, math.ceil(size / part_size) + 1)))
+            self.s3_client.complete_multipart_upload(
+                Bucket=self.space_name, Key=destination, UploadId=upload_id,
+                MultipartUpload={'Parts': parts})
+        except BaseException:
+            try:
+                self.s3_client.abort_multipart_upload(
+                    Bucket=self.space_name, Key=destination, UploadId=upload_id)
+            except (ClientError, BotoCoreError) as e:
+                logger.error(f'Could not abort the copy to {destination}: {str(e)}')
+            raise
+
+    @staticmethod
+    def _copy_error(error):
+        # Error code and message of a failed item, S3 errors keep their code
+        if isinstance(error, ClientError):
+            details = error.response.get('Error', {})
+            return details.get('Code'), details.get('Message', str(error))
+        return type(error).__name__, str(error)
+
+    def _copy_item(self, source, destination, move):
+        # Copies or moves one object and reports the outcome. A move deletes
+        # the source only once the copy exists.
+        result = {'source': source, 'destination': destination}
+        if not source or not destination or source == destination:
+            return dict(result, status='error', code='InvalidRequest',
+                        message='source and destination must be given and differ')
+        try:
+            self._copy_object(source, destination)
+        except Exception as e:
+            # Connection errors and failed parts of a multipart copy are
+            # reported for this item only
+            code, message = self._copy_error(e)
+            logger.error(f'Could not copy {source} to {destination}: {str(e)}')
+            return dict(result, status='error', code=code, message=message)
+        if move:
+            try:
+                self.s3_client.delete_object(Bucket=self.space_name, Key=source)
+                self._record_delete([source])
+            except Exception as e:
+                code, message = self._copy_error(e)
+                logger.error(f'Copied {source} to {destination} but could not delete it: {str(e)}')
+                return dict(result, status='error', code=code,
+                            message=f'Copied, but the source could not be deleted: {message}')
+        return dict(result, status='moved' if move else 'copied')
+
+    def _single_copy(self, source, destination, move):
+        if not source or not destination:
+            logger.error('No source or destination provided')
+            return {'status': 'fail', 'message': 'source and destination are required'}, 400
+        result = self._copy_item(source, destination, move)
+        if result['status'] != 'error':
+            logger.info(f"{'Moved' if move else 'Copied'} {source} to {destination}")
+            return dict(result, status='success'), 200
+        if result['code'] == 'InvalidRequest':
+            return dict(result, status='fail'), 400
+        if result['code'] in ('404', 'NoSuchKey', 'NotFound'):
+            return dict(result, status='fail', message=f'File {source} not found in cloud'), 404
+        return dict(result, status='fail'), 500
+
+    def copy_file(self, request):
+        try:
+            body = request.get_json(silent=True) or {}
+            return self._single_copy(body.get('source'), body.get('destination'), move=False)
+        except Exception as e:
+            logger.error(f'Exception: {str(e)}')
+            return {'status': 'fail', 'message': str(e)}, 500
+
+    def move_file(self, request):
+        try:
+            body = request.get_json(silent=True) or {}
+            return self._single_copy(body.get('source'), body.get('destination'), move=True)
+        except Exception as e:
+            logger.error(f'Exception: {str(e)}')
+            return {'status': 'fail', 'message': str(e)}, 500
+
+    def rename_file(self, request):
+        # Moves a file to a new name in the same folder
+        try:
+            body = request.get_json(silent=True) or {}
+            file_name = body.get('file_name')
+            new_name = body.get('new_name')
+            if not file_name or not new_name or '/' in new_name:
+                logger.error('No file_name or new_name provided')
+                return {'status': 'fail', 'message': 'file_name and a new_name without / are required'}, 400
+            folder = file_name.rpartition('/')[0]
+            return self._single_copy(file_name, f'{folder}/{new_name}' if folder else new_name, move=True)
+        except Exception as e:
+            logger.error(f'Exception: {str(e)}')
+            return {'status': 'fail', 'message': str(e)}, 500
+
+    def _prefix_pairs(self, prefix, destination_prefix):
+        for key in self._prefix_keys(prefix):
+            yield key, destination_prefix + key[len(prefix):]
+
+    def _copy_items(self, pairs, move):
+        # Runs the items concurrently with a bounded number pending, so
+        # prefix copies of any size are not all queued at once
+        results = []
+        pending = set()
+        try:
+            for source, destination in pairs:
+                if len(pending) >= MAX_PENDING_COPIES:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    results.extend(future.result() for future in done)
+                pending.add(self.copy_executor.submit(self._copy_item, source, destination, move))
+        except (ClientError, BotoCoreError) as e:
+            # The prefix listing failed, the items already sent are still
+            # reported
+            code, message = self._copy_error(e)
+            logger.error(f'Could not list the files to copy: {str(e)}')
+            results.append({'source': None, 'destination': None, 'status': 'error', 'code': code,
+                            'message': f'Listing failed: {message}'})
+        results.extend(future.result() for future in pending)
+        return results
+
+    def copy_files(self, request, move=False):
+        # Bulk copy or move: a list of {source, destination} items, or every
+        # file under prefix to the same names under destination_prefix
+        try:
+            body = request.get_json(silent=True) or {}
+            items = body.get('items')
+            prefix = body.get('prefix')
+            destination_prefix = body.get('destination_prefix')
+            if prefix and destination_prefix is not None:
+                if destination_prefix.startswith(prefix) or prefix.startswith(destination_prefix):
+                    return {'status': 'fail', 'message': 'prefix and destination_prefix must not overlap'}, 400
+                pairs = self._prefix_pairs(prefix, destination_prefix)
+            elif items:
+                try:
+                    pairs = [(item['source'], item['destination']) for item in items]
+                except (KeyError, TypeError):
+                    return {'status': 'fail', 'message': 'items need a source and a destination'}, 400
+            else:
+                logger.error('No items provided')
+                return {'status': 'fail', 'message': 'items, or prefix and destination_prefix, are required'}, 400
+
+            results = self._copy_items(pairs, move)
+            verb = 'moved' if move else 'copied'
+            failed = sum(1 for result in results if result['status'] == 'error')
+            logger.info(f'{len(results) - failed} files {verb}, {failed} failed')
+            response = {'results': results}
+            if not failed:
+                response.update(status='success', message=f'{len(results)} files {verb} successfully')
+                return response, 200
+            if failed == len(results):
+                response.update(status='fail', message=f'Files could not be {verb}')
+                return response, 500
+            response.update(status='partial', message=f'{failed} of {len(results)} files could not be {verb}')
+            return response, 207
+
+        except Exception as e:
+            logger.error(f'Exception: {str(e)}')
+            return {'status': 'fail', 'message': str(e)}, 500
+
+    def _compute_transcript(self, url, video_id, transcription_params, stage, slot=None):
+        # Downloads and transcribes one video, timing each step with stage.
+        # The transcription waits for slot, if given, once the audio is in.
+        with self.scratch.area(f'yt-{video_id}') as area:
+            # Room for the download and one copy of it, as an MP3 or
+            # as segments
+            with stage('download'):
+                audio_file = download_yt_audio(url, area.path, reserve=lambda size: area.reserve(2 * size))
+            if needs_conversion(audio_file):
+                with stage('convert'):
+                    audio_file = convert_to_mp3(audio_file)
+            with slot or nullcontext():
+                with stage('transcribe'):
+                    return transcript_yt(audio_file, transcription_params, directory=area.path,
+                                         **self.segment_options)
+
+    def _run_transcription(self, params, job):
+        url = params['url']
+        video_id = get_youtube_id(url)
+        transcription_params = dict(TRANSCRIPTION_PARAMS, **params.get('transcription', {}))
+
+        def compute():
+            return self._compute_transcript(url, video_id, transcription_params, job.stage)
+
+        with timeline('transcribe_yt', job_id=job.id, video_id=video_id):
+            transcript, source = self.transcript_cache.get_or_compute(video_id, transcription_params, compute)
+        return {'video_id': video_id, 'transcript': transcript, 'source': source}
+
+    def _run_transcription_batch(self, params, job):
+        transcription_params = dict(TRANSCRIPTION_PARAMS, **params.get('transcription', {}))
+        urls = params.get('urls')
+        if urls is None:
+            with job.stage('playlist'):
+                urls = playlist_video_urls(params['playlist_url'])[:self.batch_options['max_items']]
+
+        # One item per video, the transcript of a video listed twice is
+        # only computed once
+        items = []
+        seen = set()
+        for url in urls:
+            video_id = get_youtube_id(url)
+            if video_id and video_id in seen:
+                continue
+            seen.add(video_id)
+            item = {'url': url, 'video_id': video_id, 'status': 'queued', 'stages': {}}
+            if video_id:
+                item['key'] = self.transcript_cache.key(video_id, transcription_params)
+            else:
+                item.update(status='failed', error=f'Not a YouTube URL: {url}')
+            items.append(item)
+
+        lock = threading.Lock()
+
+        def report():
+            # Called with lock held
+            counts = {}
+            for item in items:
+                counts[item['status']] = counts.get(item['status'], 0) + 1
+            job.progress({'total': len(items), 'counts': counts, 'items': items})
+
+        def update(item, **fields):
+            with lock:
+                item.update(fields)
+                report()
+
+        def transcribe(item):
+            @contextmanager
+            def stage(name):
+                update(item, status=BATCH_STAGE_STATUS[name])
+                started = time.monotonic()
+                try:
+                    yield
+                finally:
+                    with lock:
+                        item['stages'][name] = round(time.monotonic() - started, 3)
+                        item['status'] = 'waiting'
+
+            def compute():
+                return self._compute_transcript(item['url'], item['video_id'], transcription_params,
+                                                stage, self.transcription_slots)
+
+            try:
+                _, source = self.transcript_cache.get_or_compute(item['video_id'], transcription_params, compute)
+                update(item, status='succeeded', source=source)
+            except Exception as e:
+                logger.error(f"Could not transcribe {item['url']}: {str(e)}")
+                update(item, status='failed', error=str(e))
+
+        with timeline('transcribe_batch', job_id=job.id, items=len(items)):
+            with lock:
+                report()
+            pending = [item for item in items if item['status'] == 'queued']
+            if pending:
+                workers = min(self.batch_options['workers'], len(pending))
+                with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='transcribe-batch') as executor:
+                    list(executor.map(propagate(transcribe), pending))
+
+        succeeded = sum(1 for item in items if item['status'] == 'succeeded')
+        if items and not succeeded:
+            raise RuntimeError(f'None of the {len(items)} videos could be transcribed')
+        return {'total': len(items), 'succeeded': succeeded, 'failed': len(items) - succeeded,
+                'items': [{k: v for k, v in item.items() if k != 'stages'} for item in items]}
+
     def transcribe_yt_url(self, request):
+        # Queues the transcription and returns its job id straight away,
+        # clients poll /jobs/<job_id> for the transcript
         try:
             url = request.args.get('url')
             if not url:
                 logger.error('No url provided')
                 return {'status': 'fail', 'message': 'No url provided'}, 400
 
-            try:
-                logger.info(f'The URL  {url} will be processed')
-                transcript = transcript_yt(download_yt(url))
-                return {'status': 'success', 'transcript': transcript}, 200
-            except ClientError as e:
-                logger.error(f'Client error: {str(e)}')
-                return {'status': 'fail', 'message': str(e)}, 500
+            if not get_youtube_id(url):
+                logger.error(f'Not a YouTube URL: {url}')
+                return {'status': 'fail', 'message': f'Not a YouTube URL: {url}'}, 400
+
+            params = {'url': url}
+            if request.args.get('language'):
+                params['transcription'] = {'language': request.args['language']}
+            job_id = self.job_queue.submit('transcribe_yt', params)
+            logger.info(f'The URL {url} will be processed by job {job_id}')
+            return {'status': 'accepted', 'job_id': job_id, 'status_url': f'/jobs/{job_id}'}, 202
 
         except Exception as e:
             logger.error(f'Exception: {str(e)}')
+            return {'status': 'fail', 'message': str(e)}, 500
+
+    def transcribe_batch(self, request):
+        # Queues one job for a list of videos or a playlist, clients poll
+        # /jobs/<job_id> for per video progress. Transcripts are stored in
+        # the bucket under the transcript cache key of each video.
+        try:
+            data = request.get_json(silent=True) or {}
+            urls = data.get('urls')
+            playlist_url = data.get('playlist_url')
+            if bool(urls) == bool(playlist_url):
+                logger.error('Either urls or playlist_url must be provided')
+                return {'status': 'fail', 'message': 'Either urls or playlist_url must be provided'}, 400
+
+            params = {}
+            if urls:
+                if not isinstance(urls, list) or not all(isinstance(url, str) for url in urls):
+                    logger.error('urls must be a list of URLs')
+                    return {'status': 'fail', 'message': 'urls must be a list of URLs'}, 400
+                if len(urls) > self.batch_options['max_items']:
+                    logger.error(f'Too many URLs: {len(urls)}')
+                    return {'status': 'fail',
+                            'message': f"At most {self.batch_options['max_items']} URLs per batch"}, 400
+                invalid = [url for url in urls if not get_youtube_id(url)]
+                if invalid:
+                    logger.error(f'Not YouTube URLs: {invalid}')
+                    return {'status': 'fail', 'message': 'Not YouTube URLs', 'urls': invalid}, 400
+                params['urls'] = urls
+            else:
+                if 'list=' not in playlist_url:
+                    logger.error(f'Not a YouTube playlist URL: {playlist_url}')
+                    return {'status': 'fail', 'message': f'Not a YouTube playlist URL: {playlist_url}'}, 400
+                params['playlist_url'] = playlist_url
+
+            if data.get('language'):
+                params['transcription'] = {'language': data['language']}
+            job_id = self.job_queue.submit('transcribe_batch', params)
+            logger.info(f'The batch of {len(urls) if urls else playlist_url} will be processed by job {job_id}')
+            return {'status': 'accepted', 'job_id': job_id, 'status_url': f'/jobs/{job_id}'}, 202
+
+        except Exception as e:
+            logger.error(f'Exception: {str(e)}')
+            return {'status': 'fail', 'message': str(e)}, 500
+
+    def job_status(self, job_id):
+        job = self.job_queue.get(job_id)
+        if job is None:
+            return {'status': 'fail', 'message': f'Job {job_id} not found'}, 404
+        return {'status': 'success', 'job': job}, 200
+
+    def job_stats(self):
+        return {
+            'status': 'success',
+            'jobs': self.job_queue.stats(),
+            'transcript_cache': dict(self.transcript_cache.stats)
+        }, 200
@@ -0,0 +1,27 @@
+import os
+import json
+import atexit
+import shutil
+import tempfile
+
+from utils.config import CONFIG_PATH_ENV
+
+# The app reads its configuration when it is imported. Tests use this one,
+# written to a temporary directory, instead of a developer's .env.json.
+TEST_CONFIG = {
+    'API_KEY': 'test-api-key',
+    'AWS_BUCKET_NAME': 'test_space',
+    'AWS_DEFAULT_REGION': 'us-east-1',
+    'AWS_ACCESS_KEY_ID': 'test',
+    'AWS_SECRET_ACCESS_KEY': 'test',
+    'OPENAI_API_KEY': 'test'
+}
+
+_directory = tempfile.mkdtemp(prefix='devi-tests-')
+atexit.register(shutil.rmtree, _directory, True)
+# The stores the app opens on import go here too
+TEST_CONFIG['DATA_DIR'] = os.path.join(_directory, 'data')
+_path = os.path.join(_directory, 'config.json')
+with open(_path, 'w') as config_file:
+    json.dump(TEST_CONFIG, config_file)
+os.environ[CONFIG_PATH_ENV] = _path
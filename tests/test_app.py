@@ -2,16 +2,36 @@ import unittest
 import os
 import json
 import sys
+import io
+import gzip
+import zipfile
+import shutil
+import tempfile
+import time
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from unittest.mock import patch, MagicMock
 from flask import Flask, jsonify
-from boto3.s3.transfer import TransferConfig
-from botocore.exceptions import ClientError
+from botocore.exceptions import ClientError, EndpointConnectionError, ReadTimeoutError
+from botocore.response import StreamingBody
 
 # Add the parent directory to the sys.path so we can import app and cloud_operations
 sys.path.append('..')
 
 from app import app
 from cloud_operations import CloudOperations
+from utils.transfer import TransferPlanner
+from utils.cache import ObjectCache
+from utils.metadata_index import MetadataIndex
+from utils.jobs import JobQueue
+from utils.upload_sessions import UploadSessionStore
+from utils.scratch import ScratchSpace
+from utils.transcripts import TranscriptCache
+from utils.compression import CompressionPolicy
+from utils.dedup import DigestIndex
+from utils.utils import TRANSCRIPTION_PARAMS
+from utils.config import load_config
 
 class CloudOperationsTestCase(unittest.TestCase):
     def setUp(self):
@@ -23,33 +43,71 @@ class CloudOperationsTestCase(unittest.TestCase):
     def tearDown(self):
         self.app_context.pop()
 
+    def build_cloud_ops(self, mock_s3_resource):
+        # Manually set required instance attributes for testing and route
+        # the app's requests to this instance
+        instance = CloudOperations()
+        instance.space_name = 'test_space'
+        instance.region = 'test_region'
+        instance.clients = MagicMock(resource=mock_s3_resource, client=mock_s3_resource.meta.client)
+        instance.transfer_planner = TransferPlanner()
+        instance.presigned_url_expiry = 3600
+        instance.compression = None
+        instance.object_cache = None
+        instance.metadata_index = None
+        instance.dedup = None
+        instance.segment_options = {}
+        instance.transcript_cache = TranscriptCache(mock_s3_resource.meta.client, 'test_space',
+                                                    on_store=instance._record_upload)
+        instance.job_queue = JobQueue(':memory:', workers=1)
+        instance.job_queue.register('transcribe_yt', instance._run_transcription)
+        instance.job_queue.register('transcribe_batch', instance._run_transcription_batch)
+        instance.batch_options = {'workers': 2, 'max_items': 3}
+        instance.transcription_slots = threading.BoundedSemaphore(1)
+        instance.job_queue.start()
+        self.addCleanup(instance.job_queue.stop, 5)
+        instance.upload_executor = ThreadPoolExecutor(max_workers=2)
+        self.addCleanup(instance.upload_executor.shutdown)
+        instance.delete_executor = ThreadPoolExecutor(max_workers=2)
+        self.addCleanup(instance.delete_executor.shutdown)
+        instance.zip_options = {'prefetch': 2, 'prefetch_bytes': 4}
+        instance.upload_sessions = UploadSessionStore(':memory:')
+        instance.copy_executor = ThreadPoolExecutor(max_workers=2)
+        scratch_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, scratch_root, True)
+        instance.scratch = ScratchSpace(scratch_root, quota_bytes=1024 ** 3)
+        self.addCleanup(instance.copy_executor.shutdown)
+        instance.download_executor = ThreadPoolExecutor(max_workers=2)
+        self.addCleanup(instance.download_executor.shutdown)
+
+        patcher = patch('app.cloud_ops', instance)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return instance
+
+    def s3_get_response(self, data, **extra):
+        response = {
+            'Body': StreamingBody(io.BytesIO(data), len(data)),
+            'ContentLength': len(data),
+            'ETag': '"etag"'
+        }
+        response.update(extra)
+        return response
+
     def add_auth_header(self):
-        with open('.env.json') as config_file:
-            config = json.load(config_file)
-        api_key = config.get('API_KEY')
-        return {'Authorization': api_key}
+        return {'Authorization': load_config().get('API_KEY')}
 
     @patch('cloud_operations.boto3.resource')
     @patch('cloud_operations.CloudOperations.__init__', lambda x: None)
     def test_upload_to_cloud_success(self, mock_boto_resource):
         mock_s3_resource = mock_boto_resource.return_value
-        mock_s3_resource.Object.return_value.upload_file = MagicMock()
+        mock_s3_resource.Object.return_value.upload_fileobj = MagicMock()
 
         data = {
             'files': (open('tests/testfile.txt', 'rb'), 'testfile.txt')
         }
 
-        # Manually set required instance attributes for testing
-        instance = CloudOperations()
-        instance.space_name = 'test_space'
-        instance.region = 'test_region'
-        instance.s3_resource = mock_s3_resource
-        instance.config = TransferConfig(
-            multipart_threshold=1024 * 25,
-            max_concurrency=10,
-            multipart_chunksize=1024 * 25,
-            use_threads=True
-        )
+        instance = self.build_cloud_ops(mock_s3_resource)
 
         headers = self.add_auth_header()
         response = self.app.post('/uploadToCloud', content_type='multipart/form-data', data=data, headers=headers)
@@ -62,17 +120,7 @@ class CloudOperationsTestCase(unittest.TestCase):
     def test_upload_to_cloud_no_files(self, mock_boto_resource):
         mock_s3_resource = mock_boto_resource.return_value
 
-        # Manually set required instance attributes for testing
-        instance = CloudOperations()
-        instance.space_name = 'test_space'
-        instance.region = 'test_region'
-        instance.s3_resource = mock_s3_resource
-        instance.config = TransferConfig(
-            multipart_threshold=1024 * 25,
-            max_concurrency=10,
-            multipart_chunksize=1024 * 25,
-            use_threads=True
-        )
+        instance = self.build_cloud_ops(mock_s3_resource)
 
         headers = self.add_auth_header()
         response = self.app.post('/uploadToCloud', headers=headers)
@@ -80,46 +128,198 @@ class CloudOperationsTestCase(unittest.TestCase):
         self.assertEqual(response.status_code, 400)
         self.assertIn('No files part in the request', json.loads(response.data)['message'])
 
+    @patch('cloud_operations.boto3.resource')
+    @patch('cloud_operations.CloudOperations.__init__', lambda x: None)
+    def test_upload_to_cloud_multiple_files(self, mock_boto_resource):
+        mock_s3_resource = mock_boto_resource.return_value
+        mock_s3_resource.Object.return_value.upload_fileobj = MagicMock()
+
+        data = {
+            'files': [
+                (open('tests/testfile.txt', 'rb'), 'first.txt'),
+                (open('tests/testfile.txt', 'rb'), 'second.txt')
+            ]
+        }
+
+        instance = self.build_cloud_ops(mock_s3_resource)
+
+        headers = self.add_auth_header()
+        response = self.app.post('/uploadToCloud', content_type='multipart/form-data', data=data, headers=headers)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)['uploaded_files'], ['first.txt', 'second.txt'])
+        self.assertEqual(mock_s3_resource.Object.return_value.upload_fileobj.call_count, 2)
+        self.assertFalse(os.path.exists('first.txt'))
+
+    @patch('cloud_operations.boto3.resource')
+    @patch('cloud_operations.CloudOperations.__init__', lambda x: None)
+    def test_upload_to_cloud_raw_body(self, mock_boto_resource):
+        mock_s3_resource = mock_boto_resource.return_value
+        uploaded = {}
+        mock_s3_resource.Object.return_value.upload_fileobj = MagicMock(
+            side_effect=lambda stream, **kwargs: uploaded.setdefault('data', stream.read()))
+
+        instance = self.build_cloud_ops(mock_s3_resource)
+
+        headers = self.add_auth_header()
+        response = self.app.post('/uploadToCloud', query_string={'file_name': 'raw.txt'},
+                                 content_type='text/plain', data=b'raw content', headers=headers)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)['uploaded_files'], ['raw.txt'])
+        self.assertEqual(uploaded['data'], b'raw content')
+        mock_s3_resource.Object.assert_called_with('test_space', 'raw.txt')
+
     @patch('cloud_operations.boto3.resource')
     @patch('cloud_operations.CloudOperations.__init__', lambda x: None)
     def test_download_from_cloud_success(self, mock_boto_resource):
         mock_s3_resource = mock_boto_resource.return_value
-        mock_s3_resource.Object.return_value.download_file = MagicMock()
+        mock_s3_resource.Object.return_value.get.return_value = self.s3_get_response(b'This is a test file.')
 
-        # Manually set required instance attributes for testing
-        instance = CloudOperations()
-        instance.space_name = 'test_space'
-        instance.region = 'test_region'
-        instance.s3_resource = mock_s3_resource
-        instance.config = TransferConfig(
-            multipart_threshold=1024 * 25,
-            max_concurrency=10,
-            multipart_chunksize=1024 * 25,
-            use_threads=True
-        )
+        instance = self.build_cloud_ops(mock_s3_resource)
+
+        headers = self.add_auth_header()
+        response = self.app.get('/downloadFromCloud', query_string={'file_name': 'testfile.txt'}, headers=headers)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, b'This is a test file.')
+        self.assertIn('attachment', response.headers['Content-Disposition'])
+
+    @patch('cloud_operations.boto3.resource')
+    @patch('cloud_operations.CloudOperations.__init__', lambda x: None)
+    def test_download_from_cloud_range(self, mock_boto_resource):
+        mock_s3_resource = mock_boto_resource.return_value
+        mock_s3_resource.Object.return_value.get.return_value = self.s3_get_response(
+            b'test', ContentRange='bytes 10-13/20')
 
+        instance = self.build_cloud_ops(mock_s3_resource)
+
+        headers = self.add_auth_header()
+        headers['Range'] = 'bytes=10-13'
+        response = self.app.get('/downloadFromCloud', query_string={'file_name': 'testfile.txt'}, headers=headers)
+
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.data, b'test')
+        self.assertEqual(response.headers['Content-Range'], 'bytes 10-13/20')
+        mock_s3_resource.Object.return_value.get.assert_called_once_with(Range='bytes=10-13')
+
+    @patch('cloud_operations.boto3.resource')
+    @patch('cloud_operations.CloudOperations.__init__', lambda x: None)
+    def test_upload_to_cloud_compressed(self, mock_boto_resource):
+        mock_s3_resource = mock_boto_resource.return_value
+        uploaded = {}
+        mock_s3_resource.Object.return_value.upload_fileobj = MagicMock(
+            side_effect=lambda stream, **kwargs: uploaded.update(data=stream.read(), **kwargs))
+
+        instance = self.build_cloud_ops(mock_s3_resource)
+        instance.compression = CompressionPolicy(min_size=0)
+
+        headers = self.add_auth_header()
+        data = b'{"words": "' + b'word ' * 10000 + b'"}'
+        response = self.app.post('/uploadToCloud', query_string={'file_name': 'notes.json'},
+                                 content_type='application/json', data=data, headers=headers)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(gzip.decompress(uploaded['data']), data)
+        self.assertEqual(uploaded['ExtraArgs']['ContentEncoding'], 'gzip')
+        self.assertEqual(uploaded['ExtraArgs']['Metadata'], {'devi-encoding': 'gzip'})
+
+    @patch('cloud_operations.boto3.resource')
+    @patch('cloud_operations.CloudOperations.__init__', lambda x: None)
+    def test_download_from_cloud_compressed(self, mock_boto_resource):
+        mock_s3_resource = mock_boto_resource.return_value
+        data = b'line of text\n' * 1000
+        compressed = gzip.compress(data)
+        mock_get = mock_s3_resource.Object.return_value.get
+        mock_get.side_effect = lambda **kwargs: self.s3_get_response(
+            compressed, ContentEncoding='gzip', Metadata={'devi-encoding': 'gzip'})
+
+        instance = self.build_cloud_ops(mock_s3_resource)
+
+        # Clients that accept gzip get the stored bytes
         headers = self.add_auth_header()
-        with patch.object(instance.s3_resource.Object.return_value, 'download_file', return_value=None):
-            response = self.app.get('/downloadFromCloud', query_string={'file_name': 'testfile.txt'}, headers=headers)
+        headers['Accept-Encoding'] = 'gzip, deflate'
+        response = self.app.get('/downloadFromCloud', query_string={'file_name': 'notes.txt'}, headers=headers)
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(response.headers['Content-Length'], str(len(compressed)))
+        self.assertEqual(response.data, compressed)
 
+        # Others get them decoded, and the whole object for a Range request
+        headers['Accept-Encoding'] = 'identity'
+        headers['Range'] = 'bytes=0-9'
+        response = self.app.get('/downloadFromCloud', query_string={'file_name': 'notes.txt'}, headers=headers)
         self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual(response.headers['ETag'], 'W/"etag"')
+        self.assertEqual(response.data, data)
+        self.assertEqual(mock_get.call_args.kwargs, {})
+
+    @patch('cloud_operations.boto3.resource')
+    @patch('cloud_operations.CloudOperations.__init__', lambda x: None)
+    def test_upload_to_cloud_deduplicated(self, mock_boto_resource):
+        mock_s3_resource = mock_boto_resource.return_value
+        mock_upload = mock_s3_resource.Object.return_value.upload_fileobj
+        mock_client = mock_s3_resource.meta.client
+        stored = {}
+
+        def head_object(Bucket, Key):
+            if Key not in stored:
+                raise ClientError({'Error': {'Code': '404', 'Message': 'Not Found'}}, 'HeadObject')
+            return {'Metadata': stored[Key], 'ETag': '"etag"', 'ContentType': 'text/plain', 'ContentLength': 12}
+
+        mock_client.head_object.side_effect = head_object
+        mock_upload.side_effect = lambda stream, ExtraArgs, **kwargs: stored.update(
+            {mock_s3_resource.Object.call_args.args[1]: ExtraArgs['Metadata']})
+
+        instance = self.build_cloud_ops(mock_s3_resource)
+        instance.dedup = DigestIndex(':memory:')
+        headers = self.add_auth_header()
+
+        def upload(file_name):
+            data = {'files': (io.BytesIO(b'same content'), file_name)}
+            return self.app.post('/uploadToCloud', content_type='multipart/form-data', data=data, headers=headers)
+
+        self.assertEqual(upload('first.txt').status_code, 200)
+        self.assertEqual(mock_upload.call_count, 1)
+        self.assertIn('devi-sha256', stored['first.txt'])
+
+        # The same content under another name is copied in the bucket
+        self.assertEqual(upload('second.txt').status_code, 200)
+        self.assertEqual(mock_upload.call_count, 1)
+        copy_args = mock_client.copy_object.call_args.kwargs
+        self.assertEqual((copy_args['CopySource']['Key'], copy_args['Key']), ('first.txt', 'second.txt'))
+        self.assertEqual(copy_args['Metadata'], stored['first.txt'])
+        self.assertEqual(copy_args['MetadataDirective'], 'REPLACE')
+
+        # and again under the same name is not sent at all
+        self.assertEqual(upload('first.txt').status_code, 200)
+        self.assertEqual(mock_upload.call_count, 1)
+        self.assertEqual(mock_client.copy_object.call_count, 1)
+
+        response = self.app.get('/dedupStats', headers=headers)
+        stats = json.loads(response.data)['dedup']
+        self.assertEqual((stats['checks'], stats['hits'], stats['bytes_saved']), (3, 2, 24))
+
+    @patch('cloud_operations.boto3.resource')
+    @patch('cloud_operations.CloudOperations.__init__', lambda x: None)
+    def test_download_from_cloud_invalid_range(self, mock_boto_resource):
+        mock_s3_resource = mock_boto_resource.return_value
+        mock_s3_resource.Object.return_value.get.side_effect = ClientError({'Error': {'Code': 'InvalidRange', 'Message': 'Invalid range'}}, 'GetObject')
+
+        instance = self.build_cloud_ops(mock_s3_resource)
+
+        headers = self.add_auth_header()
+        headers['Range'] = 'bytes=100-200'
+        response = self.app.get('/downloadFromCloud', query_string={'file_name': 'testfile.txt'}, headers=headers)
+
+        self.assertEqual(response.status_code, 416)
 
     @patch('cloud_operations.boto3.resource')
     @patch('cloud_operations.CloudOperations.__init__', lambda x: None)
     def test_download_from_cloud_no_file_name(self, mock_boto_resource):
         mock_s3_resource = mock_boto_resource.return_value
 
-        # Manually set required instance attributes for testing
-        instance = CloudOperations()
-        instance.space_name = 'test_space'
-        instance.region = 'test_region'
-        instance.s3_resource = mock_s3_resource
-        instance.config = TransferConfig(
-            multipart_threshold=1024 * 25,
-            max_concurrency=10,
-            multipart_chunksize=1024 * 25,
-            use_threads=True
-        )
+        instance = self.build_cloud_ops(mock_s3_resource)
 
         headers = self.add_auth_header()
         response = self.app.get('/downloadFromCloud', headers=headers)
@@ -131,23 +331,13 @@ class CloudOperationsTestCase(unittest.TestCase):
     @patch('cloud_operations.CloudOperations.__init__', lambda x: None)
     def test_upload_to_cloud_fail(self, mock_boto_resource):
         mock_s3_resource = mock_boto_resource.return_value
-        mock_s3_resource.Object.return_value.upload_file.side_effect = ClientError({'Error': {'Code': '500', 'Message': 'Upload failed'}}, 'Upload')
+        mock_s3_resource.Object.return_value.upload_fileobj.side_effect = ClientError({'Error': {'Code': '500', 'Message': 'Upload failed'}}, 'Upload')
 
         data = {
             'files': (open('tests/testfile.txt', 'rb'), 'testfile.txt')
         }
 
-        # Manually set required instance attributes for testing
-        instance = CloudOperations()
-        instance.space_name = 'test_space'
-        instance.region = 'test_region'
-        instance.s3_resource = mock_s3_resource
-        instance.config = TransferConfig(
-            multipart_threshold=1024 * 25,
-            max_concurrency=10,
-            multipart_chunksize=1024 * 25,
-            use_threads=True
-        )
+        instance = self.build_cloud_ops(mock_s3_resource)
 
         headers = self.add_auth_header()
         response = self.app.post('/uploadToCloud', content_type='multipart/form-data', data=data, headers=headers)
@@ -155,23 +345,42 @@ class CloudOperationsTestCase(unittest.TestCase):
         self.assertEqual(response.status_code, 500)
         self.assertIn('Upload failed', json.loads(response.data)['message'])
 
+    @patch('cloud_operations.boto3.resource')
+    @patch('cloud_operations.CloudOperations.__init__', lambda x: None)
+    def test_upload_to_cloud_connection_error(self, mock_boto_resource):
+        mock_s3_resource = mock_boto_resource.return_value
+        upload_fileobj = mock_s3_resource.Object.return_value.upload_fileobj
+
+        def upload(stream, **kwargs):
+            if upload_fileobj.call_count == 2:
+                raise ReadTimeoutError(endpoint_url='https://s3')
+
+        upload_fileobj.side_effect = upload
+        data = {
+            'files': [
+                (open('tests/testfile.txt', 'rb'), 'first.txt'),
+                (open('tests/testfile.txt', 'rb'), 'second.txt')
+            ]
+        }
+
+        instance = self.build_cloud_ops(mock_s3_resource)
+        instance.upload_executor = ThreadPoolExecutor(max_workers=1)
+        self.addCleanup(instance.upload_executor.shutdown)
+
+        headers = self.add_auth_header()
+        response = self.app.post('/uploadToCloud', content_type='multipart/form-data', data=data, headers=headers)
+
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(json.loads(response.data)['uploaded_files'], ['first.txt'])
+        self.assertIn('Read timeout', json.loads(response.data)['message'])
+
     @patch('cloud_operations.boto3.resource')
     @patch('cloud_operations.CloudOperations.__init__', lambda x: None)
     def test_download_from_cloud_fail(self, mock_boto_resource):
         mock_s3_resource = mock_boto_resource.return_value
-        mock_s3_resource.Object.return_value.download_file.side_effect = ClientError({'Error': {'Code': '404', 'Message': 'File testfile.txt not found in cloud'}}, 'Download')
+        mock_s3_resource.Object.return_value.get.side_effect = ClientError({'Error': {'Code': '404', 'Message': 'File testfile.txt not found in cloud'}}, 'Download')
 
-        # Manually set required instance attributes for testing
-        instance = CloudOperations()
-        instance.space_name = 'test_space'
-        instance.region = 'test_region'
-        instance.s3_resource = mock_s3_resource
-        instance.config = TransferConfig(
-            multipart_threshold=1024 * 25,
-            max_concurrency=10,
-            multipart_chunksize=1024 * 25,
-            use_threads=True
-        )
+        instance = self.build_cloud_ops(mock_s3_resource)
 
         headers = self.add_auth_header()
         response = self.app.get('/downloadFromCloud', query_string={'file_name': 'testfile.txt'}, headers=headers)
@@ -183,53 +392,177 @@ class CloudOperationsTestCase(unittest.TestCase):
     @patch('cloud_operations.CloudOperations.__init__', lambda x: None)
     def test_list_files_success(self, mock_boto_resource):
         mock_s3_resource = mock_boto_resource.return_value
-        mock_bucket = mock_s3_resource.Bucket.return_value
-        mock_bucket.objects.all.return_value = [
-            MagicMock(key='file1.txt'),
-            MagicMock(key='file2.jpg')
-        ]
+        mock_s3_resource.meta.client.list_objects_v2.return_value = {
+            'Contents': [
+                {'Key': 'file1.txt', 'Size': 10, 'ETag': '"a"', 'LastModified': datetime(2024, 6, 1)},
+                {'Key': 'file2.jpg', 'Size': 20, 'ETag': '"b"', 'LastModified': datetime(2024, 6, 2)}
+            ],
+            'IsTruncated': False
+        }
 
-        # Manually set required instance attributes for testing
-        instance = CloudOperations()
-        instance.space_name = 'test_space'
-        instance.region = 'test_region'
-        instance.s3_resource = mock_s3_resource
-        instance.config = TransferConfig(
-            multipart_threshold=1024 * 25,
-            max_concurrency=10,
-            multipart_chunksize=1024 * 25,
-            use_threads=True
-        )
+        instance = self.build_cloud_ops(mock_s3_resource)
 
         headers = self.add_auth_header()
         response = self.app.get('/listFiles', headers=headers)
 
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(len(json.loads(response.data)['files']), 2)
+        files = json.loads(response.data)['files']
+        self.assertEqual(len(files), 2)
+        self.assertEqual(files[1], {'file_name': 'file2.jpg', 'mime_type': 'image/jpeg', 'size': 20,
+                                    'last_modified': '2024-06-02T00:00:00', 'etag': '"b"'})
+
+    @patch('cloud_operations.boto3.resource')
+    @patch('cloud_operations.CloudOperations.__init__', lambda x: None)
+    @patch('app.PROFILING_ENABLED', True)
+    def test_server_timing(self, mock_boto_resource):
+        mock_s3_resource = mock_boto_resource.return_value
+        mock_get = mock_s3_resource.Object.return_value.get
+        mock_get.side_effect = lambda **kwargs: (time.sleep(0.02), self.s3_get_response(b'data'))[1]
+
+        instance = self.build_cloud_ops(mock_s3_resource)
+
+        headers = self.add_auth_header()
+        headers['X-Devi-Profile'] = '1'
+        with self.assertLogs('utils.timing', level='INFO') as logs:
+            response = self.app.get('/viewFile', query_string={'file_name': 'a.txt'}, headers=headers)
+            self.assertEqual(response.data, b'data')
+            response.close()
+
+        self.assertRegex(response.headers['Server-Timing'], r'total;dur=\d+\.\d$')
+        record = json.loads(logs.output[-1].split(':', 2)[2])
+        self.assertEqual((record['timeline'], record['method'], record['status']), ('/viewFile', 'GET', 200))
+        self.assertIn('stream', record['spans'])
+        self.assertIn('profile', record)
+
+    @patch('cloud_operations.boto3.resource')
+    @patch('cloud_operations.CloudOperations.__init__', lambda x: None)
+    def test_list_files_paginated(self, mock_boto_resource):
+        mock_s3_resource = mock_boto_resource.return_value
+        mock_list = mock_s3_resource.meta.client.list_objects_v2
+        mock_list.return_value = {
+            'Contents': [{'Key': 'docs/a.txt', 'Size': 1}],
+            'CommonPrefixes': [{'Prefix': 'docs/old/'}],
+            'IsTruncated': True,
+            'NextContinuationToken': 'token-2'
+        }
+
+        instance = self.build_cloud_ops(mock_s3_resource)
+
+        headers = self.add_auth_header()
+        response = self.app.get('/listFiles', headers=headers, query_string={
+            'prefix': 'docs/', 'delimiter': '/', 'max_keys': 1, 'continuation_token': 'token-1'})
+
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual(data['prefixes'], ['docs/old/'])
+        self.assertEqual(data['next_continuation_token'], 'token-2')
+        mock_list.assert_called_once_with(Bucket='test_space', Prefix='docs/', Delimiter='/',
+                                          ContinuationToken='token-1', MaxKeys=1)
+
+        response = self.app.get('/listFiles', headers=headers, query_string={'max_keys': 5000})
+        self.assertEqual(response.status_code, 400)
+
+    @patch('cloud_operations.boto3.resource')
+    @patch('cloud_operations.CloudOperations.__init__', lambda x: None)
+    def test_list_files_stream(self, mock_boto_resource):
+        mock_s3_resource = mock_boto_resource.return_value
+        mock_s3_resource.meta.client.get_paginator.return_value.paginate.return_value = [
+            {'Contents': [{'Key': 'a.txt', 'Size': 1}]},
+            {'Contents': [{'Key': 'b.txt', 'Size': 2}]}
+        ]
+
+        instance = self.build_cloud_ops(mock_s3_resource)
+
+        headers = self.add_auth_header()
+        response = self.app.get('/listFiles', headers=headers, query_string={'stream': 'true'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        lines = [json.loads(line) for line in response.data.decode().splitlines()]
+        self.assertEqual([line['file_name'] for line in lines], ['a.txt', 'b.txt'])
+
+    @patch('cloud_operations.boto3.resource')
+    @patch('cloud_operations.CloudOperations.__init__', lambda x: None)
+    def test_list_files_from_index(self, mock_boto_resource):
+        mock_s3_resource = mock_boto_resource.return_value
+        mock_s3_resource.meta.client.get_paginator.return_value.paginate.return_value = [
+            {'Contents': [{'Key': 'a.txt', 'Size': 1, 'ETag': '"a"', 'LastModified': datetime(2024, 6, 1)}]}
+        ]
+        mock_s3_resource.Object.return_value.content_length = 2
+        mock_s3_resource.Object.return_value.e_tag = '"b"'
+        mock_s3_resource.Object.return_value.last_modified = datetime(2024, 6, 2)
+
+        instance = self.build_cloud_ops(mock_s3_resource)
+        instance.metadata_index = MetadataIndex(':memory:')
+        instance.metadata_index.sync('test_space', mock_s3_resource.meta.client)
+
+        headers = self.add_auth_header()
+        data = {'files': (open('tests/testfile.txt', 'rb'), 'b.txt')}
+        self.app.post('/uploadToCloud', content_type='multipart/form-data', data=data, headers=headers)
+
+        response = self.app.get('/listFiles', headers=headers)
+        data = json.loads(response.data)
+        self.assertEqual(data['consistency'], 'index')
+        self.assertEqual([entry['file_name'] for entry in data['files']], ['a.txt', 'b.txt'])
+        mock_s3_resource.meta.client.list_objects_v2.assert_not_called()
+
+        self.app.delete('/deleteFile', query_string={'file_name': 'a.txt'}, headers=headers)
+        response = self.app.get('/fileInfo', query_string={'file_name': 'a.txt'}, headers=headers)
+        self.assertEqual(response.status_code, 404)
+        response = self.app.get('/fileInfo', query_string={'file_name': 'b.txt'}, headers=headers)
+        self.assertEqual(json.loads(response.data)['file']['etag'], '"b"')
+
+        mock_s3_resource.meta.client.list_objects_v2.return_value = {'Contents': [], 'IsTruncated': False}
+        response = self.app.get('/listFiles', headers=headers, query_string={'consistency': 'live'})
+        self.assertEqual(json.loads(response.data)['consistency'], 'live')
 
     @patch('cloud_operations.boto3.resource')
     @patch('cloud_operations.CloudOperations.__init__', lambda x: None)
     def test_view_file_success(self, mock_boto_resource):
         mock_s3_resource = mock_boto_resource.return_value
-        mock_s3_resource.Object.return_value.download_file = MagicMock()
+        mock_s3_resource.Object.return_value.get.return_value = self.s3_get_response(
+            b'This is a test file.', ContentType='text/plain')
 
-        # Manually set required instance attributes for testing
-        instance = CloudOperations()
-        instance.space_name = 'test_space'
-        instance.region = 'test_region'
-        instance.s3_resource = mock_s3_resource
-        instance.config = TransferConfig(
-            multipart_threshold=1024 * 25,
-            max_concurrency=10,
-            multipart_chunksize=1024 * 25,
-            use_threads=True
-        )
+        instance = self.build_cloud_ops(mock_s3_resource)
+
+        headers = self.add_auth_header()
+        response = self.app.get('/viewFile', query_string={'file_name': 'testfile.txt'}, headers=headers)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, b'This is a test file.')
+        self.assertTrue(response.mimetype.startswith('text/plain'))
+        self.assertEqual(response.headers['Accept-Ranges'], 'bytes')
+
+    @patch('cloud_operations.boto3.resource')
+    @patch('cloud_operations.CloudOperations.__init__', lambda x: None)
+    def test_view_file_cached(self, mock_boto_resource):
+        mock_s3_resource = mock_boto_resource.return_value
+        mock_get = mock_s3_resource.Object.return_value.get
+        mock_get.return_value = self.s3_get_response(b'This is a test file.', ContentType='text/plain')
+
+        instance = self.build_cloud_ops(mock_s3_resource)
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir, True)
+        instance.object_cache = ObjectCache(cache_dir, max_bytes=1024)
 
         headers = self.add_auth_header()
-        with patch.object(instance.s3_resource.Object.return_value, 'download_file', return_value=None):
-            response = self.app.get('/viewFile', query_string={'file_name': 'testfile.txt'}, headers=headers)
+        response = self.app.get('/viewFile', query_string={'file_name': 'testfile.txt'}, headers=headers)
+        self.assertEqual(response.data, b'This is a test file.')
+
+        # Unchanged objects are answered with 304 and served from disk
+        mock_get.return_value = None
+        mock_get.side_effect = ClientError({'Error': {'Code': '304', 'Message': 'Not Modified'}}, 'GetObject')
+        response = self.app.get('/viewFile', query_string={'file_name': 'testfile.txt'}, headers=headers)
 
         self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, b'This is a test file.')
+        mock_get.assert_called_with(IfNoneMatch='"etag"')
+        stats = json.loads(self.app.get('/cacheStats', headers=headers).data)['cache']
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+        # Deleting through the service drops the cached copy
+        self.app.delete('/deleteFile', query_string={'file_name': 'testfile.txt'}, headers=headers)
+        self.assertIsNone(instance.object_cache.get('test_space', 'testfile.txt'))
 
     @patch('cloud_operations.boto3.resource')
     @patch('cloud_operations.CloudOperations.__init__', lambda x: None)
@@ -237,17 +570,7 @@ class CloudOperationsTestCase(unittest.TestCase):
         mock_s3_resource = mock_boto_resource.return_value
         mock_s3_resource.Object.return_value.delete = MagicMock()
 
-        # Manually set required instance attributes for testing
-        instance = CloudOperations()
-        instance.space_name = 'test_space'
-        instance.region = 'test_region'
-        instance.s3_resource = mock_s3_resource
-        instance.config = TransferConfig(
-            multipart_threshold=1024 * 25,
-            max_concurrency=10,
-            multipart_chunksize=1024 * 25,
-            use_threads=True
-        )
+        instance = self.build_cloud_ops(mock_s3_resource)
 
         headers = self.add_auth_header()
         response = self.app.delete('/deleteFile', query_string={'file_name': 'testfile.txt'}, headers=headers)
@@ -259,19 +582,9 @@ class CloudOperationsTestCase(unittest.TestCase):
     @patch('cloud_operations.CloudOperations.__init__', lambda x: None)
     def test_delete_files_success(self, mock_boto_resource):
         mock_s3_resource = mock_boto_resource.return_value
-        mock_s3_resource.Object.return_value.delete = MagicMock()
+        mock_s3_resource.meta.client.delete_objects.return_value = {}
 
-        # Manually set required instance attributes for testing
-        instance = CloudOperations()
-        instance.space_name = 'test_space'
-        instance.region = 'test_region'
-        instance.s3_resource = mock_s3_resource
-        instance.config = TransferConfig(
-            multipart_threshold=1024 * 25,
-            max_concurrency=10,
-            multipart_chunksize=1024 * 25,
-            use_threads=True
-        )
+        instance = self.build_cloud_ops(mock_s3_resource)
 
         data = {
             'file_names': ['testfile1.txt', 'testfile2.txt']
@@ -282,6 +595,604 @@ class CloudOperationsTestCase(unittest.TestCase):
 
         self.assertEqual(response.status_code, 200)
         self.assertIn('Files [\'testfile1.txt\', \'testfile2.txt\'] deleted successfully', json.loads(response.data)['message'])
+        mock_s3_resource.meta.client.delete_objects.assert_called_once_with(
+            Bucket='test_space',
+            Delete={'Objects': [{'Key': 'testfile1.txt'}, {'Key': 'testfile2.txt'}], 'Quiet': True})
+
+    @patch('cloud_operations.boto3.resource')
+    @patch('cloud_operations.CloudOperations.__init__', lambda x: None)
+    def test_delete_files_partial(self, mock_boto_resource):
+        mock_s3_resource = mock_boto_resource.return_value
+        mock_delete = mock_s3_resource.meta.client.delete_objects
+        mock_delete.side_effect = lambda Bucket, Delete: {
+            'Errors': [{'Key': key['Key'], 'Code': 'AccessDenied', 'Message': 'Access Denied'}
+                       for key in Delete['Objects'] if key['Key'] == 'file1500.txt']
+        }
+
+        instance = self.build_cloud_ops(mock_s3_resource)
+
+        data = {
+            'file_names': [f'file{i}.txt' for i in range(2500)]
+        }
+
+        headers = self.add_auth_header()
+        response = self.app.delete('/deleteFiles', json=data, headers=headers)
+
+        self.assertEqual(response.status_code, 207)
+        results = json.loads(response.data)['results']
+        self.assertEqual(len(results), 2500)
+        self.assertEqual(results[1500], {'file_name': 'file1500.txt', 'status': 'error',
+                                         'code': 'AccessDenied', 'message': 'Access Denied'})
+        self.assertEqual(results[0], {'file_name': 'file0.txt', 'status': 'deleted'})
+        self.assertEqual(mock_delete.call_count, 3)
+
+    @patch('cloud_operations.boto3.resource')
+    @patch('cloud_operations.CloudOperations.__init__', lambda x: None)
+    def test_delete_files_batch_without_answer(self, mock_boto_resource):
+        mock_s3_resource = mock_boto_resource.return_value
+        mock_delete = mock_s3_resource.meta.client.delete_objects
+
+        def delete_objects(Bucket, Delete):
+            # The second batch never reaches S3
+            if Delete['Objects'][0]['Key'] != 'file0.txt':
+                raise EndpointConnectionError(endpoint_url='https://s3')
+            return {}
+
+        mock_delete.side_effect = delete_objects
+
+        instance = self.build_cloud_ops(mock_s3_resource)
+
+        headers = self.add_auth_header()
+        response = self.app.delete('/deleteFiles', json={'file_names': [f'file{i}.txt' for i in range(1500)]},
+                                   headers=headers)
+
+        self.assertEqual(response.status_code, 207)
+        results = json.loads(response.data)['results']
+        self.assertEqual(results[0], {'file_name': 'file0.txt', 'status': 'deleted'})
+        self.assertEqual(results[1000]['status'], 'error')
+        self.assertEqual(results[1000]['code'], 'EndpointConnectionError')
+
+    @patch('cloud_operations.boto3.resource')
+    @patch('cloud_operations.CloudOperations.__init__', lambda x: None)
+    def test_delete_files_prefix(self, mock_boto_resource):
+        mock_s3_resource = mock_boto_resource.return_value
+        mock_s3_resource.meta.client.get_paginator.return_value.paginate.return_value = [
+            {'Contents': [{'Key': 'logs/a'}, {'Key': 'logs/b'}]},
+            {'Contents': [{'Key': 'logs/c'}]}
+        ]
+        mock_s3_resource.meta.client.delete_objects.return_value = {}
+
+        instance = self.build_cloud_ops(mock_s3_resource)
+
+        headers = self.add_auth_header()
+        response = self.app.delete('/deleteFiles', json={'prefix': 'logs/'}, headers=headers)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)['deleted_count'], 3)
+        self.assertEqual(mock_s3_resource.meta.client.delete_objects.call_count, 2)
+
+    @patch('cloud_operations.boto3.resource')
+    @patch('cloud_operations.CloudOperations.__init__', lambda x: None)
+    def test_download_zip(self, mock_boto_resource):
+        mock_s3_resource = mock_boto_resource.return_value
+        objects = {
+            'docs/a.txt': self.s3_get_response(b'text ' * 100, ContentType='text/plain'),
+            'docs/b.bin': self.s3_get_response(bytes(range(256)), LastModified=datetime(2024, 6, 1)),
+            'docs/c.json': self.s3_get_response(gzip.compress(b'{"a": 1}'), Metadata={'devi-encoding': 'gzip'})
+        }
+
+        def get_object(Bucket, Key):
+            if Key not in objects:
+                raise ClientError({'Error': {'Code': 'NoSuchKey', 'Message': 'Not Found'}}, 'GetObject')
+            return objects[Key]
+
+        mock_s3_resource.meta.client.get_object.side_effect = get_object
+        instance = self.build_cloud_ops(mock_s3_resource)
+
+        headers = self.add_auth_header()
+        response = self.app.post('/downloadZip', json={'file_names': list(objects) + ['docs/missing']},
+                                 headers=headers)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/zip')
+        self.assertIn('download.zip', response.headers['Content-Disposition'])
+        archive = zipfile.ZipFile(io.BytesIO(response.data))
+        self.assertEqual(archive.namelist(), list(objects) + ['download-errors.json'])
+        self.assertEqual(archive.read('docs/a.txt'), b'text ' * 100)
+        self.assertEqual(archive.getinfo('docs/a.txt').compress_type, zipfile.ZIP_DEFLATED)
+        self.assertEqual(archive.read('docs/b.bin'), bytes(range(256)))
+        self.assertEqual(archive.getinfo('docs/b.bin').date_time, (2024, 6, 1, 0, 0, 0))
+        self.assertEqual(archive.read('docs/c.json'), b'{"a": 1}')
+        errors = json.loads(archive.read('download-errors.json'))
+        self.assertEqual([error['file_name'] for error in errors], ['docs/missing'])
+
+        response = self.app.post('/downloadZip', json={}, headers=headers)
+        self.assertEqual(response.status_code, 400)
+
+    @patch('cloud_operations.boto3.resource')
+    @patch('cloud_operations.CloudOperations.__init__', lambda x: None)
+    def test_upload_session(self, mock_boto_resource):
+        mock_s3_client = mock_boto_resource.return_value.meta.client
+        mock_s3_client.create_multipart_upload.return_value = {'UploadId': 'upload-1'}
+        mock_s3_client.upload_part.side_effect = lambda PartNumber, **kwargs: {'ETag': f'"etag-{PartNumber}"'}
+
+        instance = self.build_cloud_ops(mock_boto_resource.return_value)
+        instance.transfer_planner = TransferPlanner(min_part_size=5 * 1024 * 1024)
+        part_size = 5 * 1024 * 1024
+        size = 2 * part_size + 10
+
+        headers = self.add_auth_header()
+        response = self.app.post('/uploadSessions', json={'file_name': 'big.bin', 'size': size}, headers=headers)
+        session = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((session['part_size'], session['part_count']), (part_size, 3))
+        session_url = f"/uploadSessions/{session['session_id']}"
+
+        # Chunks arrive out of order and are checked against the planned sizes
+        response = self.app.put(f'{session_url}/chunks/3', data=b'x' * 10, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        response = self.app.put(f'{session_url}/chunks/1', data=b'x' * 10, headers=headers)
+        self.assertEqual(response.status_code, 400)
+        response = self.app.put(f'{session_url}/chunks/4', data=b'x', headers=headers)
+        self.assertEqual(response.status_code, 400)
+        response = self.app.put(f'{session_url}/chunks/1', data=b'x' * part_size, headers=headers)
+        self.assertEqual(json.loads(response.data)['etag'], '"etag-1"')
+
+        status = json.loads(self.app.get(session_url, headers=headers).data)
+        self.assertEqual(status['received_parts'], [1, 3])
+        self.assertEqual(status['missing_parts'], [2])
+        response = self.app.post(f'{session_url}/complete', headers=headers)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(json.loads(response.data)['missing_parts'], [2])
+
+        self.app.put(f'{session_url}/chunks/2', data=b'x' * part_size, headers=headers)
+        response = self.app.post(f'{session_url}/complete', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)['size'], size)
+        mock_s3_client.complete_multipart_upload.assert_called_once_with(
+            Bucket='test_space', Key='big.bin', UploadId='upload-1',
+            MultipartUpload={'Parts': [{'PartNumber': n, 'ETag': f'"etag-{n}"'} for n in (1, 2, 3)]})
+        self.assertEqual(self.app.get(session_url, headers=headers).status_code, 404)
+
+    @patch('cloud_operations.boto3.resource')
+    @patch('cloud_operations.CloudOperations.__init__', lambda x: None)
+    def test_upload_session_without_size(self, mock_boto_resource):
+        mock_s3_client = mock_boto_resource.return_value.meta.client
+        mock_s3_client.create_multipart_upload.return_value = {'UploadId': 'upload-1'}
+        mock_s3_client.upload_part.side_effect = lambda PartNumber, **kwargs: {'ETag': f'"etag-{PartNumber}"'}
+
+        instance = self.build_cloud_ops(mock_boto_resource.return_value)
+
+        headers = self.add_auth_header()
+        session = json.loads(self.app.post('/uploadSessions', json={'file_name': 'a.bin'}, headers=headers).data)
+        part_size = session['part_size']
+        session_url = f"/uploadSessions/{session['session_id']}"
+
+        # A short chunk is only accepted as the last one
+        response = self.app.put(f'{session_url}/chunks/1', data=b'x' * 100, headers=headers)
+        self.assertEqual(response.status_code, 400)
+        self.app.put(f'{session_url}/chunks/3', data=b'x' * part_size, headers=headers)
+        response = self.app.put(f'{session_url}/chunks/2', query_string={'final': 'true'}, data=b'x' * 100,
+                                headers=headers)
+        self.assertEqual(response.status_code, 409)
+
+        self.app.put(f'{session_url}/chunks/1', data=b'x' * part_size, headers=headers)
+        instance.upload_sessions.delete(session['session_id'])
+        session = json.loads(self.app.post('/uploadSessions', json={'file_name': 'a.bin'}, headers=headers).data)
+        session_url = f"/uploadSessions/{session['session_id']}"
+        self.app.put(f'{session_url}/chunks/1', data=b'x' * part_size, headers=headers)
+        response = self.app.put(f'{session_url}/chunks/2', query_string={'final': 'true'}, data=b'x' * 100,
+                                headers=headers)
+        self.assertEqual(response.status_code, 200)
+        status = json.loads(self.app.get(session_url, headers=headers).data)
+        self.assertEqual((status['size'], status['part_count'], status['missing_parts']), (part_size + 100, 2, []))
+        response = self.app.put(f'{session_url}/chunks/3', data=b'x' * part_size, headers=headers)
+        self.assertEqual(response.status_code, 400)
+        response = self.app.post(f'{session_url}/complete', headers=headers)
+        self.assertEqual(response.status_code, 200)
+
+        # Sessions stored before chunk sizes were checked
+        session_id = instance.upload_sessions.create('test_space', 'b.bin', 'upload-2', part_size)
+        instance.upload_sessions.add_part(session_id, 1, '"a"', 100)
+        instance.upload_sessions.add_part(session_id, 2, '"b"', 100)
+        response = self.app.post(f'/uploadSessions/{session_id}/complete', headers=headers)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(json.loads(response.data)['undersized_parts'], [1])
+        mock_s3_client.complete_multipart_upload.assert_called_once()
+
+    @patch('cloud_operations.boto3.resource')
+    @patch('cloud_operations.CloudOperations.__init__', lambda x: None)
+    def test_upload_session_chunk_short_reads(self, mock_boto_resource):
+        class ShortReads(object):
+            # Hands out at most 1000 bytes per read, like a slow client
+            def __init__(self, data):
+                self.data = data
+
+            def read(self, size=-1):
+                chunk, self.data = self.data[:min(size, 1000)], self.data[min(size, 1000):]
+                return chunk
+
+        mock_s3_client = mock_boto_resource.return_value.meta.client
+        received = []
+        mock_s3_client.upload_part.side_effect = lambda Body, ContentLength, **kwargs: (
+            received.append((Body.read(), ContentLength)) or {'ETag': '"etag-1"'})
+        instance = self.build_cloud_ops(mock_boto_resource.return_value)
+        session_id = instance.upload_sessions.create('test_space', 'a.bin', 'upload-1', 5000, size=5000)
+
+        response, status = instance.upload_session_chunk(
+            MagicMock(args={}, stream=ShortReads(b'x' * 5000)), session_id, 1)
+
+        self.assertEqual((status, response['size']), (200, 5000))
+        self.assertEqual(received, [(b'x' * 5000, 5000)])
+        response, status = instance.upload_session_chunk(
+            MagicMock(args={}, stream=ShortReads(b'x' * 5001)), session_id, 1)
+        self.assertEqual(status, 413)
+
+    @patch('cloud_operations.boto3.resource')
+    @patch('cloud_operations.CloudOperations.__init__', lambda x: None)
+    def test_upload_session_abort(self, mock_boto_resource):
+        mock_s3_client = mock_boto_resource.return_value.meta.client
+        mock_s3_client.create_multipart_upload.return_value = {'UploadId': 'upload-1'}
+
+        instance = self.build_cloud_ops(mock_boto_resource.return_value)
+
+        headers = self.add_auth_header()
+        session = json.loads(self.app.post('/uploadSessions', json={'file_name': 'a.bin'}, headers=headers).data)
+        self.assertNotIn('part_count', session)
+        response = self.app.delete(f"/uploadSessions/{session['session_id']}", headers=headers)
+        self.assertEqual(response.status_code, 200)
+        mock_s3_client.abort_multipart_upload.assert_called_once_with(
+            Bucket='test_space', Key='a.bin', UploadId='upload-1')
+        self.assertIsNone(instance.upload_sessions.get(session['session_id']))
+
+    @patch('cloud_operations.boto3.resource')
+    @patch('cloud_operations.CloudOperations.__init__', lambda x: None)
+    def test_copy_move_and_rename(self, mock_boto_resource):
+        mock_s3_client = mock_boto_resource.return_value.meta.client
+        mock_s3_client.head_object.return_value = {'ContentLength': 10, 'ETag': '"etag"'}
+
+        instance = self.build_cloud_ops(mock_boto_resource.return_value)
+        headers = self.add_auth_header()
+
+        response = self.app.post('/copyFile', json={'source': 'a.txt', 'destination': 'b.txt'}, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)['status'], 'success')
+        mock_s3_client.copy_object.assert_called_once_with(
+            Bucket='test_space', Key='b.txt', CopySource={'Bucket': 'test_space', 'Key': 'a.txt'},
+            CopySourceIfMatch='"etag"')
+        mock_s3_client.delete_object.assert_not_called()
+
+        response = self.app.post('/renameFile', json={'file_name': 'docs/a.txt', 'new_name': 'c.txt'},
+                                 headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(mock_s3_client.copy_object.call_args.kwargs['Key'], 'docs/c.txt')
+        mock_s3_client.delete_object.assert_called_once_with(Bucket='test_space', Key='docs/a.txt')
+
+        response = self.app.post('/moveFile', json={'source': 'a.txt', 'destination': 'a.txt'}, headers=headers)
+        self.assertEqual(response.status_code, 400)
+
+        mock_s3_client.head_object.side_effect = ClientError({'Error': {'Code': '404', 'Message': 'Not Found'}},
+                                                             'HeadObject')
+        response = self.app.post('/moveFile', json={'source': 'gone.txt', 'destination': 'x.txt'}, headers=headers)
+        self.assertEqual(response.status_code, 404)
+
+    @patch('cloud_operations.boto3.resource')
+    @patch('cloud_operations.CloudOperations.__init__', lambda x: None)
+    @patch('cloud_operations.MAX_COPY_OBJECT_SIZE', 100)
+    @patch('cloud_operations.COPY_PART_SIZE', 40)
+    def test_copy_large_file_in_parts(self, mock_boto_resource):
+        mock_s3_client = mock_boto_resource.return_value.meta.client
+        mock_s3_client.head_object.return_value = {'ContentLength': 101, 'ETag': '"etag"',
+                                                   'ContentType': 'video/mp4', 'Metadata': {'a': 'b'}}
+        mock_s3_client.create_multipart_upload.return_value = {'UploadId': 'upload-1'}
+        mock_s3_client.upload_part_copy.side_effect = lambda PartNumber, **kwargs: \
+            {'CopyPartResult': {'ETag': f'"part-{PartNumber}"'}}
+
+        instance = self.build_cloud_ops(mock_boto_resource.return_value)
+        headers = self.add_auth_header()
+        response = self.app.post('/copyFile', json={'source': 'a.mp4', 'destination': 'b.mp4'}, headers=headers)
+
+        self.assertEqual(response.status_code, 200)
+        mock_s3_client.copy_object.assert_not_called()
+        mock_s3_client.create_multipart_upload.assert_called_once_with(
+            Bucket='test_space', Key='b.mp4', ContentType='video/mp4', Metadata={'a': 'b'})
+        ranges = sorted(call.kwargs['CopySourceRange'] for call in mock_s3_client.upload_part_copy.call_args_list)
+        self.assertEqual(ranges, ['bytes=0-39', 'bytes=40-79', 'bytes=80-100'])
+        mock_s3_client.complete_multipart_upload.assert_called_once_with(
+            Bucket='test_space', Key='b.mp4', UploadId='upload-1',
+            MultipartUpload={'Parts': [{'PartNumber': n, 'ETag': f'"part-{n}"'} for n in (1, 2, 3)]})
+
+    @patch('cloud_operations.boto3.resource')
+    @patch('cloud_operations.CloudOperations.__init__', lambda x: None)
+    def test_move_files(self, mock_boto_resource):
+        mock_s3_client = mock_boto_resource.return_value.meta.client
+        mock_s3_client.head_object.return_value = {'ContentLength': 10, 'ETag': '"etag"'}
+
+        def copy_object(Key, **kwargs):
+            if Key == 'new/locked.txt':
+                raise ClientError({'Error': {'Code': 'AccessDenied', 'Message': 'Access Denied'}}, 'CopyObject')
+
+        mock_s3_client.copy_object.side_effect = copy_object
+        mock_s3_client.get_paginator.return_value.paginate.return_value = [
+            {'Contents': [{'Key': 'old/a.txt'}, {'Key': 'old/locked.txt'}]}
+        ]
+
+        instance = self.build_cloud_ops(mock_boto_resource.return_value)
+        headers = self.add_auth_header()
+        response = self.app.post('/moveFiles', json={'prefix': 'old/', 'destination_prefix': 'new/'},
+                                 headers=headers)
+
+        self.assertEqual(response.status_code, 207)
+        results = {result['source']: result for result in json.loads(response.data)['results']}
+        self.assertEqual(results['old/a.txt'], {'source': 'old/a.txt', 'destination': 'new/a.txt', 'status': 'moved'})
+        self.assertEqual(results['old/locked.txt']['code'], 'AccessDenied')
+        mock_s3_client.delete_object.assert_called_once_with(Bucket='test_space', Key='old/a.txt')
+
+        response = self.app.post('/copyFiles', json={'items': [{'source': 'a.txt', 'destination': 'b.txt'}]},
+                                 headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)['results'][0]['status'], 'copied')
+
+        response = self.app.post('/copyFiles', json={'prefix': 'old/', 'destination_prefix': 'old/sub/'},
+                                 headers=headers)
+        self.assertEqual(response.status_code, 400)
+
+    @patch('cloud_operations.boto3.resource')
+    @patch('cloud_operations.CloudOperations.__init__', lambda x: None)
+    def test_move_files_connection_errors(self, mock_boto_resource):
+        mock_s3_client = mock_boto_resource.return_value.meta.client
+        mock_s3_client.head_object.return_value = {'ContentLength': 10, 'ETag': '"etag"'}
+
+        def copy_object(Key, **kwargs):
+            if Key == 'new/far.txt':
+                raise EndpointConnectionError(endpoint_url='https://s3')
+
+        def pages(**kwargs):
+            yield {'Contents': [{'Key': 'old/a.txt'}, {'Key': 'old/far.txt'}]}
+            raise ReadTimeoutError(endpoint_url='https://s3')
+
+        mock_s3_client.copy_object.side_effect = copy_object
+        mock_s3_client.get_paginator.return_value.paginate.side_effect = pages
+
+        instance = self.build_cloud_ops(mock_boto_resource.return_value)
+        headers = self.add_auth_header()
+        response = self.app.post('/moveFiles', json={'prefix': 'old/', 'destination_prefix': 'new/'},
+                                 headers=headers)
+
+        self.assertEqual(response.status_code, 207)
+        results = {result['source']: result for result in json.loads(response.data)['results']}
+        self.assertEqual(results['old/a.txt']['status'], 'moved')
+        self.assertEqual(results['old/far.txt']['code'], 'EndpointConnectionError')
+        self.assertEqual(results[None]['code'], 'ReadTimeoutError')
+        mock_s3_client.delete_object.assert_called_once_with(Bucket='test_space', Key='old/a.txt')
+
+    @patch('cloud_operations.boto3.resource')
+    @patch('cloud_operations.CloudOperations.__init__', lambda x: None)
+    def test_presigned_url(self, mock_boto_resource):
+        mock_s3_client = mock_boto_resource.return_value.meta.client
+        mock_s3_client.generate_presigned_url.side_effect = lambda ClientMethod, Params, ExpiresIn: \
+            f"https://s3/{Params['Key']}?method={ClientMethod}&expires={ExpiresIn}"
+
+        instance = self.build_cloud_ops(mock_boto_resource.return_value)
+
+        headers = self.add_auth_header()
+        response = self.app.get('/presignedUrl', query_string={'file_name': 'a.txt'}, headers=headers)
+        self.assertEqual(json.loads(response.data)['url'], 'https://s3/a.txt?method=get_object&expires=3600')
+
+        response = self.app.get('/presignedUrl', query_string={'file_name': 'a.txt', 'method': 'put', 'expires_in': 60},
+                                headers=headers)
+        data = json.loads(response.data)
+        self.assertEqual(data['url'], 'https://s3/a.txt?method=put_object&expires=60')
+        self.assertEqual(data['headers'], {'Content-Type': 'text/plain'})
+        mock_s3_client.generate_presigned_url.assert_called_with(
+            ClientMethod='put_object', Params={'Key': 'a.txt', 'ContentType': 'text/plain', 'Bucket': 'test_space'},
+            ExpiresIn=60)
+
+        response = self.app.get('/presignedUrl', query_string={'file_name': 'a.txt', 'expires_in': 10 ** 7},
+                                headers=headers)
+        self.assertEqual(response.status_code, 400)
+
+    @patch('cloud_operations.boto3.resource')
+    @patch('cloud_operations.CloudOperations.__init__', lambda x: None)
+    def test_presigned_multipart_upload(self, mock_boto_resource):
+        mock_s3_client = mock_boto_resource.return_value.meta.client
+        mock_s3_client.create_multipart_upload.return_value = {'UploadId': 'upload-1'}
+        mock_s3_client.generate_presigned_url.side_effect = lambda ClientMethod, Params, ExpiresIn: \
+            f"https://s3/{Params['Key']}?part={Params['PartNumber']}"
+
+        instance = self.build_cloud_ops(mock_boto_resource.return_value)
+
+        headers = self.add_auth_header()
+        response = self.app.post('/multipartUploads', json={'file_name': 'big.bin', 'size': 20 * 1024 * 1024},
+                                 headers=headers)
+        data = json.loads(response.data)
+        self.assertEqual(data['upload_id'], 'upload-1')
+        self.assertEqual(data['part_size'], 8 * 1024 * 1024)
+        self.assertEqual([part['url'] for part in data['parts']],
+                         ['https://s3/big.bin?part=1', 'https://s3/big.bin?part=2', 'https://s3/big.bin?part=3'])
+
+        response = self.app.post('/multipartUploads/complete', headers=headers, json={
+            'file_name': 'big.bin', 'upload_id': 'upload-1',
+            'parts': [{'part_number': 2, 'etag': '"b"'}, {'part_number': 1, 'etag': '"a"'}]})
+        self.assertEqual(response.status_code, 200)
+        mock_s3_client.complete_multipart_upload.assert_called_once_with(
+            Bucket='test_space', Key='big.bin', UploadId='upload-1',
+            MultipartUpload={'Parts': [{'PartNumber': 1, 'ETag': '"a"'}, {'PartNumber': 2, 'ETag': '"b"'}]})
+
+    @patch('cloud_operations.boto3.resource')
+    @patch('cloud_operations.CloudOperations.__init__', lambda x: None)
+    @patch('cloud_operations.transcript_yt', return_value='hello world')
+    @patch('cloud_operations.convert_to_mp3')
+    @patch('cloud_operations.download_yt_audio', return_value='/tmp/5hMgUbmrENM.m4a')
+    def test_transcribe_yt_url_job(self, mock_download, mock_convert, mock_transcript, mock_boto_resource):
+        mock_s3_client = mock_boto_resource.return_value.meta.client
+        mock_s3_client.get_object.side_effect = ClientError({'Error': {'Code': 'NoSuchKey', 'Message': 'Not found'}}, 'GetObject')
+        mock_s3_client.get_paginator.return_value.paginate.return_value = []
+        mock_boto_resource.return_value.Object.return_value.content_length = 11
+        mock_boto_resource.return_value.Object.return_value.e_tag = '"t"'
+        mock_boto_resource.return_value.Object.return_value.last_modified = datetime(2024, 6, 1)
+        instance = self.build_cloud_ops(mock_boto_resource.return_value)
+        instance.metadata_index = MetadataIndex(':memory:')
+        instance.metadata_index.sync('test_space', mock_s3_client)
+
+        headers = self.add_auth_header()
+        response = self.app.post('/transcribeYTUrl', query_string={'url': 'https://www.youtube.com/watch?v=5hMgUbmrENM'},
+                                 headers=headers)
+
+        self.assertEqual(response.status_code, 202)
+        job_id = json.loads(response.data)['job_id']
+
+        for _ in range(100):
+            job = json.loads(self.app.get(f'/jobs/{job_id}', headers=headers).data)['job']
+            if job['status'] not in ('pending', 'running'):
+                break
+            time.sleep(0.01)
+
+        self.assertEqual(job['status'], 'succeeded')
+        self.assertEqual(job['result'], {'video_id': '5hMgUbmrENM', 'transcript': 'hello world', 'source': 'computed'})
+        self.assertEqual(set(job['stages']), {'download', 'transcribe'})
+        mock_convert.assert_not_called()
+        # The job's scratch directory is gone once it is done
+        directory = mock_transcript.call_args.kwargs['directory']
+        mock_transcript.assert_called_once_with('/tmp/5hMgUbmrENM.m4a', TRANSCRIPTION_PARAMS, directory=directory)
+        self.assertEqual(mock_download.call_args.args[1], directory)
+        self.assertTrue(directory.startswith(instance.scratch.directory))
+        self.assertFalse(os.path.exists(directory))
+        key = mock_s3_client.put_object.call_args.kwargs['Key']
+        self.assertTrue(key.startswith('transcripts/5hMgUbmrENM/'))
+        # The stored transcript is indexed like an upload
+        response = self.app.get('/fileInfo', query_string={'file_name': key}, headers=headers)
+        self.assertEqual(json.loads(response.data)['file']['size'], 11)
+
+        stats = json.loads(self.app.get('/jobs/stats', headers=headers).data)['jobs']
+        self.assertEqual(stats['queue_depth'], 0)
+        self.assertEqual(stats['stages']['download']['count'], 1)
+
+    def wait_for_job(self, job_id, headers):
+        for _ in range(200):
+            job = json.loads(self.app.get(f'/jobs/{job_id}', headers=headers).data)['job']
+            if job['status'] not in ('pending', 'running'):
+                return job
+            time.sleep(0.01)
+        self.fail(f'Job {job_id} did not finish')
+
+    @patch('cloud_operations.boto3.resource')
+    @patch('cloud_operations.CloudOperations.__init__', lambda x: None)
+    @patch('cloud_operations.transcript_yt', return_value='hello world')
+    @patch('cloud_operations.download_yt_audio')
+    def test_transcribe_batch(self, mock_download, mock_transcript, mock_boto_resource):
+        mock_s3_client = mock_boto_resource.return_value.meta.client
+        mock_s3_client.get_object.side_effect = ClientError({'Error': {'Code': 'NoSuchKey', 'Message': 'Not found'}}, 'GetObject')
+        instance = self.build_cloud_ops(mock_boto_resource.return_value)
+
+        def download(url, directory, reserve=None):
+            if 'bbbbbbbbbbb' in url:
+                raise RuntimeError('Video unavailable')
+            return os.path.join(directory, url[-11:] + '.m4a')
+        mock_download.side_effect = download
+
+        headers = self.add_auth_header()
+        urls = ['https://www.youtube.com/watch?v=aaaaaaaaaaa', 'https://youtu.be/bbbbbbbbbbb',
+                'https://www.youtube.com/watch?v=aaaaaaaaaaa']
+        response = self.app.post('/transcribeBatch', json={'urls': urls}, headers=headers)
+
+        self.assertEqual(response.status_code, 202)
+        job = self.wait_for_job(json.loads(response.data)['job_id'], headers)
+
+        self.assertEqual(job['status'], 'succeeded')
+        self.assertEqual(job['result']['total'], 2)
+        self.assertEqual(job['result']['succeeded'], 1)
+        first, second = job['result']['items']
+        self.assertEqual(first['status'], 'succeeded')
+        self.assertEqual(first['source'], 'computed')
+        self.assertEqual(first['key'], instance.transcript_cache.key('aaaaaaaaaaa', TRANSCRIPTION_PARAMS))
+        self.assertEqual(second['status'], 'failed')
+        self.assertEqual(second['error'], 'Video unavailable')
+        mock_s3_client.put_object.assert_called_once()
+        self.assertEqual(mock_s3_client.put_object.call_args.kwargs['Key'], first['key'])
+
+        progress = job['progress']
+        self.assertEqual(progress['counts'], {'succeeded': 1, 'failed': 1})
+        self.assertEqual(set(progress['items'][0]['stages']), {'download', 'transcribe'})
+
+    @patch('cloud_operations.boto3.resource')
+    @patch('cloud_operations.CloudOperations.__init__', lambda x: None)
+    @patch('cloud_operations.transcript_yt', return_value='hello world')
+    @patch('cloud_operations.download_yt_audio')
+    @patch('cloud_operations.playlist_video_urls')
+    def test_transcribe_batch_playlist(self, mock_playlist, mock_download, mock_transcript, mock_boto_resource):
+        mock_playlist.return_value = [f'https://www.youtube.com/watch?v={c * 11}' for c in 'abcd']
+        mock_download.side_effect = lambda url, directory, reserve=None: os.path.join(directory, 'audio.m4a')
+        instance = self.build_cloud_ops(mock_boto_resource.return_value)
+        # The first video was transcribed before
+        mock_s3_client = mock_boto_resource.return_value.meta.client
+        cached = instance.transcript_cache.key('aaaaaaaaaaa', TRANSCRIPTION_PARAMS)
+        def get_object(Bucket, Key):
+            if Key == cached:
+                return {'Body': io.BytesIO(b'cached')}
+            raise ClientError({'Error': {'Code': 'NoSuchKey', 'Message': 'Not found'}}, 'GetObject')
+        mock_s3_client.get_object.side_effect = get_object
+
+        headers = self.add_auth_header()
+        playlist_url = 'https://www.youtube.com/playlist?list=PL123'
+        response = self.app.post('/transcribeBatch', json={'playlist_url': playlist_url}, headers=headers)
+        job = self.wait_for_job(json.loads(response.data)['job_id'], headers)
+
+        self.assertEqual(job['status'], 'succeeded')
+        mock_playlist.assert_called_once_with(playlist_url)
+        # Only max_items videos are taken from the playlist
+        self.assertEqual([item['source'] for item in job['result']['items']], ['bucket', 'computed', 'computed'])
+        self.assertEqual(mock_download.call_count, 2)
+        self.assertIn('playlist', job['stages'])
+
+    @patch('cloud_operations.boto3.resource')
+    @patch('cloud_operations.CloudOperations.__init__', lambda x: None)
+    def test_transcribe_batch_invalid(self, mock_boto_resource):
+        instance = self.build_cloud_ops(mock_boto_resource.return_value)
+
+        headers = self.add_auth_header()
+        self.assertEqual(self.app.post('/transcribeBatch', json={}, headers=headers).status_code, 400)
+        response = self.app.post('/transcribeBatch', json={'urls': ['https://example.com/video']}, headers=headers)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.data)['urls'], ['https://example.com/video'])
+        response = self.app.post('/transcribeBatch', json={'urls': ['https://youtu.be/aaaaaaaaaaa'] * 4},
+                                 headers=headers)
+        self.assertEqual(response.status_code, 400)
+        response = self.app.post('/transcribeBatch', json={'playlist_url': 'https://www.youtube.com/watch?v=aaaaaaaaaaa'},
+                                 headers=headers)
+        self.assertEqual(response.status_code, 400)
+
+    @patch('cloud_operations.boto3.resource')
+    @patch('cloud_operations.CloudOperations.__init__', lambda x: None)
+    def test_job_status_not_found(self, mock_boto_resource):
+        instance = self.build_cloud_ops(mock_boto_resource.return_value)
+
+        headers = self.add_auth_header()
+        response = self.app.get('/jobs/unknown', headers=headers)
+
+        self.assertEqual(response.status_code, 404)
+
+    @patch('cloud_operations.boto3.resource')
+    @patch('cloud_operations.CloudOperations.__init__', lambda x: None)
+    def test_metrics(self, mock_boto_resource):
+        instance = self.build_cloud_ops(mock_boto_resource.return_value)
+        instance.clients.snapshot.return_value = {'requests': 3, 'in_flight': 0, 'pool_saturated': 0}
+        mock_object = mock_boto_resource.return_value.Object.return_value
+        mock_object.get.return_value = self.s3_get_response(b'metered')
+
+        headers = self.add_auth_header()
+        self.app.get('/downloadFromCloud', query_string={'file_name': 'file.txt'}, headers=headers).close()
+        response = self.app.get('/metrics', headers=headers)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/plain'))
+        body = response.get_data(as_text=True)
+        self.assertIn('devi_transfer_bytes_total{direction="download"}', body)
+        self.assertIn('devi_transfers_in_flight{direction="download"} 0', body)
+        self.assertIn('devi_http_request_duration_seconds_count{endpoint="/downloadFromCloud",'
+                      'method="GET",status="200"}', body)
+        self.assertIn('devi_s3_requests_total 3', body)
+        self.assertIn('devi_job_queue_depth 0', body)
 
 if __name__ == '__main__':
     # Create a temporary file to test file upload
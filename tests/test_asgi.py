@@ -0,0 +1,203 @@
+import unittest
+import os
+import json
+import shutil
+import tempfile
+import asyncio
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch, AsyncMock, MagicMock
+
+sys.path.append('..')
+
+from asgi import async_app, application, API_KEY
+from async_cloud_operations import AsyncCloudOperations
+from cloud_operations import CloudOperations, MAX_PENDING_DELETE_BATCHES
+from utils.transfer import TransferPlanner, MB
+from utils.cache import ObjectCache
+
+
+class FakeBody(object):
+    def __init__(self, data):
+        self.data = data
+        self.closed = False
+
+    async def iter_chunks(self, chunk_size):
+        for i in range(0, len(self.data), chunk_size):
+            yield self.data[i:i + chunk_size]
+
+    def close(self):
+        self.closed = True
+
+
+class AsyncCloudOperationsTestCase(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        with patch('cloud_operations.CloudOperations.__init__', lambda x: None):
+            cloud_ops = CloudOperations()
+        cloud_ops.space_name = 'test_space'
+        cloud_ops.transfer_planner = TransferPlanner()
+        cloud_ops.compression = None
+        cloud_ops.object_cache = None
+        cloud_ops.metadata_index = None
+        cloud_ops.dedup = None
+
+        self.ops = AsyncCloudOperations(cloud_ops, {})
+        self.ops.client = MagicMock()
+        for method in ('get_object', 'put_object', 'create_multipart_upload', 'upload_part',
+                       'complete_multipart_upload', 'abort_multipart_upload', 'list_objects_v2',
+                       'delete_object', 'delete_objects'):
+            setattr(self.ops.client, method, AsyncMock())
+
+        patcher = patch('asgi.async_cloud_ops', self.ops)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = async_app.test_client()
+        self.headers = {'Authorization': API_KEY}
+
+    async def test_download(self):
+        body = FakeBody(b'streamed data')
+        self.ops.client.get_object.return_value = {'Body': body, 'ContentLength': 13, 'ETag': '"etag"'}
+
+        response = await self.client.get('/downloadFromCloud', query_string={'file_name': 'file.txt'},
+                                         headers=self.headers)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(await response.get_data(), b'streamed data')
+        self.assertIn('attachment', response.headers['Content-Disposition'])
+        self.assertTrue(body.closed)
+
+    async def test_download_closed_before_streaming(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, True)
+        self.ops.cloud_ops.object_cache = ObjectCache(directory, max_bytes=1024)
+        directory = self.ops.cloud_ops.object_cache.directory
+        body = FakeBody(b'never sent')
+        self.ops.client.get_object.return_value = {'Body': body, 'ContentLength': 10, 'ETag': '"etag"'}
+
+        request = MagicMock(headers={})
+        response, status = await self.ops._stream_object(request, 'file.txt', as_attachment=True)
+        self.assertTrue(os.listdir(directory))
+        # The client went away before the first chunk
+        async with response.response:
+            pass
+
+        self.assertTrue(body.closed)
+        self.assertEqual(os.listdir(directory), [])
+
+        body = FakeBody(b'sent whole')
+        self.ops.client.get_object.return_value = {'Body': body, 'ContentLength': 10, 'ETag': '"etag"'}
+        response, status = await self.ops._stream_object(request, 'file.txt', as_attachment=True)
+        self.assertEqual(await response.get_data(), b'sent whole')
+        self.assertTrue(body.closed)
+        self.assertIsNotNone(self.ops.cloud_ops.object_cache.get('test_space', 'file.txt'))
+
+    async def test_view_range(self):
+        self.ops.client.get_object.return_value = {
+            'Body': FakeBody(b'0123'), 'ContentLength': 4, 'ContentRange': 'bytes 0-3/10'}
+
+        response = await self.client.get('/viewFile', query_string={'file_name': 'file.txt'},
+                                         headers=dict(self.headers, Range='bytes=0-3'))
+
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.headers['Content-Range'], 'bytes 0-3/10')
+        self.assertEqual(self.ops.client.get_object.call_args.kwargs['Range'], 'bytes=0-3')
+
+    async def test_upload_raw_body(self):
+        response = await self.client.post('/uploadToCloud', query_string={'file_name': 'raw.txt'},
+                                          data=b'raw content', headers=self.headers)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((await response.get_json())['uploaded_files'], ['raw.txt'])
+        self.assertEqual(self.ops.client.put_object.call_args.kwargs['Body'], b'raw content')
+
+    async def test_upload_in_parts(self):
+        self.ops.client.create_multipart_upload.return_value = {'UploadId': 'upload-id'}
+        self.ops.client.upload_part.side_effect = lambda **kwargs: {'ETag': f'"{kwargs["PartNumber"]}"'}
+        data = b'x' * (11 * MB)
+
+        response = await self.client.post('/uploadToCloud', query_string={'file_name': 'big.bin'},
+                                          data=data, headers=dict(self.headers, **{'Content-Length': str(len(data))}))
+
+        self.assertEqual(response.status_code, 200)
+        sizes = [len(call.kwargs['Body']) for call in self.ops.client.upload_part.call_args_list]
+        self.assertEqual(sizes, [8 * MB, 3 * MB])
+        parts = self.ops.client.complete_multipart_upload.call_args.kwargs['MultipartUpload']['Parts']
+        self.assertEqual(parts, [{'PartNumber': 1, 'ETag': '"1"'}, {'PartNumber': 2, 'ETag': '"2"'}])
+
+    async def test_upload_in_parts_aborts_on_error(self):
+        from botocore.exceptions import ClientError
+        self.ops.client.create_multipart_upload.return_value = {'UploadId': 'upload-id'}
+        self.ops.client.upload_part.side_effect = ClientError(
+            {'Error': {'Code': 'InternalError', 'Message': 'boom'}}, 'UploadPart')
+
+        data = b'x' * (9 * MB)
+        response = await self.client.post('/uploadToCloud', query_string={'file_name': 'big.bin'},
+                                          data=data, headers=dict(self.headers, **{'Content-Length': str(len(data))}))
+
+        self.assertEqual(response.status_code, 500)
+        self.ops.client.abort_multipart_upload.assert_awaited_once()
+        self.ops.client.complete_multipart_upload.assert_not_awaited()
+
+    async def test_delete_files_partial(self):
+        self.ops.client.delete_objects.return_value = {
+            'Errors': [{'Key': 'b.txt', 'Code': 'AccessDenied', 'Message': 'Access Denied'}]}
+
+        response = await self.client.delete('/deleteFiles', json={'file_names': ['a.txt', 'b.txt']},
+                                            headers=self.headers)
+
+        self.assertEqual(response.status_code, 207)
+        results = (await response.get_json())['results']
+        self.assertEqual([result['status'] for result in results], ['deleted', 'error'])
+
+    async def test_delete_prefix_keeps_a_bounded_window(self):
+        in_flight = 0
+        peak = 0
+
+        async def delete_objects(Bucket, Delete):
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0)
+            in_flight -= 1
+            return {}
+        self.ops.client.delete_objects.side_effect = delete_objects
+
+        async def batches(prefix):
+            for i in range(40):
+                yield [f'{prefix}{i}-{j}' for j in range(3)]
+
+        with patch.object(self.ops, '_prefix_batches', batches):
+            response = await self.client.delete('/deleteFiles', json={'prefix': 'logs/'}, headers=self.headers)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((await response.get_json())['deleted_count'], 120)
+        self.assertLessEqual(peak, MAX_PENDING_DELETE_BATCHES)
+
+    async def test_missing_api_key(self):
+        response = await self.client.get('/listFiles')
+
+        self.assertEqual(response.status_code, 401)
+
+    async def test_other_routes_use_flask_app(self):
+        # Routes without an async implementation are served by app.py
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+                 'scheme': 'http', 'path': '/jobs/unknown', 'raw_path': b'/jobs/unknown', 'query_string': b'',
+                 'root_path': '', 'headers': [(b'authorization', API_KEY.encode('utf-8'))],
+                 'client': ('127.0.0.1', 1234), 'server': ('127.0.0.1', 80)}
+        await application(scope, receive, send)
+
+        self.assertEqual(messages[0]['status'], 404)
+        body = b''.join(message.get('body', b'') for message in messages[1:])
+        self.assertEqual(json.loads(body)['message'], 'Job unknown not found')
+
+
+if __name__ == '__main__':
+    unittest.main()
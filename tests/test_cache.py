@@ -0,0 +1,73 @@
+import unittest
+import os
+import sys
+import shutil
+import tempfile
+
+sys.path.append('..')
+
+from utils.cache import ObjectCache
+
+
+class ObjectCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = ObjectCache(self.directory, max_bytes=10)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def add(self, key, data, etag='"etag"'):
+        writer = self.cache.writer('bucket', key, etag, len(data), 'text/plain')
+        writer.write(data)
+        writer.commit()
+
+    def test_lru_eviction(self):
+        self.add('a', b'aaaa')
+        self.add('b', b'bbbb')
+        self.cache.record_hit('bucket', 'a')
+        self.add('c', b'cccc')
+
+        self.assertIsNotNone(self.cache.get('bucket', 'a'))
+        self.assertIsNone(self.cache.get('bucket', 'b'))
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+        self.assertEqual(self.cache.stats()['bytes'], 8)
+        self.assertEqual(len(os.listdir(self.cache.directory)), 2)
+
+    def test_incomplete_write_is_discarded(self):
+        writer = self.cache.writer('bucket', 'a', '"etag"', 4, 'text/plain')
+        writer.write(b'aa')
+        writer.commit()
+
+        self.assertIsNone(self.cache.get('bucket', 'a'))
+        self.assertEqual(os.listdir(self.cache.directory), [])
+
+    def test_oversized_objects_are_not_cached(self):
+        self.assertIsNone(self.cache.writer('bucket', 'a', '"etag"', 11, 'text/plain'))
+
+    def test_invalidate(self):
+        self.add('a', b'aaaa')
+        self.cache.invalidate('bucket', 'a')
+
+        self.assertIsNone(self.cache.get('bucket', 'a'))
+        self.assertEqual(self.cache.stats()['invalidations'], 1)
+        self.assertEqual(os.listdir(self.cache.directory), [])
+
+    def test_leaves_other_files_alone(self):
+        other = os.path.join(self.directory, 'other')
+        with open(other, 'w') as other_file:
+            other_file.write('kept')
+        cache = ObjectCache(self.directory, max_bytes=10)
+        self.add('a', b'aaaa')
+
+        cache.close()
+        self.cache.close()
+
+        self.assertEqual(os.listdir(self.directory), ['other'])
+
+    def test_disabled_without_budget(self):
+        self.assertIsNone(ObjectCache.from_config({}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+import unittest
+import sys
+import time
+import threading
+
+import boto3
+from unittest.mock import MagicMock
+from botocore.awsrequest import AWSResponse
+from botocore.exceptions import ClientError
+
+sys.path.append('..')
+
+from utils.clients import S3Clients, PoolTimeout
+from utils.metrics import S3_OPERATION_SECONDS, S3_ERRORS
+
+
+class S3ClientsTestCase(unittest.TestCase):
+    def setUp(self):
+        session = boto3.session.Session(region_name='us-east-1', aws_access_key_id='key',
+                                        aws_secret_access_key='secret')
+        self.clients = S3Clients.from_config(session, {'S3_MAX_POOL_CONNECTIONS': 20})
+
+    def test_client_config(self):
+        config = self.clients.client.meta.config
+        self.assertEqual(config.max_pool_connections, 20)
+        self.assertTrue(config.tcp_keepalive)
+        self.assertEqual(config.retries['mode'], 'standard')
+
+    def test_endpoint_url(self):
+        session = boto3.session.Session(region_name='us-east-1', aws_access_key_id='key',
+                                        aws_secret_access_key='secret')
+        clients = S3Clients.from_config(session, {'S3_ENDPOINT_URL': 'http://127.0.0.1:9000'})
+
+        self.assertEqual(clients.client.meta.endpoint_url, 'http://127.0.0.1:9000')
+        self.assertEqual(clients.resource.meta.client.meta.endpoint_url, 'http://127.0.0.1:9000')
+
+    def test_keepalive_flag(self):
+        session = boto3.session.Session(region_name='us-east-1', aws_access_key_id='key',
+                                        aws_secret_access_key='secret')
+        clients = S3Clients.from_config(session, {'S3_TCP_KEEPALIVE': 'false'})
+
+        self.assertFalse(clients.client.meta.config.tcp_keepalive)
+
+    def test_resource_per_thread(self):
+        resources = []
+        thread = threading.Thread(target=lambda: resources.append(self.clients.resource))
+        thread.start()
+        thread.join()
+
+        self.assertIs(self.clients.resource, self.clients.resource)
+        self.assertIsNot(self.clients.resource, resources[0])
+        self.assertEqual(self.clients.snapshot()['resources'], 2)
+        # One client, and so one connection pool, behind all of them
+        self.assertIs(resources[0].meta.client, self.clients.client)
+        self.assertIs(self.clients.resource.Object('bucket', 'key').meta.client, self.clients.client)
+
+    def answer(self, body=b'<ListAllMyBucketsResult><Buckets/></ListAllMyBucketsResult>'):
+        raw = MagicMock()
+        raw.stream.return_value = [body]
+        self.clients.client.meta.events.register(
+            'before-send.s3', lambda request, **kwargs: AWSResponse(request.url, 200, {}, raw))
+
+    def test_calls_wait_for_a_free_connection(self):
+        self.answer()
+        for _ in range(self.clients.max_pool_connections):
+            self.clients._slots.acquire()
+        thread = threading.Thread(target=self.clients.client.list_buckets)
+        thread.start()
+        time.sleep(0.05)
+        self.assertTrue(thread.is_alive())
+        self.clients._slots.release()
+        thread.join()
+        for _ in range(self.clients.max_pool_connections - 1):
+            self.clients._slots.release()
+
+        stats = self.clients.snapshot()
+        self.assertEqual(stats['pool_saturated'], 1)
+        self.assertGreaterEqual(stats['pool_wait_seconds'], 0.04)
+        self.assertEqual(stats['in_flight'], 0)
+
+    def test_waiting_for_a_connection_times_out(self):
+        self.answer()
+        self.clients.pool_timeout = 0.05
+        for _ in range(self.clients.max_pool_connections):
+            self.clients._slots.acquire()
+
+        with self.assertRaises(PoolTimeout):
+            self.clients.client.list_buckets()
+        for _ in range(self.clients.max_pool_connections):
+            self.clients._slots.release()
+
+        self.assertEqual(self.clients.snapshot()['in_flight'], 0)
+
+    def test_slot_is_released_when_a_call_fails(self):
+        def fail(**kwargs):
+            raise RuntimeError('connection reset')
+
+        self.clients.client.meta.events.register('before-send.s3', fail)
+        # Fails before the request is made, so no slot is taken
+        self.clients.client.meta.events.register('before-call.s3.ListBuckets', fail)
+
+        for _ in range(self.clients.max_pool_connections + 1):
+            with self.assertRaises(RuntimeError):
+                self.clients.client.list_buckets()
+        with self.assertRaises(RuntimeError):
+            self.clients.client.list_objects_v2(Bucket='bucket')
+
+        self.assertEqual(self.clients.snapshot()['in_flight'], 0)
+        self.assertTrue(self.clients._slots.acquire(blocking=False))
+        self.clients._slots.release()
+
+    def test_requests_are_counted(self):
+        # Answers the request in place of the network
+        raw = MagicMock()
+        raw.stream.return_value = [b'<ListAllMyBucketsResult><Buckets/></ListAllMyBucketsResult>']
+        self.clients.client.meta.events.register(
+            'before-send.s3', lambda request, **kwargs: AWSResponse(request.url, 200, {}, raw))
+
+        self.clients.client.list_buckets()
+
+        stats = self.clients.snapshot()
+        self.assertEqual(stats['requests'], 1)
+        self.assertEqual(stats['in_flight'], 0)
+        self.assertEqual(stats['peak_in_flight'], 1)
+
+    def test_errors_are_counted(self):
+        raw = MagicMock()
+        raw.stream.return_value = [b'<Error><Code>NoSuchBucket</Code><Message>missing</Message></Error>']
+        self.clients.client.meta.events.register(
+            'before-send.s3', lambda request, **kwargs: AWSResponse(request.url, 404, {}, raw))
+        before = S3_ERRORS.value(operation='ListObjectsV2', code='NoSuchBucket')
+
+        with self.assertRaises(ClientError):
+            self.clients.client.list_objects_v2(Bucket='missing')
+
+        self.assertEqual(S3_ERRORS.value(operation='ListObjectsV2', code='NoSuchBucket'), before + 1)
+        self.assertIn('devi_s3_operation_duration_seconds_count{operation="ListObjectsV2"}',
+                      '\n'.join(S3_OPERATION_SECONDS.render()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import unittest
+import io
+import sys
+import gzip
+import asyncio
+from unittest.mock import patch
+
+sys.path.append('..')
+
+import utils.compression
+from utils.compression import CompressionPolicy, CompressingReader, decompress_chunks, stored_encoding
+
+
+class CompressionTestCase(unittest.TestCase):
+    def test_reader_round_trip(self):
+        data = b'transcript line\n' * 100000
+        reader = CompressingReader(io.BytesIO(data), 'gzip')
+
+        parts = []
+        while True:
+            part = reader.read(4096)
+            if not part:
+                break
+            self.assertLessEqual(len(part), 4096)
+            parts.append(part)
+
+        compressed = b''.join(parts)
+        self.assertLess(len(compressed), len(data) // 10)
+        self.assertEqual(gzip.decompress(compressed), data)
+
+    def test_async_reader(self):
+        data = b'{"key": "value"}' * 10000
+        source = io.BytesIO(data)
+
+        async def read(size):
+            return source.read(size)
+
+        async def compress():
+            reader = CompressionPolicy().async_reader(read)
+            return await reader.read()
+
+        self.assertEqual(gzip.decompress(asyncio.run(compress())), data)
+
+    def test_decompress_chunks(self):
+        data = b'hello world ' * 5000
+        compressed = gzip.compress(data)
+        chunks = [compressed[i:i + 100] for i in range(0, len(compressed), 100)]
+
+        self.assertEqual(b''.join(decompress_chunks(chunks, 'gzip')), data)
+
+    def test_policy_by_mime_type(self):
+        policy = CompressionPolicy.from_config({'COMPRESSION_ENCODING': 'gzip'})
+
+        self.assertEqual(policy.encoding_for('text/plain'), 'gzip')
+        self.assertEqual(policy.encoding_for('application/json', 10000), 'gzip')
+        self.assertIsNone(policy.encoding_for('image/png'))
+        self.assertIsNone(policy.encoding_for(None))
+        self.assertIsNone(policy.encoding_for('text/plain', 100))
+
+    def test_disabled_by_default(self):
+        self.assertIsNone(CompressionPolicy.from_config({}))
+
+    def test_zstd_falls_back_to_gzip(self):
+        with patch.object(utils.compression, 'zstandard', None):
+            self.assertEqual(CompressionPolicy(encoding='zstd').encoding, 'gzip')
+
+    def test_unknown_encoding(self):
+        with self.assertRaises(ValueError):
+            CompressionPolicy(encoding='br')
+
+    def test_stored_encoding(self):
+        self.assertEqual(stored_encoding({'Metadata': {'devi-encoding': 'gzip'}}), 'gzip')
+        self.assertIsNone(stored_encoding({'Metadata': {}}))
+        self.assertIsNone(stored_encoding({}))
+
+
+if __name__ == '__main__':
+    unittest.main()
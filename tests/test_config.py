@@ -0,0 +1,44 @@
+import unittest
+import os
+import sys
+import json
+import tempfile
+import subprocess
+from unittest.mock import patch
+
+sys.path.append('..')
+
+import utils.config
+from utils.config import load_config, CONFIG_PATH_ENV
+
+
+class ConfigTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = os.path.join(self.directory.name, 'config.json')
+        with open(self.path, 'w') as config_file:
+            json.dump({'API_KEY': 'key'}, config_file)
+
+        # Every test starts from an unloaded configuration
+        patcher = patch.object(utils.config, '_config', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_loaded_once(self):
+        with patch.dict(os.environ, {CONFIG_PATH_ENV: self.path}):
+            config = load_config()
+            os.remove(self.path)
+            self.assertIs(load_config(), config)
+        self.assertEqual(config['API_KEY'], 'key')
+
+    def test_transcription_is_not_imported_at_boot(self):
+        root = os.path.join(os.path.dirname(__file__), '..')
+        output = subprocess.run(
+            [sys.executable, '-c', 'import sys, app; print(sorted({"openai", "pytube"} & set(sys.modules)))'],
+            cwd=root, capture_output=True, text=True, check=True).stdout
+        self.assertEqual(output.strip().splitlines()[-1], '[]')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import unittest
+import sys
+import io
+import hashlib
+
+sys.path.append('..')
+
+from utils.dedup import DigestIndex, HashingReader, hash_stream
+
+
+class DedupTestCase(unittest.TestCase):
+    def test_hash_stream_restores_position(self):
+        stream = io.BytesIO(b'header|content')
+        stream.seek(7)
+        digest, size = hash_stream(stream)
+        self.assertEqual(digest, hashlib.sha256(b'content').hexdigest())
+        self.assertEqual(size, 7)
+        self.assertEqual(stream.tell(), 7)
+
+    def test_hash_stream_unseekable(self):
+        class Unseekable(object):
+            def read(self, size=-1):
+                return b''
+        self.assertIsNone(hash_stream(Unseekable()))
+
+    def test_hashing_reader(self):
+        reader = HashingReader(io.BytesIO(b'some content'))
+        self.assertEqual(reader.read(4) + reader.read(), b'some content')
+        self.assertEqual(reader.hexdigest(), hashlib.sha256(b'some content').hexdigest())
+        self.assertEqual(reader.size, 12)
+
+    def test_candidates_and_stats(self):
+        index = DigestIndex(':memory:')
+        index.put('bucket', 'a.txt', 'digest', 10)
+        index.put('bucket', 'b.txt', 'digest', 10, '"etag"')
+        index.put('bucket', 'c.txt', 'other', 10)
+        index.put('other', 'a.txt', 'digest', 10)
+        self.assertEqual([row['key'] for row in index.candidates('bucket', 'digest', 10)], ['a.txt', 'b.txt'])
+        self.assertEqual(index.candidates('bucket', 'digest', 11), [])
+
+        index.put('bucket', 'a.txt', 'changed', 10)
+        index.remove('bucket', ['b.txt'])
+        self.assertEqual(index.candidates('bucket', 'digest', 10), [])
+        self.assertEqual(index.get('bucket', 'a.txt')['digest'], 'changed')
+
+        index.record_check(10, hit=True)
+        index.record_check(30, hit=False)
+        stats = index.snapshot()
+        self.assertEqual(stats['hit_rate'], 0.5)
+        self.assertEqual(stats['bytes_saved'], 10)
+        self.assertEqual(stats['bytes_checked'], 40)
+        self.assertEqual(stats['entries'], 3)
+
+    def test_from_config(self):
+        self.assertIsNone(DigestIndex.from_config({}))
+        self.assertIsInstance(DigestIndex.from_config({'DEDUP_INDEX_PATH': ':memory:'}), DigestIndex)
+
+
+if __name__ == '__main__':
+    unittest.main()
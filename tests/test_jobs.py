@@ -0,0 +1,173 @@
+import unittest
+import os
+import sys
+import time
+import shutil
+import threading
+import sqlite3
+import tempfile
+
+sys.path.append('..')
+
+from utils.jobs import JobQueue
+
+
+class JobQueueTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'jobs.sqlite3')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def started(self, *args, **kwargs):
+        job_queue = JobQueue(self.path, *args, **kwargs)
+        self.addCleanup(job_queue.stop, 5)
+        return job_queue
+
+    def wait_for(self, job_queue, job_id):
+        for _ in range(200):
+            job = job_queue.get(job_id)
+            if job['status'] not in ('pending', 'running'):
+                return job
+            time.sleep(0.01)
+        self.fail(f'Job {job_id} did not finish')
+
+    def test_runs_jobs_and_records_stages(self):
+        def handler(params, job):
+            with job.stage('double'):
+                return {'value': params['value'] * 2}
+
+        job_queue = self.started(workers=2)
+        job_queue.register('double', handler)
+        job_queue.start()
+
+        job = self.wait_for(job_queue, job_queue.submit('double', {'value': 21}))
+
+        self.assertEqual(job['status'], 'succeeded')
+        self.assertEqual(job['result'], {'value': 42})
+        self.assertIn('double', job['stages'])
+        self.assertEqual(job_queue.stats()['stages']['double']['count'], 1)
+
+    def test_failed_job_records_error(self):
+        def handler(params, job):
+            raise RuntimeError('boom')
+
+        job_queue = self.started(workers=1)
+        job_queue.register('fail', handler)
+        job_queue.start()
+
+        job = self.wait_for(job_queue, job_queue.submit('fail', {}))
+
+        self.assertEqual(job['status'], 'failed')
+        self.assertEqual(job['error'], 'boom')
+
+    def test_pending_jobs_survive_restart(self):
+        # Submitted but never started, as if the process had stopped
+        job_queue = JobQueue(self.path, workers=1)
+        job_queue.register('echo', lambda params, job: params)
+        job_id = job_queue.submit('echo', {'value': 1})
+        self.assertEqual(job_queue.stats()['queue_depth'], 1)
+
+        restarted = self.started(workers=1)
+        restarted.register('echo', lambda params, job: params)
+        restarted.start()
+
+        self.assertEqual(self.wait_for(restarted, job_id)['result'], {'value': 1})
+
+    def test_progress_is_reported(self):
+        def handler(params, job):
+            job.progress({'done': 1, 'total': 2})
+            return {}
+
+        job_queue = self.started(workers=1)
+        job_queue.register('step', handler)
+        job_queue.start()
+
+        job = self.wait_for(job_queue, job_queue.submit('step', {}))
+
+        self.assertEqual(job['progress'], {'done': 1, 'total': 2})
+
+    def test_store_without_progress_column(self):
+        conn = sqlite3.connect(self.path)
+        conn.execute("CREATE TABLE jobs (id TEXT PRIMARY KEY, kind TEXT NOT NULL, params TEXT NOT NULL, "
+                     "status TEXT NOT NULL, result TEXT, error TEXT, stages TEXT NOT NULL DEFAULT '{}', "
+                     "created_at REAL NOT NULL, started_at REAL, finished_at REAL)")
+        conn.commit()
+        conn.close()
+
+        job_queue = self.started(workers=1)
+        job_queue.register('echo', lambda params, job: params)
+        job_queue.start()
+
+        job = self.wait_for(job_queue, job_queue.submit('echo', {'value': 1}))
+
+        self.assertEqual(job['result'], {'value': 1})
+        self.assertNotIn('progress', job)
+
+    def test_each_job_runs_once_across_processes(self):
+        runs = []
+        lock = threading.Lock()
+
+        def handler(params, job):
+            with lock:
+                runs.append(params['n'])
+            return {}
+
+        queues = [self.started(workers=3) for _ in range(2)]
+        for job_queue in queues:
+            job_queue.register('count', handler)
+        job_ids = [queues[0].submit('count', {'n': n}) for n in range(30)]
+        # The second process finds the same pending jobs in the store
+        for job_queue in queues:
+            job_queue.start()
+        for job_id in job_ids:
+            self.wait_for(queues[0], job_id)
+
+        self.assertEqual(sorted(runs), list(range(30)))
+
+    def test_running_jobs_of_live_processes_are_not_requeued(self):
+        release = threading.Event()
+        first = self.started(workers=1)
+        first.register('wait', lambda params, job: release.wait(5))
+        first.start()
+        job_id = first.submit('wait', {})
+        for _ in range(200):
+            if first.get(job_id)['status'] == 'running':
+                break
+            time.sleep(0.01)
+
+        second = self.started(workers=1)
+        second.register('wait', lambda params, job: self.fail('run twice'))
+        second.start()
+        self.assertEqual(second.get(job_id)['status'], 'running')
+        release.set()
+        self.assertEqual(self.wait_for(first, job_id)['status'], 'succeeded')
+
+    def test_expired_leases_are_requeued(self):
+        job_queue = JobQueue(self.path, workers=1)
+        job_queue.register('echo', lambda params, job: params)
+        job_id = job_queue.submit('echo', {'value': 1})
+        # Claimed by a process that stopped without finishing it
+        job_queue._claim(job_id)
+        job_queue._conn.execute('UPDATE jobs SET lease_expires = ? WHERE id = ?', (time.time() - 1, job_id))
+
+        restarted = self.started(workers=1)
+        restarted.register('echo', lambda params, job: params)
+        restarted.start()
+
+        self.assertEqual(self.wait_for(restarted, job_id)['result'], {'value': 1})
+
+    def test_default_store_is_in_the_data_directory(self):
+        job_queue = JobQueue.from_config({'DATA_DIR': os.path.join(self.directory, 'data')})
+
+        self.assertEqual(job_queue.path, os.path.join(self.directory, 'data', 'jobs.sqlite3'))
+
+    def test_unknown_kind(self):
+        job_queue = JobQueue(self.path)
+        with self.assertRaises(ValueError):
+            job_queue.submit('missing', {})
+
+
+if __name__ == '__main__':
+    unittest.main()
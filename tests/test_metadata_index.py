@@ -0,0 +1,60 @@
+import unittest
+import sys
+from datetime import datetime
+from unittest.mock import MagicMock
+
+sys.path.append('..')
+
+from utils.metadata_index import MetadataIndex
+
+
+class MetadataIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.index = MetadataIndex(':memory:')
+        for key in ('a.txt', 'docs/b.txt', 'docs/c.txt', 'docs/old/d.txt', 'docs/old/e.txt', 'z.jpg'):
+            self.index.put('bucket', key, 1, '"etag"', datetime(2024, 6, 1))
+
+    def test_get(self):
+        entry = self.index.get('bucket', 'z.jpg')
+        self.assertEqual(entry['mime_type'], 'image/jpeg')
+        self.assertEqual(entry['last_modified'], '2024-06-01T00:00:00')
+        self.assertIsNone(self.index.get('bucket', 'missing'))
+
+    def test_list_with_prefix_and_delimiter(self):
+        files, prefixes, token = self.index.list('bucket', prefix='docs/', delimiter='/')
+        self.assertEqual([entry['file_name'] for entry in files], ['docs/b.txt', 'docs/c.txt'])
+        self.assertEqual(prefixes, ['docs/old/'])
+        self.assertIsNone(token)
+
+    def test_list_pages(self):
+        keys = []
+        token = None
+        while True:
+            files, _, token = self.index.list('bucket', max_keys=4, continuation_token=token)
+            keys.extend(entry['file_name'] for entry in files)
+            if token is None:
+                break
+        self.assertEqual(len(keys), 6)
+        self.assertEqual(keys, sorted(keys))
+
+    def test_sync_removes_stale_keys(self):
+        client = MagicMock()
+        client.get_paginator.return_value.paginate.return_value = [
+            {'Contents': [{'Key': 'a.txt', 'Size': 5, 'ETag': '"new"'}]}
+        ]
+        self.assertFalse(self.index.is_ready('bucket'))
+
+        self.index.sync('bucket', client)
+
+        self.assertTrue(self.index.is_ready('bucket'))
+        files, _, _ = self.index.list('bucket')
+        self.assertEqual([(entry['file_name'], entry['size']) for entry in files], [('a.txt', 5)])
+
+    def test_remove(self):
+        self.index.remove('bucket', ['a.txt', 'z.jpg'])
+        files = list(self.index.iter_objects('bucket'))
+        self.assertEqual(len(files), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
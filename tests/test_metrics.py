@@ -0,0 +1,73 @@
+import unittest
+import sys
+import threading
+
+sys.path.append('..')
+
+from utils.metrics import Registry, TransferCallback, TRANSFER_BYTES
+
+
+class MetricsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.registry = Registry()
+
+    def test_counter(self):
+        counter = self.registry.counter('test_bytes_total', 'Bytes', ['direction'])
+
+        def add():
+            for _ in range(1000):
+                counter.inc(2, direction='upload')
+
+        threads = [threading.Thread(target=add) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(counter.value(direction='upload'), 8000)
+        self.assertIn('test_bytes_total{direction="upload"} 8000', self.registry.render())
+
+    def test_gauge(self):
+        gauge = self.registry.gauge('test_in_flight', 'In flight')
+        gauge.inc()
+        gauge.inc()
+        gauge.dec()
+
+        self.assertEqual(gauge.value(), 1)
+        self.assertIn('# TYPE test_in_flight gauge\ntest_in_flight 1\n', self.registry.render())
+
+    def test_histogram(self):
+        histogram = self.registry.histogram('test_seconds', 'Latency', ['operation'], buckets=(0.1, 1))
+        histogram.observe(0.05, operation='GetObject')
+        histogram.observe(0.5, operation='GetObject')
+        histogram.observe(5, operation='GetObject')
+
+        lines = self.registry.render().splitlines()
+        self.assertIn('test_seconds_bucket{operation="GetObject",le="0.1"} 1', lines)
+        self.assertIn('test_seconds_bucket{operation="GetObject",le="1.0"} 2', lines)
+        self.assertIn('test_seconds_bucket{operation="GetObject",le="+Inf"} 3', lines)
+        self.assertIn('test_seconds_count{operation="GetObject"} 3', lines)
+        self.assertIn('test_seconds_sum{operation="GetObject"} 5.55', lines)
+
+    def test_label_escaping(self):
+        counter = self.registry.counter('test_total', 'Escaped', ['code'])
+        counter.inc(code='say "hi"\n')
+
+        self.assertIn('test_total{code="say \\"hi\\"\\n"} 1', self.registry.render())
+
+    def test_samples(self):
+        body = self.registry.render([('test_queue_depth', 'gauge', 'Queued jobs', 4)])
+
+        self.assertEqual(body, '# HELP test_queue_depth Queued jobs\n# TYPE test_queue_depth gauge\ntest_queue_depth 4\n')
+
+    def test_transfer_callback(self):
+        before = TRANSFER_BYTES.value(direction='upload')
+        callback = TransferCallback('upload')
+        callback(100)
+        callback(50)
+
+        self.assertEqual(TRANSFER_BYTES.value(direction='upload'), before + 150)
+
+
+if __name__ == '__main__':
+    unittest.main()
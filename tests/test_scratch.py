@@ -0,0 +1,102 @@
+import unittest
+import sys
+import os
+import time
+import shutil
+import tempfile
+import threading
+
+sys.path.append('..')
+
+from utils.scratch import ScratchSpace, ScratchSpaceFull
+
+
+class ScratchSpaceTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, True)
+
+    def test_areas_are_unique_and_removed(self):
+        space = ScratchSpace(self.root, quota_bytes=100)
+        with space.area('yt-abc') as first, space.area('yt-abc') as second:
+            self.assertNotEqual(first.path, second.path)
+            with open(first.file('../audio.mp3'), 'wb') as audio:
+                audio.write(b'data')
+            self.assertEqual(os.path.dirname(first.file('../audio.mp3')), first.path)
+
+        with self.assertRaises(ValueError):
+            with space.area('failing', reserve=10) as area:
+                raise ValueError('failed')
+        self.assertFalse(os.path.exists(first.path))
+        self.assertFalse(os.path.exists(area.path))
+        self.assertEqual(space.snapshot()['reserved_bytes'], 0)
+        self.assertEqual(space.snapshot()['active_areas'], 0)
+
+    def test_quota_back_pressure(self):
+        space = ScratchSpace(self.root, quota_bytes=100, wait_seconds=5)
+        order = []
+
+        def second():
+            with space.area('second', reserve=60):
+                order.append('second')
+
+        with space.area('first', reserve=60):
+            thread = threading.Thread(target=second)
+            thread.start()
+            time.sleep(0.05)
+            order.append('first done')
+        thread.join()
+
+        self.assertEqual(order, ['first done', 'second'])
+        self.assertEqual(space.snapshot()['waits'], 1)
+
+    def test_quota_rejects(self):
+        space = ScratchSpace(self.root, quota_bytes=100, wait_seconds=0.01)
+        with self.assertRaises(ScratchSpaceFull):
+            with space.area('huge', reserve=101):
+                pass
+        with space.area('first', reserve=60):
+            with self.assertRaises(ScratchSpaceFull):
+                with space.area('second') as area:
+                    area.reserve(60)
+        self.assertEqual(space.snapshot()['rejected'], 2)
+        self.assertEqual(space.snapshot()['reserved_bytes'], 0)
+
+    def test_sweeps_orphans(self):
+        # Another process using the same root, its lock is held
+        other = ScratchSpace(self.root, quota_bytes=100)
+        # A process that is gone, although its pid is now this process's
+        dead = os.path.join(self.root, f'{os.getpid()}-dead')
+        os.makedirs(os.path.join(dead, 'yt-abc'))
+        open(dead + '.lock', 'w').close()
+        unlocked = os.path.join(self.root, '12345-old')
+        os.makedirs(unlocked)
+        loose = os.path.join(self.root, 'leftover.mp3')
+        open(loose, 'w').close()
+
+        space = ScratchSpace(self.root, quota_bytes=100)
+
+        self.assertTrue(os.path.exists(other.directory))
+        self.assertFalse(os.path.exists(dead))
+        self.assertFalse(os.path.exists(dead + '.lock'))
+        self.assertFalse(os.path.exists(unlocked))
+        self.assertFalse(os.path.exists(loose))
+        self.assertEqual(space.snapshot()['swept'], 4)
+
+    def test_quota_is_shared_by_processes(self):
+        space = ScratchSpace(self.root, quota_bytes=100, wait_seconds=0.01)
+        other = ScratchSpace(self.root, quota_bytes=100, wait_seconds=0.01)
+
+        with other.area('other', reserve=60):
+            with self.assertRaises(ScratchSpaceFull):
+                with space.area('first', reserve=60):
+                    pass
+            with space.area('second', reserve=40):
+                pass
+        with space.area('third', reserve=60):
+            pass
+        self.assertEqual(space.snapshot()['rejected'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import unittest
+import sys
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append('..')
+
+from utils import timing
+
+
+class TimingTestCase(unittest.TestCase):
+    def tearDown(self):
+        timing.stop()
+
+    def test_spans_add_up(self):
+        timeline = timing.start('/viewFile', method='GET')
+        with timing.span('s3 get'):
+            pass
+        timeline.add('s3 get', 0.5)
+        timeline.add('send', 0.25)
+
+        spans = timeline.spans()
+        self.assertEqual(spans['s3 get'][1], 2)
+        self.assertGreaterEqual(spans['s3 get'][0], 0.5)
+        header = timeline.server_timing()
+        self.assertRegex(header, r'^s3-get;dur=5\d\d\.\d;desc="2 calls", send;dur=250\.0, total;dur=\d+\.\d$')
+        record = timeline.record(status=200)
+        self.assertEqual(record['timeline'], '/viewFile')
+        self.assertEqual(record['method'], 'GET')
+        self.assertEqual(record['spans']['send'], {'ms': 250.0, 'count': 1})
+
+    def test_span_without_timeline(self):
+        timing.stop()
+        with timing.span('nothing'):
+            pass
+        self.assertIsNone(timing.current())
+
+    def test_propagate_to_threads(self):
+        timeline = timing.start('job')
+
+        @timing.timed('segment')
+        def work(_):
+            return timing.current()
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            seen = list(executor.map(timing.propagate(work), range(8)))
+        self.assertTrue(all(current is timeline for current in seen))
+        self.assertEqual(timeline.spans()['segment'][1], 8)
+
+    def test_timeline_logs_and_restores(self):
+        outer = timing.start('request')
+        with self.assertLogs('utils.timing', level='INFO') as logs:
+            with timing.timeline('job', job_id='1') as inner:
+                self.assertIs(timing.current(), inner)
+        self.assertIs(timing.current(), outer)
+        self.assertIn('"job_id": "1"', logs.output[0])
+
+    def test_sampling_profiler(self):
+        def busy_loop():
+            deadline = time.perf_counter() + 0.2
+            while time.perf_counter() < deadline:
+                pass
+
+        profiler = timing.SamplingProfiler(threading.get_ident(), interval=0.001).start()
+        busy_loop()
+        top = profiler.stop().top(5)
+        self.assertTrue(top)
+        self.assertIn('test_timing.py:busy_loop', top[0]['stack'])
+
+
+if __name__ == '__main__':
+    unittest.main()
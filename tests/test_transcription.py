@@ -0,0 +1,101 @@
+import unittest
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import subprocess
+
+import imageio_ffmpeg
+
+sys.path.append('..')
+
+from utils.transcription import (audio_duration, plan_windows, stitch, transcribe_audio,
+                                 transcribe_segments, segment_options_from_config)
+
+
+class StubBackend(object):
+    # Local stand-in for the transcription API, "transcribes" a segment as
+    # its file name and rounded duration
+    def __init__(self):
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def __call__(self, path):
+        with self._lock:
+            self.calls.append(os.path.basename(path))
+        return f'{os.path.basename(path)} {round(audio_duration(path))}'
+
+
+class TranscriptionTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.audio_file = os.path.join(self.directory, 'sample.wav')
+        subprocess.run(
+            [imageio_ffmpeg.get_ffmpeg_exe(), '-y', '-loglevel', 'error', '-f', 'lavfi',
+             '-i', 'sine=frequency=440:duration=10', self.audio_file],
+            check=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_plan_fixed_windows_overlap(self):
+        self.assertEqual(plan_windows(25, 10, 2), [(0.0, 10.0), (8.0, 18.0), (16.0, 25)])
+
+    def test_overlap_must_be_shorter_than_window(self):
+        with self.assertRaises(ValueError):
+            plan_windows(25, 10, 10)
+        with self.assertRaises(ValueError):
+            segment_options_from_config({'TRANSCRIPTION_SEGMENT_SECONDS': 5, 'TRANSCRIPTION_OVERLAP_SECONDS': 5})
+        with self.assertRaises(ValueError):
+            segment_options_from_config({'TRANSCRIPTION_OVERLAP_SECONDS': -1})
+        self.assertEqual(segment_options_from_config({})['overlap'], 5)
+
+    def test_plan_windows_cut_at_silence(self):
+        self.assertEqual(plan_windows(25, 10, 2, silences=[3.0, 7.5, 16.0]),
+                         [(0.0, 7.5), (7.5, 16.0), (16.0, 25)])
+
+    def test_stitch_removes_overlap(self):
+        texts = ['the quick brown fox jumps', 'Fox jumps over the lazy', 'lazy dog.']
+        self.assertEqual(stitch(texts), 'the quick brown fox jumps over the lazy dog.')
+
+    def test_stitch_without_overlap(self):
+        self.assertEqual(stitch(['Hello there.', 'General Kenobi.']), 'Hello there. General Kenobi.')
+
+    def test_failed_segment_is_retried_alone(self):
+        attempts = {}
+
+        def backend(path):
+            attempts[path] = attempts.get(path, 0) + 1
+            if path == 'b' and attempts[path] == 1:
+                raise RuntimeError('temporary failure')
+            return path.upper()
+
+        texts = transcribe_segments(['a', 'b', 'c'], backend, retry_delay=0)
+
+        self.assertEqual(texts, ['A', 'B', 'C'])
+        self.assertEqual(attempts, {'a': 1, 'b': 2, 'c': 1})
+
+    def test_segment_failing_every_retry_raises(self):
+        def backend(path):
+            raise RuntimeError('permanent failure')
+
+        with self.assertRaises(RuntimeError):
+            transcribe_segments(['a'], backend, retries=1, retry_delay=0)
+
+    def test_short_audio_is_sent_whole(self):
+        backend = StubBackend()
+        self.assertEqual(transcribe_audio(self.audio_file, backend), 'sample.wav 10')
+        self.assertEqual(backend.calls, ['sample.wav'])
+
+    def test_long_audio_is_segmented_in_order(self):
+        backend = StubBackend()
+        text = transcribe_audio(self.audio_file, backend, window=4, overlap=1, use_silence=False)
+
+        self.assertEqual(text, 'segment-0000.wav 4 segment-0001.wav 4 segment-0002.wav 4')
+        self.assertEqual(sorted(backend.calls), ['segment-0000.wav', 'segment-0001.wav', 'segment-0002.wav'])
+        self.assertEqual(sorted(os.listdir(self.directory)), ['sample.wav'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import unittest
+import io
+import sys
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock
+from botocore.exceptions import ClientError
+
+sys.path.append('..')
+
+from utils.transcripts import TranscriptCache
+
+PARAMS = {'model': 'whisper-1', 'language': 'en'}
+
+
+class TranscriptCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.client = MagicMock()
+        self.client.get_object.side_effect = ClientError({'Error': {'Code': 'NoSuchKey', 'Message': 'Not found'}}, 'GetObject')
+        self.cache = TranscriptCache(self.client, 'bucket', max_entries=2)
+
+    def test_memory_hit_after_compute(self):
+        compute = MagicMock(return_value='text')
+
+        self.assertEqual(self.cache.get_or_compute('vid', PARAMS, compute), ('text', 'computed'))
+        self.assertEqual(self.cache.get_or_compute('vid', PARAMS, compute), ('text', 'memory'))
+        compute.assert_called_once()
+        self.client.put_object.assert_called_once()
+
+    def test_stored_transcripts_are_reported(self):
+        stored = []
+        cache = TranscriptCache(self.client, 'bucket', on_store=stored.append)
+
+        cache.get_or_compute('vid', PARAMS, lambda: 'text')
+        self.assertEqual(stored, [cache.key('vid', PARAMS)])
+
+        self.client.put_object.side_effect = ClientError({'Error': {'Code': 'AccessDenied', 'Message': 'Denied'}}, 'PutObject')
+        cache.get_or_compute('other', PARAMS, lambda: 'text')
+        self.assertEqual(len(stored), 1)
+
+    def test_bucket_hit(self):
+        self.client.get_object.side_effect = None
+        self.client.get_object.return_value = {'Body': io.BytesIO(b'stored')}
+        compute = MagicMock()
+
+        self.assertEqual(self.cache.get_or_compute('vid', PARAMS, compute), ('stored', 'bucket'))
+        compute.assert_not_called()
+
+    def test_params_are_part_of_the_key(self):
+        self.assertNotEqual(self.cache.key('vid', PARAMS), self.cache.key('vid', dict(PARAMS, language='de')))
+
+    def test_concurrent_requests_share_one_computation(self):
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def compute():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return 'text'
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            leader = executor.submit(self.cache.get_or_compute, 'vid', PARAMS, compute)
+            started.wait(5)
+            followers = [executor.submit(self.cache.get_or_compute, 'vid', PARAMS, compute) for _ in range(3)]
+            while self.cache.stats['shared'] < 3:
+                time.sleep(0.01)
+            release.set()
+
+            self.assertEqual(leader.result(), ('text', 'computed'))
+            self.assertEqual([follower.result() for follower in followers], [('text', 'shared')] * 3)
+        self.assertEqual(len(calls), 1)
+
+    def test_failure_propagates_to_waiters_and_is_not_cached(self):
+        compute = MagicMock(side_effect=RuntimeError('boom'))
+        with self.assertRaises(RuntimeError):
+            self.cache.get_or_compute('vid', PARAMS, compute)
+
+        compute.side_effect = None
+        compute.return_value = 'text'
+        self.assertEqual(self.cache.get_or_compute('vid', PARAMS, compute), ('text', 'computed'))
+
+
+if __name__ == '__main__':
+    unittest.main()
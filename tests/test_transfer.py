@@ -0,0 +1,53 @@
+import unittest
+import sys
+
+sys.path.append('..')
+
+from utils.transfer import TransferPlanner, MB, GB, MAX_PARTS, MIN_PART_SIZE
+
+
+class TransferPlannerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.planner = TransferPlanner()
+
+    def test_small_object_single_request(self):
+        config = self.planner.plan(100 * 1024)
+        self.assertFalse(config.use_threads)
+        self.assertEqual(config.multipart_threshold, 8 * MB)
+
+    def test_part_size_respects_s3_minimum(self):
+        planner = TransferPlanner(multipart_threshold=1024 * 25, min_part_size=1024 * 25)
+        config = planner.plan(20 * MB)
+        self.assertEqual(config.multipart_chunksize, MIN_PART_SIZE)
+        self.assertEqual(config.multipart_threshold, MIN_PART_SIZE)
+
+    def test_part_count_stays_under_limit(self):
+        size = 200 * GB
+        config = self.planner.plan(size)
+        self.assertLessEqual(-(-size // config.multipart_chunksize), MAX_PARTS)
+        self.assertEqual(config.multipart_chunksize % MB, 0)
+
+    def test_unknown_size_uses_multipart(self):
+        config = self.planner.plan(None)
+        self.assertTrue(config.use_threads)
+        self.assertGreaterEqual(config.multipart_chunksize, 8 * MB)
+
+    def test_concurrency_shared_under_load(self):
+        planner = TransferPlanner(max_concurrency=10, total_concurrency=12)
+        with planner.transfer(1 * GB) as first:
+            self.assertEqual(first.max_concurrency, 10)
+            with planner.transfer(1 * GB) as second:
+                self.assertEqual(second.max_concurrency, 6)
+        self.assertEqual(planner.active_transfers, 0)
+
+    def test_from_config_overrides(self):
+        planner = TransferPlanner.from_config({
+            'TRANSFER_MULTIPART_THRESHOLD': 64 * MB,
+            'TRANSFER_MAX_CONCURRENCY': 4
+        })
+        self.assertEqual(planner.multipart_threshold, 64 * MB)
+        self.assertEqual(planner.plan(1 * GB).max_concurrency, 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
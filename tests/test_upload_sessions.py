@@ -0,0 +1,55 @@
+import unittest
+import sys
+import time
+from unittest.mock import MagicMock, patch
+
+sys.path.append('..')
+
+from utils.upload_sessions import UploadSessionStore
+
+
+class UploadSessionStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.store = UploadSessionStore(':memory:')
+
+    def test_parts(self):
+        session_id = self.store.create('bucket', 'a.bin', 'upload-1', 100, 250)
+        self.store.add_part(session_id, 3, '"c"', 50)
+        self.store.add_part(session_id, 1, '"a"', 100)
+        self.store.add_part(session_id, 1, '"a2"', 100)
+        self.assertEqual(self.store.parts(session_id), [
+            {'part_number': 1, 'etag': '"a2"', 'size': 100},
+            {'part_number': 3, 'etag': '"c"', 'size': 50}
+        ])
+        self.store.delete(session_id)
+        self.assertIsNone(self.store.get(session_id))
+        self.assertEqual(self.store.parts(session_id), [])
+
+    def test_set_size(self):
+        session_id = self.store.create('bucket', 'a.bin', 'upload-1', 100)
+        self.store.set_size(session_id, 250)
+        self.assertEqual(self.store.get(session_id)['size'], 250)
+
+    def test_expired(self):
+        with patch('utils.upload_sessions.time.time', return_value=1000):
+            old = self.store.create('bucket', 'old.bin', 'upload-1', 100)
+        with patch('utils.upload_sessions.time.time', return_value=2000):
+            self.store.add_part(old, 1, '"a"', 100)
+        with patch('utils.upload_sessions.time.time', return_value=1500):
+            idle = self.store.create('bucket', 'idle.bin', 'upload-2', 100)
+        with patch('utils.upload_sessions.time.time', return_value=2100):
+            self.assertEqual([session['id'] for session in self.store.expired(300)], [idle])
+
+    def test_collector_aborts_expired_sessions(self):
+        session_id = self.store.create('bucket', 'a.bin', 'upload-1', 100)
+        abort = MagicMock()
+        self.store.start_collector(abort, ttl=0, interval=60)
+        deadline = time.time() + 5
+        while self.store.get(session_id) is not None and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertIsNone(self.store.get(session_id))
+        self.assertEqual(abort.call_args.args[0]['upload_id'], 'upload-1')
+
+
+if __name__ == '__main__':
+    unittest.main()
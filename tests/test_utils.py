@@ -0,0 +1,57 @@
+import unittest
+import os
+import sys
+import shutil
+import tempfile
+import subprocess
+
+import imageio_ffmpeg
+
+sys.path.append('..')
+
+from utils.utils import get_youtube_id, needs_conversion, convert_to_mp3, transcode_to_mp3
+
+
+class UtilsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.wav_file = os.path.join(self.directory, 'sample.wav')
+        subprocess.run(
+            [imageio_ffmpeg.get_ffmpeg_exe(), '-y', '-loglevel', 'error', '-f', 'lavfi',
+             '-i', 'sine=frequency=440:duration=1', self.wav_file],
+            check=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_get_youtube_id(self):
+        self.assertEqual(get_youtube_id('https://www.youtube.com/watch?v=5hMgUbmrENM'), '5hMgUbmrENM')
+        self.assertEqual(get_youtube_id('https://youtu.be/5hMgUbmrENM'), '5hMgUbmrENM')
+        self.assertIsNone(get_youtube_id('https://example.com'))
+
+    def test_needs_conversion(self):
+        self.assertFalse(needs_conversion('/tmp/id.m4a'))
+        self.assertFalse(needs_conversion('/tmp/id.webm'))
+        self.assertTrue(needs_conversion('/tmp/id.3gpp'))
+
+    def test_convert_to_mp3_removes_source(self):
+        mp3_file = convert_to_mp3(self.wav_file)
+
+        self.assertTrue(mp3_file.endswith('.mp3'))
+        self.assertGreater(os.path.getsize(mp3_file), 1000)
+        self.assertFalse(os.path.exists(self.wav_file))
+
+    def test_transcode_piped_chunks(self):
+        mp3_file = os.path.join(self.directory, 'piped.mp3')
+        with open(self.wav_file, 'rb') as source:
+            transcode_to_mp3(iter(lambda: source.read(4096), b''), mp3_file)
+
+        self.assertGreater(os.path.getsize(mp3_file), 1000)
+
+    def test_transcode_failure(self):
+        with self.assertRaises(RuntimeError):
+            transcode_to_mp3([b'not audio'], os.path.join(self.directory, 'bad.mp3'))
+
+
+if __name__ == '__main__':
+    unittest.main()
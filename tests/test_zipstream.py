@@ -0,0 +1,50 @@
+import unittest
+import sys
+import io
+import zipfile
+
+sys.path.append('..')
+
+from utils.zipstream import ZipEntry, zip_chunks, member_name
+
+
+class ZipStreamTestCase(unittest.TestCase):
+    def test_archive_is_written_as_chunks_arrive(self):
+        consumed = []
+
+        def chunks(name, count):
+            for i in range(count):
+                consumed.append((name, i))
+                yield bytes([i]) * 1000
+
+        stream = zip_chunks([
+            ZipEntry('first.bin', chunks('first', 3), size=3000),
+            ZipEntry('second.bin', chunks('second', 2))
+        ])
+        first = next(stream)
+        # Only the first chunk of the first entry has been read
+        self.assertEqual(consumed, [('first', 0)])
+        data = first + b''.join(stream)
+
+        archive = zipfile.ZipFile(io.BytesIO(data))
+        self.assertIsNone(archive.testzip())
+        self.assertEqual(archive.read('first.bin'), b'\x00' * 1000 + b'\x01' * 1000 + b'\x02' * 1000)
+        self.assertEqual(archive.getinfo('second.bin').file_size, 2000)
+        self.assertEqual(archive.getinfo('second.bin').compress_type, zipfile.ZIP_STORED)
+
+    def test_member_names_stay_inside_the_archive(self):
+        self.assertEqual(member_name('/etc/passwd'), 'etc/passwd')
+        self.assertEqual(member_name('a/../../b//c.txt'), 'a/b/c.txt')
+        self.assertEqual(member_name('..\\..\\evil.txt'), 'evil.txt')
+        self.assertEqual(member_name('/..'), 'unnamed')
+
+        data = b''.join(zip_chunks([ZipEntry('../../escape.txt', [b'x'], size=1)]))
+        self.assertEqual(zipfile.ZipFile(io.BytesIO(data)).namelist(), ['escape.txt'])
+
+    def test_empty_archive(self):
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(zip_chunks([]))))
+        self.assertEqual(archive.namelist(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
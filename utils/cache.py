@@ -0,0 +1,181 @@
+import os
+import time
+import atexit
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class CacheEntry(object):
+    def __init__(self, path, etag, size, content_type):
+        self.path = path
+        self.etag = etag
+        self.size = size
+        self.content_type = content_type
+        self.validated_at = time.monotonic()
+
+
+class CacheWriter(object):
+    """Collects an object's bytes into a temporary file while they are being
+    streamed to a client, and adds them to the cache once complete."""
+
+    def __init__(self, cache, bucket, key, etag, size, content_type):
+        self._cache = cache
+        self._bucket = bucket
+        self._key = key
+        self._etag = etag
+        self._size = size
+        self._content_type = content_type
+        self._written = 0
+        self._file = tempfile.NamedTemporaryFile(dir=cache.directory, suffix='.part', delete=False)
+
+    def write(self, chunk):
+        self._file.write(chunk)
+        self._written += len(chunk)
+
+    def commit(self):
+        self._file.close()
+        if self._written != self._size:
+            # The client went away before the whole object was read
+            self.discard()
+            return
+        self._cache._add(self._bucket, self._key, self._file.name, self._etag,
+                         self._size, self._content_type)
+
+    def discard(self):
+        self._file.close()
+        try:
+            os.remove(self._file.name)
+        except FileNotFoundError:
+            pass
+
+
+class ObjectCache(object):
+    """Size-bounded on-disk read-through cache for S3 objects.
+
+    Entries are keyed by bucket and key and remember the ETag they were
+    fetched with, so callers can revalidate them with If-None-Match. The
+    least recently used entries are evicted once max_bytes is exceeded.
+    Each cache keeps its files in its own subdirectory of root, removed
+    when the process exits, so it never touches anything else there.
+    """
+
+    def __init__(self, root, max_bytes, max_object_bytes=None, revalidate_after=0):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_object_bytes = min(max_object_bytes or max_bytes, max_bytes)
+        self.revalidate_after = revalidate_after
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Entries do not survive a restart
+        os.makedirs(root, exist_ok=True)
+        self.directory = tempfile.mkdtemp(prefix=f'{os.getpid()}-', dir=root)
+        atexit.register(self.close)
+
+    @classmethod
+    def from_config(cls, config):
+        # The cache is disabled unless it is given a byte budget
+        max_bytes = int(config.get('OBJECT_CACHE_MAX_BYTES', 0))
+        if max_bytes <= 0:
+            return None
+        return cls(
+            root=config.get('OBJECT_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'devi-object-cache')),
+            max_bytes=max_bytes,
+            max_object_bytes=int(config.get('OBJECT_CACHE_MAX_OBJECT_BYTES', 0)) or None,
+            revalidate_after=float(config.get('OBJECT_CACHE_REVALIDATE_SECONDS', 0))
+        )
+
+    def get(self, bucket, key):
+        with self._lock:
+            return self._entries.get((bucket, key))
+
+    def is_fresh(self, entry):
+        # Recently validated entries can be served without asking S3
+        return time.monotonic() - entry.validated_at < self.revalidate_after
+
+    def record_hit(self, bucket, key):
+        with self._lock:
+            self.hits += 1
+            entry = self._entries.get((bucket, key))
+            if entry is not None:
+                entry.validated_at = time.monotonic()
+                self._entries.move_to_end((bucket, key))
+
+    def record_miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def writer(self, bucket, key, etag, size, content_type):
+        if not etag or size is None or size > self.max_object_bytes:
+            return None
+        return CacheWriter(self, bucket, key, etag, size, content_type)
+
+    def invalidate(self, bucket, key):
+        with self._lock:
+            entry = self._entries.pop((bucket, key), None)
+            if entry is None:
+                return
+            self.invalidations += 1
+            self._bytes -= entry.size
+        self._remove_file(entry.path)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes
+            }
+
+    def close(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def _add(self, bucket, key, temp_path, etag, size, content_type):
+        digest = hashlib.sha256(f'{bucket}/{key}/{etag}'.encode('utf-8')).hexdigest()
+        path = os.path.join(self.directory, digest)
+        os.replace(temp_path, path)
+
+        evicted = []
+        with self._lock:
+            previous = self._entries.pop((bucket, key), None)
+            if previous is not None:
+                self._bytes -= previous.size
+                if previous.path != path:
+                    evicted.append(previous)
+            self._entries[(bucket, key)] = CacheEntry(path, etag, size, content_type)
+            self._bytes += size
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                _, entry = self._entries.popitem(last=False)
+                self._bytes -= entry.size
+                self.evictions += 1
+                evicted.append(entry)
+
+        # Files still being sent stay readable after they are unlinked
+        for entry in evicted:
+            self._remove_file(entry.path)
+
+    def _remove_file(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.error(f'Could not remove cached file {path}: {str(e)}')
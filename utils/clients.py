@@ -0,0 +1,153 @@
+import time
+import threading
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError
+
+from utils.config import config_flag
+from utils.metrics import S3_OPERATION_SECONDS, S3_POOL_WAIT_SECONDS, S3_ERRORS
+from utils import timing
+
+
+class PoolTimeout(BotoCoreError):
+    fmt = 'No S3 connection became free within {timeout} seconds'
+
+
+class S3Clients(object):
+    """Thread-safe S3 access shared by all requests.
+
+    The low-level client is thread-safe and shared, with a connection pool
+    of max_pool_connections. boto3 resources are not, so every thread gets
+    its own resource, created once and reused, and each of them makes its
+    calls through the shared client and so through the one pool.
+
+    botocore opens extra connections outside a full pool rather than wait,
+    so calls here wait for one of max_pool_connections slots instead, and
+    the time they wait is reported. A call that waits longer than
+    pool_timeout fails with PoolTimeout. The slot is taken once the request
+    is being made, where botocore reports every outcome to after-call or
+    after-call-error, and is given back there. A streamed response body
+    keeps its connection after its call has returned; it is not counted.
+    endpoint_url points the client at another S3-compatible service.
+    """
+
+    def __init__(self, session, max_pool_connections=50, retry_mode='standard', max_attempts=5,
+                 tcp_keepalive=True, endpoint_url=None, pool_timeout=60):
+        self.max_pool_connections = max_pool_connections
+        self.pool_timeout = pool_timeout
+        self.endpoint_url = endpoint_url
+        self._session = session
+        self._config = Config(
+            max_pool_connections=max_pool_connections,
+            tcp_keepalive=tcp_keepalive,
+            retries={'mode': retry_mode, 'max_attempts': max_attempts}
+        )
+        # Sessions are not thread-safe either, creating from them is serialized
+        self._session_lock = threading.Lock()
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_pool_connections)
+        self._in_flight = 0
+        self.stats = {
+            'resources': 0,
+            'requests': 0,
+            'in_flight': 0,
+            'peak_in_flight': 0,
+            'pool_saturated': 0,
+            'pool_wait_seconds': 0.0,
+            'request_seconds': 0.0
+        }
+        self.client = self._create('client')
+        # Per-thread resources are instances of this class made around the
+        # shared client, so they do not create clients of their own
+        self._resource_class = type(session.resource('s3', config=self._config, endpoint_url=endpoint_url))
+
+    @classmethod
+    def from_config(cls, session, config):
+        return cls(
+            session,
+            max_pool_connections=int(config.get('S3_MAX_POOL_CONNECTIONS', 50)),
+            retry_mode=config.get('S3_RETRY_MODE', 'standard'),
+            max_attempts=int(config.get('S3_MAX_ATTEMPTS', 5)),
+            tcp_keepalive=config_flag(config, 'S3_TCP_KEEPALIVE', True),
+            endpoint_url=config.get('S3_ENDPOINT_URL'),
+            pool_timeout=float(config.get('S3_POOL_TIMEOUT_SECONDS', 60))
+        )
+
+    @property
+    def resource(self):
+        resource = getattr(self._local, 'resource', None)
+        if resource is None:
+            # Sub-resources such as Object take the client of the resource
+            # they come from
+            resource = self._resource_class(client=self.client)
+            self._local.resource = resource
+            with self._stats_lock:
+                self.stats['resources'] += 1
+        return resource
+
+    def snapshot(self):
+        with self._stats_lock:
+            stats = dict(self.stats, max_pool_connections=self.max_pool_connections)
+        stats['request_seconds'] = round(stats['request_seconds'], 3)
+        stats['pool_wait_seconds'] = round(stats['pool_wait_seconds'], 3)
+        return stats
+
+    def _create(self, kind):
+        with self._session_lock:
+            created = getattr(self._session, kind)('s3', config=self._config, endpoint_url=self.endpoint_url)
+        created.meta.events.register('request-created.s3', self._take_slot)
+        created.meta.events.register('after-call.s3', self._after_call)
+        created.meta.events.register('after-call-error.s3', self._after_call)
+        return created
+
+    def _take_slot(self, request=None, **kwargs):
+        # The request's context is the call's, handed to after-call and
+        # after-call-error too; the start time in it marks the slot as taken
+        context = getattr(request, 'context', None)
+        if context is None or 'devi_started' in context:
+            return
+        waited = 0.0
+        if not self._slots.acquire(blocking=False):
+            started = time.monotonic()
+            acquired = self._slots.acquire(timeout=self.pool_timeout)
+            waited = time.monotonic() - started
+            S3_POOL_WAIT_SECONDS.observe(waited)
+            if not acquired:
+                with self._stats_lock:
+                    self.stats['pool_saturated'] += 1
+                    self.stats['pool_wait_seconds'] += waited
+                raise PoolTimeout(timeout=self.pool_timeout)
+        context['devi_started'] = time.monotonic()
+        with self._stats_lock:
+            if waited:
+                self.stats['pool_saturated'] += 1
+                self.stats['pool_wait_seconds'] += waited
+            self._in_flight += 1
+            self.stats['in_flight'] = self._in_flight
+            self.stats['peak_in_flight'] = max(self.stats['peak_in_flight'], self._in_flight)
+        timeline = timing.current()
+        if timeline is not None and waited:
+            timeline.add('s3-pool-wait', waited)
+
+    def _after_call(self, model=None, http_response=None, parsed=None, exception=None, context=None, **kwargs):
+        started = (context or {}).pop('devi_started', None)
+        if started is None:
+            return
+        self._slots.release()
+        elapsed = time.monotonic() - started
+        with self._stats_lock:
+            self._in_flight -= 1
+            self.stats['in_flight'] = self._in_flight
+            self.stats['requests'] += 1
+            self.stats['request_seconds'] += elapsed
+
+        operation = model.name if model is not None else 'unknown'
+        S3_OPERATION_SECONDS.observe(elapsed, operation=operation)
+        timeline = timing.current()
+        if timeline is not None:
+            timeline.add(f's3-{operation}', elapsed)
+        if exception is not None:
+            S3_ERRORS.inc(operation=operation, code=type(exception).__name__)
+        elif http_response is not None and http_response.status_code >= 300:
+            code = (parsed or {}).get('Error', {}).get('Code') or str(http_response.status_code)
+            S3_ERRORS.inc(operation=operation, code=code)
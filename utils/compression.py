@@ -0,0 +1,154 @@
+import zlib
+import logging
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from utils.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# Object metadata key recording how the stored bytes are encoded
+ENCODING_METADATA = 'devi-encoding'
+ENCODINGS = ('gzip', 'zstd')
+
+# Types that compress well; images, audio, video and archives usually
+# are compressed already
+DEFAULT_MIME_TYPES = ('text/', 'application/json', 'application/xml', 'application/javascript',
+                      'application/x-ndjson', 'image/svg+xml')
+
+DEFAULT_LEVELS = {'gzip': 6, 'zstd': 3}
+
+# Source bytes read per compress call
+READ_SIZE = 256 * 1024
+
+COMPRESSION_BYTES = REGISTRY.counter(
+    'devi_compression_bytes_total', 'Bytes before and after upload compression', ['encoding', 'stage'])
+
+
+def compressobj(encoding, level=None):
+    level = DEFAULT_LEVELS[encoding] if level is None else level
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=level).compressobj()
+    # wbits 31 writes a gzip header and trailer
+    return zlib.compressobj(level, zlib.DEFLATED, 31)
+
+
+def decompressobj(encoding):
+    if encoding == 'zstd':
+        if zstandard is None:
+            raise RuntimeError('The object is zstd-encoded but zstandard is not installed')
+        return zstandard.ZstdDecompressor().decompressobj()
+    if encoding != 'gzip':
+        raise ValueError(f'Unknown encoding {encoding}')
+    return zlib.decompressobj(31)
+
+
+def stored_encoding(s3_response):
+    # Encoding recorded at upload, None for objects stored as they are
+    return (s3_response.get('Metadata') or {}).get(ENCODING_METADATA)
+
+
+def decompress_chunks(chunks, encoding):
+    decompressor = decompressobj(encoding)
+    for chunk in chunks:
+        data = decompressor.decompress(chunk)
+        if data:
+            yield data
+    tail = decompressor.flush() if hasattr(decompressor, 'flush') else b''
+    if tail:
+        yield tail
+
+
+class CompressingReader(object):
+    """File-like view of a stream whose read() returns compressed bytes.
+
+    The source is read and compressed as the reader is consumed, so
+    uploads of any size run in bounded memory.
+    """
+
+    def __init__(self, stream, encoding, level=None):
+        self.encoding = encoding
+        self._stream = stream
+        self._compressor = compressobj(encoding, level)
+        self._buffer = bytearray()
+        self._done = False
+
+    def _fill(self, chunk):
+        if chunk:
+            COMPRESSION_BYTES.inc(len(chunk), encoding=self.encoding, stage='in')
+            self._buffer.extend(self._compressor.compress(chunk))
+        else:
+            self._buffer.extend(self._compressor.flush())
+            self._done = True
+
+    def _take(self, size):
+        if size is None or size < 0:
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        COMPRESSION_BYTES.inc(len(data), encoding=self.encoding, stage='out')
+        return data
+
+    def read(self, size=-1):
+        while (size is None or size < 0 or len(self._buffer) < size) and not self._done:
+            self._fill(self._stream.read(READ_SIZE))
+        return self._take(size)
+
+
+class AsyncCompressingReader(CompressingReader):
+    """CompressingReader over an async read(size) function."""
+
+    async def read(self, size=-1):
+        while (size is None or size < 0 or len(self._buffer) < size) and not self._done:
+            self._fill(await self._stream(READ_SIZE))
+        return self._take(size)
+
+
+class CompressionPolicy(object):
+    """Decides which uploads are compressed and how.
+
+    Objects whose type starts with one of mime_types and that are not known
+    to be smaller than min_size are compressed with encoding. zstd needs the
+    zstandard package and falls back to gzip without it.
+    """
+
+    def __init__(self, encoding='gzip', level=None, mime_types=DEFAULT_MIME_TYPES, min_size=1024):
+        if encoding not in ENCODINGS:
+            raise ValueError(f'encoding must be one of {", ".join(ENCODINGS)}')
+        if encoding == 'zstd' and zstandard is None:
+            logger.warning('zstandard is not installed, compressing with gzip')
+            encoding = 'gzip'
+        self.encoding = encoding
+        self.level = level
+        self.mime_types = tuple(mime_types)
+        self.min_size = min_size
+
+    @classmethod
+    def from_config(cls, config):
+        # Compression is off unless COMPRESSION_ENCODING is set
+        encoding = config.get('COMPRESSION_ENCODING')
+        if not encoding:
+            return None
+        level = config.get('COMPRESSION_LEVEL')
+        return cls(
+            encoding=encoding,
+            level=int(level) if level is not None else None,
+            mime_types=config.get('COMPRESSION_MIME_TYPES', DEFAULT_MIME_TYPES),
+            min_size=int(config.get('COMPRESSION_MIN_BYTES', 1024))
+        )
+
+    def encoding_for(self, mime_type, size=None):
+        if not mime_type or (size is not None and size < self.min_size):
+            return None
+        if any(mime_type.startswith(prefix) for prefix in self.mime_types):
+            return self.encoding
+        return None
+
+    def reader(self, stream):
+        return CompressingReader(stream, self.encoding, self.level)
+
+    def async_reader(self, read):
+        return AsyncCompressingReader(read, self.encoding, self.level)
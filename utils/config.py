@@ -0,0 +1,45 @@
+import os
+import json
+import logging
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Environment variable naming the configuration file
+CONFIG_PATH_ENV = 'DEVI_CONFIG'
+DEFAULT_CONFIG_PATH = '.env.json'
+
+_config = None
+_config_lock = threading.Lock()
+
+
+def load_config():
+    # Parses the configuration file once per process, every caller shares
+    # the same dict
+    global _config
+    with _config_lock:
+        if _config is None:
+            path = os.environ.get(CONFIG_PATH_ENV, DEFAULT_CONFIG_PATH)
+            with open(path) as config_file:
+                _config = json.load(config_file)
+            logger.info(f'Loaded configuration from {path}')
+        return _config
+
+
+def config_flag(config, name, default=False):
+    # Boolean setting, given as a JSON boolean or as a string such as
+    # "true" or "false"
+    value = config.get(name, default)
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes', 'on')
+    return bool(value)
+
+
+def data_path(config, name):
+    # Where a store keeps its file when its path is not configured: in
+    # DATA_DIR, a directory under the system's temporary directory unless
+    # set, so importing the app never writes to the working directory
+    directory = config.get('DATA_DIR', os.path.join(tempfile.gettempdir(), 'devi-data'))
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, name)
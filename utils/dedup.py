@@ -0,0 +1,137 @@
+import hashlib
+import logging
+import sqlite3
+import threading
+
+from utils.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# Object metadata key holding the sha256 of the object's content
+DIGEST_METADATA = 'devi-sha256'
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+DEDUP_CHECKS = REGISTRY.counter(
+    'devi_dedup_checks_total', 'Uploads checked for an identical stored object', ['result'])
+DEDUP_BYTES_SAVED = REGISTRY.counter(
+    'devi_dedup_bytes_saved_total', 'Upload bytes not transferred because the content was stored already')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS digests (
+    bucket TEXT NOT NULL,
+    key TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    size INTEGER,
+    etag TEXT,
+    PRIMARY KEY (bucket, key)
+);
+CREATE INDEX IF NOT EXISTS digests_by_digest ON digests (bucket, digest);
+'''
+
+
+def hash_stream(stream):
+    # (sha256, size) of a seekable stream from its current position, which
+    # is restored afterwards. None for streams that cannot be rewound.
+    try:
+        position = stream.tell()
+        stream.seek(position)
+    except (AttributeError, OSError, ValueError):
+        return None
+    digest = hashlib.sha256()
+    size = 0
+    for chunk in iter(lambda: stream.read(HASH_CHUNK_SIZE), b''):
+        digest.update(chunk)
+        size += len(chunk)
+    stream.seek(position)
+    return digest.hexdigest(), size
+
+
+class HashingReader(object):
+    """Hashes a stream as it is read, for streams that cannot be rewound."""
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._digest = hashlib.sha256()
+        self.size = 0
+
+    def read(self, size=-1):
+        data = self._stream.read(size)
+        self._digest.update(data)
+        self.size += len(data)
+        return data
+
+    def hexdigest(self):
+        return self._digest.hexdigest()
+
+
+class DigestIndex(object):
+    """Content digests of the objects uploaded through the service.
+
+    Maps sha256 digests to the keys holding that content, so an upload of
+    content that is already stored can be replaced by a server-side copy.
+    Rows are hints: a candidate is only used after its stored checksum
+    metadata or ETag has been checked against S3.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        if path != ':memory:':
+            self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(SCHEMA)
+        self.stats = {'checks': 0, 'hits': 0, 'bytes_checked': 0, 'bytes_saved': 0}
+
+    @classmethod
+    def from_config(cls, config):
+        # Deduplication is disabled unless it is given a database path,
+        # ':memory:' keeps the index for the life of the process
+        path = config.get('DEDUP_INDEX_PATH')
+        if not path:
+            return None
+        return cls(path)
+
+    def put(self, bucket, key, digest, size, etag=None):
+        with self._lock:
+            self._conn.execute(
+                'INSERT INTO digests (bucket, key, digest, size, etag) VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT (bucket, key) DO UPDATE SET digest = excluded.digest, '
+                'size = excluded.size, etag = excluded.etag',
+                (bucket, key, digest, size, etag))
+
+    def remove(self, bucket, keys):
+        with self._lock:
+            self._conn.executemany(
+                'DELETE FROM digests WHERE bucket = ? AND key = ?',
+                [(bucket, key) for key in keys])
+
+    def get(self, bucket, key):
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT key, digest, size, etag FROM digests WHERE bucket = ? AND key = ?',
+                (bucket, key)).fetchone()
+        return dict(row) if row else None
+
+    def candidates(self, bucket, digest, size):
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT key, digest, size, etag FROM digests WHERE bucket = ? AND digest = ? AND size = ?',
+                (bucket, digest, size)).fetchall()
+        return [dict(row) for row in rows]
+
+    def record_check(self, size, hit):
+        with self._lock:
+            self.stats['checks'] += 1
+            self.stats['bytes_checked'] += size
+            if hit:
+                self.stats['hits'] += 1
+                self.stats['bytes_saved'] += size
+
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['entries'] = self._conn.execute('SELECT COUNT(*) FROM digests').fetchone()[0]
+        stats['hit_rate'] = round(stats['hits'] / stats['checks'], 4) if stats['checks'] else 0.0
+        return stats
@@ -0,0 +1,282 @@
+import os
+import json
+import time
+import uuid
+import queue
+import socket
+import logging
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from utils.config import data_path
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    params TEXT NOT NULL,
+    status TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    stages TEXT NOT NULL DEFAULT '{}',
+    progress TEXT,
+    owner TEXT,
+    lease_expires REAL,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at);
+'''
+
+PENDING = 'pending'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+
+
+class Job(object):
+    """Handed to job handlers to time the stages of their work."""
+
+    def __init__(self, job_queue, job_id, params):
+        self.id = job_id
+        self.params = params
+        self.stages = {}
+        self._queue = job_queue
+
+    def progress(self, progress):
+        # Replaces the job's JSON-serializable progress report
+        self._queue._record_progress(self.id, progress)
+
+    @contextmanager
+    def stage(self, name):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - started
+            self.stages[name] = round(elapsed, 3)
+            self._queue._record_stage(self.id, name, elapsed, self.stages)
+
+
+class JobQueue(object):
+    """Background jobs persisted in SQLite and run by a bounded worker pool.
+
+    Submitting only writes a row and wakes a worker. Several processes can
+    share one store: a worker claims a job by switching it from pending to
+    running in a single UPDATE, so each job runs once, and holds a lease on
+    it that its process renews while it runs. Jobs whose lease expired,
+    because their process stopped, are queued again, as are pending jobs
+    that no process has picked up.
+    """
+
+    def __init__(self, path, workers=2, lease_seconds=60):
+        self.path = path
+        self.workers = workers
+        self.lease_seconds = lease_seconds
+        self.owner = f'{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}'
+        self._handlers = {}
+        self._queue = queue.Queue()
+        # Ids in _queue, so rescans of the store do not queue a job twice
+        self._queued = set()
+        self._running = 0
+        self._stage_totals = {}
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(SCHEMA)
+        columns = {row['name'] for row in self._conn.execute('PRAGMA table_info(jobs)')}
+        # Stores created before progress reports and leases
+        for column, kind in (('progress', 'TEXT'), ('owner', 'TEXT'), ('lease_expires', 'REAL')):
+            if column not in columns:
+                self._conn.execute(f'ALTER TABLE jobs ADD COLUMN {column} {kind}')
+        self._threads = []
+        self._stopped = threading.Event()
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            path=config.get('JOB_STORE_PATH') or data_path(config, 'jobs.sqlite3'),
+            workers=int(config.get('JOB_WORKERS', 2)),
+            lease_seconds=float(config.get('JOB_LEASE_SECONDS', 60))
+        )
+
+    def register(self, kind, handler):
+        # handler(params, job) returns a JSON-serializable result
+        self._handlers[kind] = handler
+
+    def start(self):
+        resumed = self._recover(pending_before=None)
+        if resumed:
+            logger.info(f'Resuming {resumed} pending jobs')
+
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f'job-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(target=self._maintain, name='job-leases', daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        # Running jobs finish first, queued ones stay pending in the store
+        self._stopped.set()
+        for _ in range(self.workers):
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _recover(self, pending_before):
+        # Queues the jobs of expired leases, and pending jobs created before
+        # pending_before (all of them when None), in this process
+        now = time.time()
+        with self._lock:
+            expired = self._conn.execute(
+                'SELECT id FROM jobs WHERE status = ? AND (lease_expires IS NULL OR lease_expires < ?)',
+                (RUNNING, now)).fetchall()
+            for row in expired:
+                self._conn.execute(
+                    'UPDATE jobs SET status = ?, owner = NULL, lease_expires = NULL '
+                    'WHERE id = ? AND status = ? AND (lease_expires IS NULL OR lease_expires < ?)',
+                    (PENDING, row['id'], RUNNING, now))
+            rows = self._conn.execute(
+                'SELECT id FROM jobs WHERE status = ? AND created_at < ? ORDER BY created_at',
+                (PENDING, now if pending_before is None else pending_before)).fetchall()
+        if expired:
+            logger.info(f'Requeued {len(expired)} jobs whose lease expired')
+        for row in rows:
+            self._enqueue(row['id'])
+        return len(rows)
+
+    def _enqueue(self, job_id):
+        with self._lock:
+            if job_id in self._queued:
+                return
+            self._queued.add(job_id)
+        self._queue.put(job_id)
+
+    def _maintain(self):
+        # Renews the leases of this process's running jobs and picks up
+        # jobs other processes left behind
+        interval = self.lease_seconds / 3
+        while not self._stopped.wait(interval):
+            try:
+                with self._lock:
+                    self._conn.execute(
+                        'UPDATE jobs SET lease_expires = ? WHERE owner = ? AND status = ?',
+                        (time.time() + self.lease_seconds, self.owner, RUNNING))
+                self._recover(pending_before=time.time() - self.lease_seconds)
+            except sqlite3.Error as e:
+                logger.error(f'Could not renew job leases: {str(e)}')
+
+    def submit(self, kind, params):
+        if kind not in self._handlers:
+            raise ValueError(f'Unknown job kind {kind}')
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._conn.execute(
+                'INSERT INTO jobs (id, kind, params, status, created_at) VALUES (?, ?, ?, ?, ?)',
+                (job_id, kind, json.dumps(params), PENDING, time.time()))
+        self._enqueue(job_id)
+        return job_id
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = {
+            'job_id': row['id'],
+            'kind': row['kind'],
+            'params': json.loads(row['params']),
+            'status': row['status'],
+            'stages': json.loads(row['stages']),
+            'created_at': row['created_at'],
+            'started_at': row['started_at'],
+            'finished_at': row['finished_at']
+        }
+        if row['progress'] is not None:
+            job['progress'] = json.loads(row['progress'])
+        if row['result'] is not None:
+            job['result'] = json.loads(row['result'])
+        if row['error'] is not None:
+            job['error'] = row['error']
+        return job
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._conn.execute(
+                'SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+            stages = {
+                name: {'count': count, 'total_seconds': round(total, 3),
+                       'average_seconds': round(total / count, 3)}
+                for name, (count, total) in self._stage_totals.items()
+            }
+            return {
+                'queue_depth': counts.get(PENDING, 0),
+                'running': self._running,
+                'workers': self.workers,
+                'jobs': counts,
+                'stages': stages
+            }
+
+    def _record_stage(self, job_id, name, elapsed, stages):
+        with self._lock:
+            count, total = self._stage_totals.get(name, (0, 0.0))
+            self._stage_totals[name] = (count + 1, total + elapsed)
+            self._conn.execute('UPDATE jobs SET stages = ? WHERE id = ?', (json.dumps(stages), job_id))
+
+    def _record_progress(self, job_id, progress):
+        with self._lock:
+            self._conn.execute('UPDATE jobs SET progress = ? WHERE id = ?', (json.dumps(progress), job_id))
+
+    def _finish(self, job_id, status, result=None, error=None):
+        with self._lock:
+            cursor = self._conn.execute(
+                'UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?, lease_expires = NULL '
+                'WHERE id = ? AND owner = ? AND status = ?',
+                (status, json.dumps(result) if result is not None else None, error, time.time(),
+                 job_id, self.owner, RUNNING))
+        if cursor.rowcount != 1:
+            logger.error(f'Job {job_id} lost its lease, its outcome was not recorded')
+
+    def _claim(self, job_id):
+        # Only one worker of any process can switch the job to running
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                'UPDATE jobs SET status = ?, owner = ?, lease_expires = ?, started_at = ? '
+                'WHERE id = ? AND status = ?',
+                (RUNNING, self.owner, now + self.lease_seconds, now, job_id, PENDING))
+            if cursor.rowcount != 1:
+                return None
+            self._running += 1
+            return self._conn.execute('SELECT kind, params FROM jobs WHERE id = ?', (job_id,)).fetchone()
+
+    def _work(self):
+        while True:
+            job_id = self._queue.get()
+            if job_id is None:
+                return
+            with self._lock:
+                self._queued.discard(job_id)
+            row = self._claim(job_id)
+            if row is None:
+                continue
+
+            try:
+                job = Job(self, job_id, json.loads(row['params']))
+                result = self._handlers[row['kind']](job.params, job)
+                self._finish(job_id, SUCCEEDED, result=result)
+                logger.info(f'Job {job_id} finished')
+            except Exception as e:
+                logger.error(f'Job {job_id} failed: {str(e)}')
+                self._finish(job_id, FAILED, error=str(e))
+            finally:
+                with self._lock:
+                    self._running -= 1
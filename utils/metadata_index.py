@@ -0,0 +1,186 @@
+import time
+import logging
+import sqlite3
+import mimetypes
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Sorts after every key that starts with a given prefix
+PREFIX_END = '\U0010ffff'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS objects (
+    bucket TEXT NOT NULL,
+    key TEXT NOT NULL,
+    size INTEGER,
+    mime_type TEXT,
+    etag TEXT,
+    last_modified TEXT,
+    indexed_at REAL NOT NULL,
+    generation INTEGER NOT NULL,
+    PRIMARY KEY (bucket, key)
+);
+CREATE TABLE IF NOT EXISTS sync_state (
+    bucket TEXT PRIMARY KEY,
+    generation INTEGER NOT NULL,
+    synced_at REAL
+);
+'''
+
+
+class MetadataIndex(object):
+    """Local SQLite copy of the bucket listing.
+
+    A bulk sync fills the index from ListObjectsV2, the service's own uploads
+    and deletes keep it current, and periodic reconciliation re-lists the
+    bucket and drops rows for keys that no longer exist.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(SCHEMA)
+        self._reconciler = None
+
+    @classmethod
+    def from_config(cls, config):
+        # The index is disabled unless it is given a database path
+        path = config.get('METADATA_INDEX_PATH')
+        if not path:
+            return None
+        return cls(path)
+
+    def _generation(self, bucket):
+        row = self._conn.execute(
+            'SELECT generation FROM sync_state WHERE bucket = ?', (bucket,)).fetchone()
+        return row['generation'] if row else 0
+
+    def is_ready(self, bucket):
+        # Listings are only answered from the index after a full sync
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT synced_at FROM sync_state WHERE bucket = ?', (bucket,)).fetchone()
+        return row is not None and row['synced_at'] is not None
+
+    def put(self, bucket, key, size, etag, last_modified):
+        with self._lock:
+            self._upsert(bucket, [(key, size, etag, last_modified)], self._generation(bucket))
+
+    def remove(self, bucket, keys):
+        with self._lock:
+            self._conn.executemany(
+                'DELETE FROM objects WHERE bucket = ? AND key = ?',
+                [(bucket, key) for key in keys])
+
+    def get(self, bucket, key):
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT * FROM objects WHERE bucket = ? AND key = ?', (bucket, key)).fetchone()
+        return self._entry(row) if row else None
+
+    def list(self, bucket, prefix='', delimiter=None, max_keys=1000, continuation_token=None):
+        # Mirrors a ListObjectsV2 page; the continuation token is the last
+        # key or common prefix returned
+        files = []
+        prefixes = []
+        after = continuation_token or ''
+        upper = prefix + PREFIX_END
+        with self._lock:
+            while len(files) + len(prefixes) < max_keys:
+                rows = self._conn.execute(
+                    'SELECT * FROM objects WHERE bucket = ? AND key > ? AND key >= ? AND key < ? '
+                    'ORDER BY key LIMIT ?',
+                    (bucket, after, prefix, upper, max_keys - len(files) - len(prefixes))).fetchall()
+                if not rows:
+                    break
+                for row in rows:
+                    rest = row['key'][len(prefix):]
+                    if delimiter and delimiter in rest:
+                        common_prefix = prefix + rest[:rest.index(delimiter) + len(delimiter)]
+                        prefixes.append(common_prefix)
+                        # Skip every other key under the common prefix
+                        after = common_prefix + PREFIX_END
+                        break
+                    files.append(self._entry(row))
+                    after = row['key']
+
+            more = self._conn.execute(
+                'SELECT 1 FROM objects WHERE bucket = ? AND key > ? AND key >= ? AND key < ? LIMIT 1',
+                (bucket, after, prefix, upper)).fetchone()
+        return files, prefixes, after if more else None
+
+    def iter_objects(self, bucket, prefix='', batch_size=1000):
+        after = None
+        while True:
+            files, _, after = self.list(bucket, prefix, max_keys=batch_size, continuation_token=after)
+            for entry in files:
+                yield entry
+            if after is None:
+                return
+
+    def sync(self, bucket, client):
+        # Full re-listing. Rows that were not seen again (and not written
+        # since the sync began) belong to deleted keys and are dropped.
+        started = time.time()
+        with self._lock:
+            generation = self._generation(bucket) + 1
+            self._conn.execute(
+                'INSERT INTO sync_state (bucket, generation) VALUES (?, ?) '
+                'ON CONFLICT (bucket) DO UPDATE SET generation = excluded.generation',
+                (bucket, generation))
+
+        count = 0
+        paginator = client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=bucket):
+            rows = [(obj['Key'], obj.get('Size'), obj.get('ETag'), obj.get('LastModified'))
+                    for obj in page.get('Contents', [])]
+            with self._lock:
+                self._upsert(bucket, rows, generation)
+            count += len(rows)
+
+        with self._lock:
+            removed = self._conn.execute(
+                'DELETE FROM objects WHERE bucket = ? AND generation < ?', (bucket, generation)).rowcount
+            self._conn.execute(
+                'UPDATE sync_state SET synced_at = ? WHERE bucket = ?', (time.time(), bucket))
+        logger.info(f'Indexed {count} objects of {bucket}, removed {removed} stale entries '
+                    f'in {time.time() - started:.1f}s')
+        return count
+
+    def start_reconciler(self, bucket, client, interval):
+        # Initial bulk sync followed by a reconciliation every interval seconds
+        def run():
+            while True:
+                try:
+                    self.sync(bucket, client)
+                except Exception as e:
+                    logger.error(f'Metadata index sync failed: {str(e)}')
+                time.sleep(interval)
+
+        self._reconciler = threading.Thread(target=run, name='metadata-index', daemon=True)
+        self._reconciler.start()
+
+    def _upsert(self, bucket, rows, generation):
+        now = time.time()
+        self._conn.executemany(
+            'INSERT INTO objects (bucket, key, size, mime_type, etag, last_modified, indexed_at, generation) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT (bucket, key) DO UPDATE SET size = excluded.size, etag = excluded.etag, '
+            'last_modified = excluded.last_modified, indexed_at = excluded.indexed_at, '
+            'generation = excluded.generation',
+            [(bucket, key, size, mimetypes.guess_type(key)[0], etag,
+              last_modified.isoformat() if last_modified else None, now, generation)
+             for key, size, etag, last_modified in rows])
+
+    def _entry(self, row):
+        return {
+            'file_name': row['key'],
+            'mime_type': row['mime_type'],
+            'size': row['size'],
+            'last_modified': row['last_modified'],
+            'etag': row['etag']
+        }
@@ -0,0 +1,211 @@
+import os
+import re
+import time
+import fcntl
+import atexit
+import shutil
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+NAME_PATTERN = re.compile(r'[^A-Za-z0-9_.-]')
+
+# Held while instances start, sweep or change their reservations
+QUOTA_LOCK = '.quota.lock'
+LOCK_SUFFIX = '.lock'
+
+# Reservations that do not fit are retried at least this often, since
+# other processes cannot wake the waiting threads
+POLL_SECONDS = 0.5
+
+
+class ScratchSpaceFull(RuntimeError):
+    pass
+
+
+class ScratchArea(object):
+    """A private directory for the temporary files of one request or job."""
+
+    def __init__(self, space, path):
+        self.space = space
+        self.path = path
+        self.reserved = 0
+
+    def reserve(self, nbytes):
+        # Blocks until the space has room for nbytes more
+        self.space._acquire(nbytes)
+        self.reserved += nbytes
+
+    def file(self, name):
+        return os.path.join(self.path, os.path.basename(name))
+
+
+class ScratchSpace(object):
+    """Temporary files under one root with a byte quota and guaranteed cleanup.
+
+    Every area is a unique directory, so requests for the same name never
+    collide, and it is removed when its block exits. Areas reserve the bytes
+    they expect to write; a reservation that does not fit waits for other
+    areas to finish, up to wait_seconds.
+
+    The quota is shared by every process using the same root. Each process
+    works in its own subdirectory and holds an exclusive lock on a file
+    next to it for as long as it runs, with its reserved bytes written in
+    that file. A lock that can be taken belongs to a process that is gone,
+    whatever its pid is now used for, so its directory is swept and its
+    reservation is not counted.
+    """
+
+    def __init__(self, root, quota_bytes, wait_seconds=600):
+        self.root = root
+        self.quota_bytes = quota_bytes
+        self.wait_seconds = wait_seconds
+        self._reserved = 0
+        self._condition = threading.Condition()
+        self.stats = {'areas': 0, 'active_areas': 0, 'waits': 0, 'rejected': 0, 'swept': 0}
+        self.directory = None
+        self._lock_file = None
+        os.makedirs(root, exist_ok=True)
+        with self._quota_lock():
+            self._sweep()
+            self.directory = tempfile.mkdtemp(prefix=f'{os.getpid()}-', dir=root)
+            self._lock_file = open(self.directory + LOCK_SUFFIX, 'w+')
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            self._publish()
+        atexit.register(self._remove)
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            root=config.get('SCRATCH_DIR', os.path.join(tempfile.gettempdir(), 'devi-scratch')),
+            quota_bytes=int(config.get('SCRATCH_QUOTA_BYTES', 20 * 1024 ** 3)),
+            wait_seconds=float(config.get('SCRATCH_WAIT_SECONDS', 600))
+        )
+
+    @contextmanager
+    def _quota_lock(self):
+        with open(os.path.join(self.root, QUOTA_LOCK), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _owners(self):
+        # (directory, reserved bytes) of every other live process
+        owners = []
+        for entry in os.listdir(self.root):
+            if not entry.endswith(LOCK_SUFFIX) or entry == QUOTA_LOCK:
+                continue
+            path = os.path.join(self.root, entry)
+            if self._lock_file is not None and path == self._lock_file.name:
+                continue
+            try:
+                with open(path) as lock:
+                    try:
+                        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        owners.append((path[:-len(LOCK_SUFFIX)], int(lock.read() or 0)))
+            except (OSError, ValueError):
+                continue
+        return owners
+
+    def sweep(self):
+        with self._quota_lock():
+            self._sweep()
+
+    def _sweep(self):
+        # Removes what earlier processes left behind: directories whose
+        # lock is not held and anything that is not a live process's
+        # directory or lock. Runs with the quota lock held, so no process
+        # is between creating its directory and locking it.
+        live = [directory for directory, _ in self._owners()]
+        if self.directory is not None:
+            live.append(self.directory)
+        keep = {os.path.join(self.root, QUOTA_LOCK)}
+        keep.update(live)
+        keep.update(directory + LOCK_SUFFIX for directory in live)
+        for entry in os.listdir(self.root):
+            path = os.path.join(self.root, entry)
+            if path in keep:
+                continue
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+            self.stats['swept'] += 1
+            logger.info(f'Removed orphaned scratch files {path}')
+
+    def _publish(self):
+        # Writes this process's reservation, with the quota lock held
+        self._lock_file.seek(0)
+        self._lock_file.truncate()
+        self._lock_file.write(str(self._reserved))
+        self._lock_file.flush()
+
+    def _remove(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+        try:
+            os.remove(self._lock_file.name)
+        except OSError:
+            pass
+        self._lock_file.close()
+
+    @contextmanager
+    def area(self, name='area', reserve=0):
+        path = tempfile.mkdtemp(prefix=f'{NAME_PATTERN.sub("-", name)[:64]}-', dir=self.directory)
+        area = ScratchArea(self, path)
+        with self._condition:
+            self.stats['areas'] += 1
+            self.stats['active_areas'] += 1
+        try:
+            if reserve:
+                area.reserve(reserve)
+            yield area
+        finally:
+            shutil.rmtree(path, ignore_errors=True)
+            self._release(area.reserved)
+            with self._condition:
+                self.stats['active_areas'] -= 1
+
+    def _acquire(self, nbytes):
+        if nbytes > self.quota_bytes:
+            with self._condition:
+                self.stats['rejected'] += 1
+            raise ScratchSpaceFull(f'{nbytes} bytes exceed the scratch quota of {self.quota_bytes}')
+        deadline = time.monotonic() + self.wait_seconds
+        waited = False
+        with self._condition:
+            while True:
+                with self._quota_lock():
+                    others = sum(reserved for _, reserved in self._owners())
+                    if others + self._reserved + nbytes <= self.quota_bytes:
+                        self._reserved += nbytes
+                        self._publish()
+                        return
+                if not waited:
+                    waited = True
+                    self.stats['waits'] += 1
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.stats['rejected'] += 1
+                    raise ScratchSpaceFull(f'No room for {nbytes} bytes of scratch space')
+                self._condition.wait(min(remaining, POLL_SECONDS))
+
+    def _release(self, nbytes):
+        if nbytes:
+            with self._condition:
+                with self._quota_lock():
+                    self._reserved -= nbytes
+                    self._publish()
+                self._condition.notify_all()
+
+    def snapshot(self):
+        with self._condition:
+            return dict(self.stats, reserved_bytes=self._reserved, quota_bytes=self.quota_bytes)
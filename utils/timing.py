@@ -0,0 +1,173 @@
+import re
+import sys
+import json
+import time
+import logging
+import threading
+import contextvars
+from functools import wraps
+from collections import Counter
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Timeline of the request or job the current code runs for. Work handed to
+# other threads keeps it when the callable is wrapped with propagate().
+_current = contextvars.ContextVar('timeline', default=None)
+
+TOKEN_PATTERN = re.compile(r'[^A-Za-z0-9_.-]')
+
+
+class Timeline(object):
+    """Named spans of one request or job.
+
+    Spans with the same name add up, so a stage run in several parts, or in
+    parallel threads, is reported once with its total time and count.
+    """
+
+    def __init__(self, name, **fields):
+        self.name = name
+        self.fields = fields
+        self.started = time.perf_counter()
+        self._spans = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds):
+        with self._lock:
+            total, count = self._spans.get(name, (0.0, 0))
+            self._spans[name] = (total + seconds, count + 1)
+
+    def spans(self):
+        with self._lock:
+            return dict(self._spans)
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self):
+        # Server-Timing header value, durations in milliseconds
+        entries = []
+        for name, (seconds, count) in self.spans().items():
+            entry = f'{TOKEN_PATTERN.sub("-", name)};dur={seconds * 1000:.1f}'
+            if count > 1:
+                entry += f';desc="{count} calls"'
+            entries.append(entry)
+        entries.append(f'total;dur={self.elapsed() * 1000:.1f}')
+        return ', '.join(entries)
+
+    def record(self, **extra):
+        record = {'timeline': self.name, 'total_ms': round(self.elapsed() * 1000, 1)}
+        record.update(self.fields)
+        record.update(extra)
+        record['spans'] = {name: {'ms': round(seconds * 1000, 1), 'count': count}
+                           for name, (seconds, count) in self.spans().items()}
+        return record
+
+
+def start(name, **fields):
+    timeline = Timeline(name, **fields)
+    _current.set(timeline)
+    return timeline
+
+
+def stop():
+    _current.set(None)
+
+
+def current():
+    return _current.get()
+
+
+def log(timeline, **extra):
+    # One JSON line per request or job
+    logger.info(json.dumps(timeline.record(**extra), default=str))
+
+
+@contextmanager
+def timeline(name, **fields):
+    # Times a unit of work outside a request, such as a job, and logs it
+    previous = _current.get()
+    started = start(name, **fields)
+    try:
+        yield started
+    finally:
+        log(started)
+        _current.set(previous)
+
+
+@contextmanager
+def span(name):
+    # Adds the time spent in the block to the current timeline, if any
+    timeline = _current.get()
+    if timeline is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timeline.add(name, time.perf_counter() - started)
+
+
+def timed(name):
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return f(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def propagate(f):
+    # f bound to the caller's context, for work sent to a thread pool. Each
+    # call runs in its own copy, so parallel calls can share one wrapper.
+    context = contextvars.copy_context()
+
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        return context.copy().run(f, *args, **kwargs)
+    return wrapper
+
+
+class SamplingProfiler(object):
+    """Samples the stack of one thread at a fixed interval.
+
+    A background thread reads the target thread's current frame, so the
+    profiled code runs unmodified. Stacks are kept in collapsed form
+    (root;...;leaf), which flame graph tools read directly.
+    """
+
+    def __init__(self, thread_id=None, interval=0.005, max_depth=64):
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.interval = interval
+        self.max_depth = max_depth
+        self.samples = Counter()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None and len(stack) < self.max_depth:
+                code = frame.f_code
+                stack.append(f'{code.co_filename.rsplit("/", 1)[-1]}:{code.co_name}')
+                frame = frame.f_back
+            self.samples[';'.join(reversed(stack))] += 1
+
+    def top(self, limit=20):
+        return [{'stack': stack, 'samples': count} for stack, count in self.samples.most_common(limit)]
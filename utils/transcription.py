@@ -0,0 +1,176 @@
+import os
+import re
+import time
+import shutil
+import logging
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import imageio_ffmpeg
+
+from utils.timing import timed, propagate
+
+logger = logging.getLogger(__name__)
+
+# The transcription API rejects uploads above 25 MB
+MAX_UPLOAD_BYTES = 24 * 1024 * 1024
+
+DURATION_PATTERN = re.compile(r'Duration: (\d+):(\d+):(\d+(?:\.\d+)?)')
+SILENCE_START_PATTERN = re.compile(r'silence_start: (-?\d+(?:\.\d+)?)')
+SILENCE_END_PATTERN = re.compile(r'silence_end: (\d+(?:\.\d+)?)')
+WORD_PATTERN = re.compile(r"[\w']+")
+
+
+def _ffmpeg(args):
+    process = subprocess.run([imageio_ffmpeg.get_ffmpeg_exe(), '-hide_banner'] + args,
+                             stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    return process.returncode, process.stderr.decode('utf-8', 'replace')
+
+
+def audio_duration(path):
+    _, output = _ffmpeg(['-i', path])
+    match = DURATION_PATTERN.search(output)
+    if not match:
+        raise RuntimeError(f'Could not read the duration of {path}')
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+@timed('silence-detect')
+def silence_points(path, noise='-30dB', min_silence=0.5):
+    # Midpoints of the silent stretches ffmpeg's silencedetect finds
+    _, output = _ffmpeg(['-i', path, '-af', f'silencedetect=noise={noise}:d={min_silence}', '-f', 'null', '-'])
+    starts = [float(value) for value in SILENCE_START_PATTERN.findall(output)]
+    ends = [float(value) for value in SILENCE_END_PATTERN.findall(output)]
+    return [(start + end) / 2 for start, end in zip(starts, ends)]
+
+
+def segment_options_from_config(config):
+    # Keyword arguments of transcribe_audio, checked so windows always advance
+    options = {
+        'window': float(config.get('TRANSCRIPTION_SEGMENT_SECONDS', 600)),
+        'overlap': float(config.get('TRANSCRIPTION_OVERLAP_SECONDS', 5)),
+        'max_workers': int(config.get('TRANSCRIPTION_SEGMENT_WORKERS', 4)),
+        'retries': int(config.get('TRANSCRIPTION_SEGMENT_RETRIES', 2))
+    }
+    if not 0 <= options['overlap'] < options['window']:
+        raise ValueError('TRANSCRIPTION_OVERLAP_SECONDS must be at least 0 and less than '
+                         'TRANSCRIPTION_SEGMENT_SECONDS')
+    return options
+
+
+def plan_windows(duration, window, overlap, silences=()):
+    """Splits [0, duration] into (start, end) windows of at most window seconds.
+
+    Each window ends at the last silence in its second half when there is
+    one. Otherwise it is cut at the window length and the next window starts
+    overlap seconds earlier, so no words are lost at the cut.
+    """
+    if not 0 <= overlap < window:
+        raise ValueError(f'overlap must be at least 0 and less than the window, got {overlap} and {window}')
+    windows = []
+    start = 0.0
+    while duration - start > window:
+        limit = start + window
+        cuts = [point for point in silences if start + window / 2 < point <= limit]
+        if cuts:
+            end = max(cuts)
+            next_start = end
+        else:
+            end = limit
+            next_start = end - overlap
+        windows.append((start, end))
+        start = next_start
+    windows.append((start, duration))
+    return windows
+
+
+@timed('split')
+def split_audio(path, windows, directory):
+    # Cuts the windows out without re-encoding
+    extension = os.path.splitext(path)[1]
+    segments = []
+    for i, (start, end) in enumerate(windows):
+        segment = os.path.join(directory, f'segment-{i:04d}{extension}')
+        returncode, output = _ffmpeg(['-y', '-loglevel', 'error', '-ss', f'{start:.3f}', '-t', f'{end - start:.3f}',
+                                      '-i', path, '-vn', '-c', 'copy', segment])
+        if returncode != 0:
+            raise RuntimeError(f'ffmpeg failed: {output.strip()}')
+        segments.append(segment)
+    return segments
+
+
+def transcribe_segments(segments, backend, max_workers=4, retries=2, retry_delay=1.0):
+    # Transcribes the segments concurrently and returns the texts in order.
+    # A failed segment is retried on its own.
+    def transcribe(segment):
+        for attempt in range(retries + 1):
+            try:
+                return backend(segment)
+            except Exception as e:
+                if attempt == retries:
+                    raise
+                logger.error(f'Transcribing {segment} failed, retrying: {str(e)}')
+                time.sleep(retry_delay * (2 ** attempt))
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='segment') as executor:
+        return list(executor.map(propagate(transcribe), segments))
+
+
+def _words(text):
+    return [word.lower() for word in WORD_PATTERN.findall(text)]
+
+
+def stitch(texts, max_overlap_words=40):
+    """Joins segment texts, dropping the words the overlap transcribed twice.
+
+    The longest run of words that ends one text and starts the next is
+    removed from the start of the next text.
+    """
+    result = ''
+    previous = []
+    for text in texts:
+        text = text.strip()
+        words = _words(text)
+        overlap = 0
+        for size in range(min(len(previous), len(words), max_overlap_words), 0, -1):
+            if previous[-size:] == words[:size]:
+                overlap = size
+                break
+        if overlap:
+            # Cut the text right after its overlap-th word
+            match = list(WORD_PATTERN.finditer(text))[overlap - 1]
+            text = text[match.end():].lstrip(' \t\n.,;:!?-')
+        if text:
+            result = f'{result} {text}' if result else text
+        previous = words
+    return result
+
+
+def transcribe_audio(path, backend, window=600, overlap=5, max_workers=4, retries=2,
+                     max_upload_bytes=MAX_UPLOAD_BYTES, use_silence=True, directory=None):
+    """Transcribes an audio file with backend(path) -> text.
+
+    Files that fit one upload and one window go to the backend as they are.
+    Longer files are split into windows, written under directory, that are
+    transcribed in parallel and stitched back together in order.
+    """
+    duration = audio_duration(path)
+    if duration <= window and os.path.getsize(path) <= max_upload_bytes:
+        return backend(path)
+
+    # Keep every segment below the upload limit, assuming a constant bitrate
+    bytes_per_second = os.path.getsize(path) / max(duration, 1)
+    window = min(window, max(max_upload_bytes / bytes_per_second * 0.9, overlap * 4))
+
+    silences = silence_points(path) if use_silence else ()
+    windows = plan_windows(duration, window, overlap, silences)
+    logger.info(f'Transcribing {path} in {len(windows)} segments')
+
+    segment_directory = tempfile.mkdtemp(prefix='segments-', dir=directory)
+    try:
+        segments = split_audio(path, windows, segment_directory)
+        return stitch(transcribe_segments(segments, backend, max_workers=max_workers, retries=retries))
+    finally:
+        shutil.rmtree(segment_directory, ignore_errors=True)
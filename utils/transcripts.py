@@ -0,0 +1,110 @@
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger(__name__)
+
+
+class TranscriptCache(object):
+    """Transcripts keyed by YouTube video id and transcription parameters.
+
+    Transcripts are stored in the bucket under prefix and kept in an
+    in-memory LRU in front of it. Concurrent requests for a transcript that
+    is already being computed wait for that computation instead of
+    starting their own. on_store(key) is called for every transcript
+    written to the bucket.
+    """
+
+    def __init__(self, client, bucket, prefix='transcripts/', max_entries=256, on_store=None):
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+        self.max_entries = max_entries
+        self.on_store = on_store
+        self.stats = {'memory_hits': 0, 'bucket_hits': 0, 'misses': 0, 'shared': 0}
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config, client, bucket, on_store=None):
+        return cls(
+            client, bucket,
+            prefix=config.get('TRANSCRIPT_CACHE_PREFIX', 'transcripts/'),
+            max_entries=int(config.get('TRANSCRIPT_CACHE_ENTRIES', 256)),
+            on_store=on_store
+        )
+
+    def key(self, video_id, params):
+        digest = hashlib.sha256(json.dumps(params, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+        return f'{self.prefix}{video_id}/{digest}.txt'
+
+    def get_or_compute(self, video_id, params, compute):
+        # Returns the transcript and where it came from: memory, bucket,
+        # computed, or shared with a computation already in flight
+        key = self.key(video_id, params)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.stats['memory_hits'] += 1
+                return self._entries[key], 'memory'
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._inflight[key] = future
+            else:
+                self.stats['shared'] += 1
+
+        if not leader:
+            return future.result(), 'shared'
+
+        try:
+            transcript = self._load(key)
+            source = 'bucket'
+            if transcript is None:
+                transcript = compute()
+                source = 'computed'
+                self._store(key, video_id, transcript)
+            with self._lock:
+                self.stats['bucket_hits' if source == 'bucket' else 'misses'] += 1
+                self._remember(key, transcript)
+            future.set_result(transcript)
+            return transcript, source
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def _load(self, key):
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey'):
+                return None
+            raise
+        return response['Body'].read().decode('utf-8')
+
+    def _store(self, key, video_id, transcript):
+        try:
+            self.client.put_object(
+                Bucket=self.bucket, Key=key, Body=transcript.encode('utf-8'),
+                ContentType='text/plain; charset=utf-8', Metadata={'video-id': video_id})
+        except ClientError as e:
+            # The transcript is still returned and kept in memory
+            logger.error(f'Could not store transcript {key}: {str(e)}')
+            return
+        if self.on_store is not None:
+            self.on_store(key)
+
+    def _remember(self, key, transcript):
+        self._entries[key] = transcript
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
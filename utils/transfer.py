@@ -0,0 +1,91 @@
+import math
+import threading
+from contextlib import contextmanager
+from boto3.s3.transfer import TransferConfig
+
+MB = 1024 * 1024
+GB = 1024 * MB
+
+# S3 multipart limits
+MIN_PART_SIZE = 5 * MB
+MAX_PART_SIZE = 5 * GB
+MAX_PARTS = 10000
+
+# Streams of unknown length are planned as if they could be this large so
+# that they never run out of part numbers
+UNKNOWN_SIZE = 100 * GB
+
+
+class TransferPlanner(object):
+    """Chooses a TransferConfig per object from its size and current load.
+
+    Objects below the multipart threshold go out as a single request without
+    a thread pool. Larger objects get the smallest part size that keeps them
+    under S3's part limit, and their concurrency shares a process-wide budget
+    between the transfers in flight. Streamed reads are relayed to clients
+    in stream_chunk_size pieces.
+    """
+
+    def __init__(self, multipart_threshold=8 * MB, min_part_size=8 * MB,
+                 max_concurrency=10, total_concurrency=40, stream_chunk_size=256 * 1024):
+        self.multipart_threshold = max(multipart_threshold, MIN_PART_SIZE)
+        self.min_part_size = min(max(min_part_size, MIN_PART_SIZE), MAX_PART_SIZE)
+        self.max_concurrency = max(max_concurrency, 1)
+        self.total_concurrency = max(total_concurrency, 1)
+        self.stream_chunk_size = max(stream_chunk_size, 1024)
+        self._active = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        # Overrides read from .env.json, sizes in bytes
+        return cls(
+            multipart_threshold=int(config.get('TRANSFER_MULTIPART_THRESHOLD', 8 * MB)),
+            min_part_size=int(config.get('TRANSFER_MIN_PART_SIZE', 8 * MB)),
+            max_concurrency=int(config.get('TRANSFER_MAX_CONCURRENCY', 10)),
+            total_concurrency=int(config.get('TRANSFER_TOTAL_CONCURRENCY', 40)),
+            stream_chunk_size=int(config.get('TRANSFER_STREAM_CHUNK_SIZE', 256 * 1024))
+        )
+
+    @property
+    def active_transfers(self):
+        return self._active
+
+    def part_size(self, size):
+        if size is None:
+            size = UNKNOWN_SIZE
+        part_size = max(self.min_part_size, math.ceil(size / MAX_PARTS))
+        # Round up to a whole MiB to keep part boundaries aligned
+        part_size = math.ceil(part_size / MB) * MB
+        return min(part_size, MAX_PART_SIZE)
+
+    def plan(self, size):
+        if size is not None and size < self.multipart_threshold:
+            return TransferConfig(
+                multipart_threshold=self.multipart_threshold,
+                multipart_chunksize=self.min_part_size,
+                max_concurrency=1,
+                use_threads=False
+            )
+
+        part_size = self.part_size(size)
+        parts = MAX_PARTS if size is None else math.ceil(size / part_size)
+        share = max(1, self.total_concurrency // max(self._active, 1))
+        concurrency = max(1, min(parts, self.max_concurrency, share))
+        return TransferConfig(
+            multipart_threshold=self.multipart_threshold,
+            multipart_chunksize=part_size,
+            max_concurrency=concurrency,
+            use_threads=concurrency > 1
+        )
+
+    @contextmanager
+    def transfer(self, size):
+        # Counts the transfer as in flight while planning and running it
+        with self._lock:
+            self._active += 1
+        try:
+            yield self.plan(size)
+        finally:
+            with self._lock:
+                self._active -= 1
@@ -0,0 +1,122 @@
+import time
+import uuid
+import logging
+import sqlite3
+import threading
+
+from utils.config import data_path
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS upload_sessions (
+    id TEXT PRIMARY KEY,
+    bucket TEXT NOT NULL,
+    key TEXT NOT NULL,
+    upload_id TEXT NOT NULL,
+    part_size INTEGER NOT NULL,
+    size INTEGER,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS upload_sessions_updated ON upload_sessions (updated_at);
+CREATE TABLE IF NOT EXISTS upload_session_parts (
+    session_id TEXT NOT NULL,
+    part_number INTEGER NOT NULL,
+    etag TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    PRIMARY KEY (session_id, part_number)
+);
+'''
+
+
+class UploadSessionStore(object):
+    """Resumable upload sessions persisted in SQLite.
+
+    A session is an S3 multipart upload plus the ETags of the parts that
+    have been received, so a client can ask what is missing and carry on
+    after a dropped connection or a restart. Chunk data itself goes
+    straight to S3.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        if path != ':memory:':
+            self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(SCHEMA)
+        self._collector = None
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config.get('UPLOAD_SESSION_STORE_PATH') or data_path(config, 'upload_sessions.sqlite3'))
+
+    def create(self, bucket, key, upload_id, part_size, size=None):
+        session_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                'INSERT INTO upload_sessions (id, bucket, key, upload_id, part_size, size, created_at, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (session_id, bucket, key, upload_id, part_size, size, now, now))
+        return session_id
+
+    def get(self, session_id):
+        with self._lock:
+            row = self._conn.execute('SELECT * FROM upload_sessions WHERE id = ?', (session_id,)).fetchone()
+        return dict(row) if row else None
+
+    def set_size(self, session_id, size):
+        # Fixes the size of a session created without one, once its last
+        # chunk has arrived
+        with self._lock:
+            self._conn.execute('UPDATE upload_sessions SET size = ?, updated_at = ? WHERE id = ?',
+                               (size, time.time(), session_id))
+
+    def add_part(self, session_id, part_number, etag, size):
+        # A chunk sent again replaces the earlier one, as UploadPart does
+        with self._lock:
+            self._conn.execute(
+                'INSERT INTO upload_session_parts (session_id, part_number, etag, size) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT (session_id, part_number) DO UPDATE SET etag = excluded.etag, size = excluded.size',
+                (session_id, part_number, etag, size))
+            self._conn.execute('UPDATE upload_sessions SET updated_at = ? WHERE id = ?',
+                               (time.time(), session_id))
+
+    def parts(self, session_id):
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT part_number, etag, size FROM upload_session_parts WHERE session_id = ? '
+                'ORDER BY part_number', (session_id,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def delete(self, session_id):
+        with self._lock:
+            self._conn.execute('DELETE FROM upload_session_parts WHERE session_id = ?', (session_id,))
+            self._conn.execute('DELETE FROM upload_sessions WHERE id = ?', (session_id,))
+
+    def expired(self, ttl):
+        # Sessions that have not received a chunk for ttl seconds
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT * FROM upload_sessions WHERE updated_at < ?', (time.time() - ttl,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def start_collector(self, abort, ttl, interval):
+        # Every interval seconds, abort(session) the sessions idle for ttl
+        # seconds and forget them. Sessions whose abort fails are retried.
+        def run():
+            while True:
+                for session in self.expired(ttl):
+                    try:
+                        abort(session)
+                        self.delete(session['id'])
+                        logger.info(f"Collected abandoned upload session {session['id']}")
+                    except Exception as e:
+                        logger.error(f"Could not collect upload session {session['id']}: {str(e)}")
+                time.sleep(interval)
+
+        self._collector = threading.Thread(target=run, name='upload-sessions', daemon=True)
+        self._collector.start()
@@ -1,8 +1,11 @@
 import re
 import os
-from pytube import YouTube
-import moviepy.editor as mp
-from openai import OpenAI
+import time
+import threading
+import subprocess
+import imageio_ffmpeg
+from utils.transcription import transcribe_audio
+from utils.timing import timed
 import logging
 
 def get_youtube_id(url):
@@ -18,49 +21,158 @@ def get_youtube_id(url):
     else:
         return None
 
-def download_yt(url):
+# Containers the transcription API accepts as they are
+WHISPER_FORMATS = {'flac', 'm4a', 'mp3', 'mp4', 'mpeg', 'mpga', 'oga', 'ogg', 'wav', 'webm'}
+
+
+def needs_conversion(file_name):
+    return os.path.splitext(file_name)[1].lstrip('.').lower() not in WHISPER_FORMATS
+
+
+@timed('yt-download')
+def download_yt_audio(url, directory='/tmp', reserve=None):
+    # pytube is only imported when a video is downloaded. reserve(nbytes),
+    # when given, is called with the size of the stream before it is fetched
+    from pytube import YouTube
+    from pytube.request import stream as stream_url
+
     yt = YouTube(url)
     unique_file_name = get_youtube_id(url)
-    logging.info("Downloading ", unique_file_name)
-    file_name = '/tmp/' + unique_file_name + '.mp4'
+    logging.info(f"Downloading {unique_file_name}")
     # Select the best audio stream
     audio_stream = yt.streams.filter(only_audio=True).first()
 
-    # Download the audio stream to a temporary file
-    audio_stream.download(filename=file_name)
-    logging.info("file downloaded")
-    # Convert the downloaded file to MP3
-    clip = mp.AudioFileClip(file_name)
-    mp3_file = "/tmp/" + unique_file_name + ".mp3"
-    clip.write_audiofile(mp3_file)
+    if reserve is not None:
+        reserve(audio_stream.filesize or 0)
+
+    # Audio-only mp4 streams are m4a files
+    extension = 'm4a' if audio_stream.subtype == 'mp4' else audio_stream.subtype
+    if extension in WHISPER_FORMATS:
+        # Fast path: the downloaded container goes to transcription as it is
+        file_name = os.path.join(directory, unique_file_name + '.' + extension)
+        audio_stream.download(filename=file_name)
+        logging.info("file downloaded")
+        return file_name
+
+    # Anything else is transcoded while it downloads, without an
+    # intermediate file
+    mp3_file = os.path.join(directory, unique_file_name + '.mp3')
+    transcode_to_mp3(stream_url(audio_stream.url), mp3_file)
+    logging.info("file downloaded and transcoded")
+    return mp3_file
 
-    logging.info("MP3 downloaded")
 
-    # Remove the temporary MP4 file
-    clip.close()
+@timed('ffmpeg')
+def transcode_to_mp3(source, mp3_file):
+    # Transcodes with ffmpeg into an MP3 file. source is a local path, or an
+    # iterable of byte chunks that is piped in as it arrives.
+    piped = not isinstance(source, str)
+    process = subprocess.Popen(
+        [imageio_ffmpeg.get_ffmpeg_exe(), '-y', '-loglevel', 'error', '-i', 'pipe:0' if piped else source,
+         '-vn', '-c:a', 'libmp3lame', '-b:a', '64k', mp3_file],
+        stdin=subprocess.PIPE if piped else subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if piped:
+        try:
+            for chunk in source:
+                process.stdin.write(chunk)
+        except BrokenPipeError:
+            pass
+        finally:
+            process.stdin.close()
+    error = process.stderr.read()
+    if process.wait() != 0:
+        raise RuntimeError(f"ffmpeg failed: {error.decode('utf-8', 'replace').strip()}")
     return mp3_file
-            
 
-def transcript_yt(filepath):
-    # Create OpenAI Connection
-    client = OpenAI()
-    client.api_key  = os.environ['OPENAI_API_KEY']
-    audio_file= open(filepath, "rb")
+
+def convert_to_mp3(file_name):
+    # Fallback for local files the transcription API does not accept
+    mp3_file = os.path.splitext(file_name)[0] + ".mp3"
+    transcode_to_mp3(file_name, mp3_file)
+    logging.info("MP3 converted")
+
+    # Remove the source file
+    os.remove(file_name)
+    return mp3_file
+
+
+def playlist_video_urls(url):
+    from pytube import Playlist
+    return list(Playlist(url).video_urls)
+
+
+# Parameters of the Whisper call, part of the transcript cache key
+TRANSCRIPTION_PARAMS = {
+    'model': 'whisper-1',
+    'language': 'en',
+    'prompt': 'Can you interpret,explain, add a metaphor and summarize',
+    'response_format': 'text'
+}
+
+
+# One OpenAI client, and so one HTTP connection pool, shared by all threads
+_openai_client = None
+_openai_lock = threading.Lock()
+_openai_stats = {'clients': 0, 'requests': 0, 'in_flight': 0, 'request_seconds': 0.0}
+
+
+def get_openai_client():
+    global _openai_client
+    with _openai_lock:
+        if _openai_client is None:
+            # Importing openai takes most of the boot time, it happens on
+            # the first transcription
+            from openai import OpenAI
+
+            # Create OpenAI Connection
+            _openai_client = OpenAI(api_key=os.environ['OPENAI_API_KEY'])
+            _openai_stats['clients'] += 1
+        return _openai_client
+
+
+def preload_transcription():
+    # Pays the import cost of the transcription stack up front
+    import pytube  # noqa: F401
+    get_openai_client()
+
+
+def openai_client_stats():
+    with _openai_lock:
+        stats = dict(_openai_stats)
+    stats['request_seconds'] = round(stats['request_seconds'], 3)
+    return stats
+
+
+@timed('whisper')
+def transcribe_file(filepath, params=None):
+    client = get_openai_client()
     logging.info("transcripting")
-    transcript = client.audio.transcriptions.create(
-                model="whisper-1",
-
-                file=audio_file,
-                language="en",
-                prompt="Can you interpret,explain, add a metaphor and summarize",
-                response_format="text"
-                )
+    with _openai_lock:
+        _openai_stats['in_flight'] += 1
+    started = time.monotonic()
+    try:
+        with open(filepath, "rb") as audio_file:
+            transcript = client.audio.transcriptions.create(
+                        file=audio_file,
+                        **(params or TRANSCRIPTION_PARAMS)
+                        )
+    finally:
+        with _openai_lock:
+            _openai_stats['in_flight'] -= 1
+            _openai_stats['requests'] += 1
+            _openai_stats['request_seconds'] += time.monotonic() - started
     return transcript
 
+
+def transcript_yt(filepath, params=None, **segment_options):
+    # Long files are split and their segments transcribed concurrently,
+    # see utils.transcription.transcribe_audio for segment_options
+    return transcribe_audio(filepath, lambda path: transcribe_file(path, params), **segment_options)
+
 # Example usage
 # url = 'https://www.youtube.com/watch?v=5hMgUbmrENM'
 # video_id = get_youtube_id(url)
 
-# print(transcript_yt(download_yt(url)))
+# print(transcript_yt(download_yt_audio(url, directory)))
 
 # print(f'The video ID is: {video_id}')
\ No newline at end of file
@@ -0,0 +1,79 @@
+import io
+import time
+import zipfile
+
+from utils.compression import DEFAULT_MIME_TYPES
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only, unseekable file that collects what zipfile writes.
+
+    zipfile sees that it cannot seek and writes each entry's sizes and CRC
+    in a data descriptor after its data, so nothing has to be rewritten.
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+class ZipEntry(object):
+    """A file of the archive: its name, contents as an iterable of byte
+    chunks, and its size and modification time when they are known."""
+
+    def __init__(self, name, chunks, size=None, last_modified=None, mime_type=None):
+        self.name = name
+        self.chunks = chunks
+        self.size = size
+        self.last_modified = last_modified
+        self.mime_type = mime_type
+
+
+def compress_type(mime_type):
+    # Deflate text-like files, store the rest, which is usually compressed already
+    if mime_type and any(mime_type.startswith(prefix) for prefix in DEFAULT_MIME_TYPES):
+        return zipfile.ZIP_DEFLATED
+    return zipfile.ZIP_STORED
+
+
+def member_name(name):
+    # S3 keys can start with / or hold .. segments, which would extract
+    # outside the target directory; both are dropped from the member name,
+    # and backslashes are taken as separators, as Windows tools do
+    parts = [part for part in name.replace('\\', '/').split('/') if part not in ('', '.', '..')]
+    return '/'.join(parts) or 'unnamed'
+
+
+def zip_chunks(entries):
+    # Yields a ZIP archive of the entries as it is written. Only the
+    # current chunk and the central directory records are held in memory.
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, 'w') as archive:
+        for entry in entries:
+            date_time = (entry.last_modified.timetuple() if entry.last_modified is not None
+                         else time.localtime())[:6]
+            info = zipfile.ZipInfo(member_name(entry.name), date_time=max(date_time, (1980, 1, 1, 0, 0, 0)))
+            info.compress_type = compress_type(entry.mime_type)
+            info.file_size = entry.size or 0
+            # Sizes that are not known up front may need ZIP64 fields
+            with archive.open(info, 'w', force_zip64=entry.size is None) as member:
+                for chunk in entry.chunks:
+                    member.write(chunk)
+                    data = sink.drain()
+                    if data:
+                        yield data
+            data = sink.drain()
+            if data:
+                yield data
+    yield sink.drain()